@@ -0,0 +1,218 @@
+import sys
+import pickle
+import tempfile
+
+
+AGGREGATE_FUNCTIONS = ('count', 'sum', 'avg', 'min', 'max')
+
+# SUM и AVG считаются только по числовым колонкам
+NUMERIC_FUNCTIONS = ('sum', 'avg')
+
+# сколько первых групп берём, чтобы оценить размер группы в памяти
+SAMPLE_GROUPS = 256
+
+# на сколько файлов делятся группы при сбросе на диск
+SPILL_PARTITIONS = 16
+
+
+class HashAggregator:
+    """
+    Потоковая хэш-агрегация за один проход: группа -> плоский список частичных
+    состояний (count: число, sum/min/max: значение или None, avg: сумма и число
+    в двух соседних ячейках). Частичные состояния из разных диапазонов таблицы
+    складываются через merge(), поэтому агрегацию можно считать по частям
+    в разных процессах. Если групп становится больше, чем помещается
+    в memory_bytes, они сбрасываются во временные файлы по хэшу ключа
+    и сливаются по одному файлу в конце.
+    """
+
+    def __init__(self, group_size: int, aggregates: list, memory_bytes: int = 64 * 1024 * 1024, spill_dir: str = None):
+        """
+        group_size — сколько первых значений строки образуют ключ группы.
+        aggregates — пары (функция, позиция значения в строке); для COUNT(*) позиция None.
+        memory_bytes=None — без ограничения памяти.
+        """
+        self.group_size = group_size
+        self.aggregates = aggregates
+        self.memory_bytes = memory_bytes
+        self.spill_dir = spill_dir
+        self.groups = {}
+        self.max_groups = None
+        self.spilled = 0
+        self._files = None
+
+        # (функция, ячейка состояния, позиция значения в строке)
+        self._slots = []
+        self._template = []
+        for function, pos in aggregates:
+            self._slots.append((function, len(self._template), pos))
+            if function == 'count':
+                self._template.append(0)
+            elif function == 'avg':
+                self._template.extend((0, 0))
+            else:
+                self._template.append(None)
+
+    def add_rows(self, rows):
+        """
+        Добавляет строки-кортежи: сначала значения ключа, затем входы агрегатов.
+        """
+        groups = self.groups
+        group_size = self.group_size
+        slots = self._slots
+        template = self._template
+        limit = self.max_groups or SAMPLE_GROUPS
+
+        for row in rows:
+            key = row[:group_size]
+            states = groups.get(key)
+            if states is None:
+                if len(groups) >= limit:
+                    self._check_memory()
+                    groups = self.groups
+                    limit = self.max_groups
+                states = groups[key] = template.copy()
+
+            for function, i, pos in slots:
+                if pos is None:
+                    states[i] += 1
+                    continue
+                value = row[pos]
+                if function == 'sum':
+                    states[i] = value if states[i] is None else states[i] + value
+                elif function == 'avg':
+                    states[i] += value
+                    states[i + 1] += 1
+                elif function == 'count':
+                    if value != '':
+                        states[i] += 1
+                elif function == 'min':
+                    if states[i] is None or value < states[i]:
+                        states[i] = value
+                elif states[i] is None or value > states[i]:
+                    states[i] = value
+
+    def merge(self, partial: dict):
+        """
+        Добавляет частичные состояния {ключ: состояния}, посчитанные отдельно.
+        """
+        for key, states in partial.items():
+            current = self.groups.get(key)
+            if current is None:
+                if len(self.groups) >= (self.max_groups or SAMPLE_GROUPS):
+                    self._check_memory()
+                self.groups[key] = states
+            else:
+                self._merge_states(current, states)
+
+    def new_states(self) -> list:
+        """
+        Начальные состояния агрегатов для новой группы.
+        """
+        return self._template.copy()
+
+    def results(self):
+        """
+        Генератор пар (ключ группы, значения агрегатов).
+        """
+        try:
+            if self._files is None:
+                for key, states in self.groups.items():
+                    yield key, self._finish(states)
+                return
+
+            # группы из памяти раскладываем по тем же файлам и сливаем файл за файлом
+            self._spill()
+            for f in self._files:
+                f.seek(0)
+                merged = {}
+                for partial in _read_chunks(f):
+                    for key, states in partial:
+                        current = merged.get(key)
+                        if current is None:
+                            merged[key] = states
+                        else:
+                            self._merge_states(current, states)
+                for key, states in merged.items():
+                    yield key, self._finish(states)
+        finally:
+            self.close()
+
+    def close(self):
+        if self._files is not None:
+            for f in self._files:
+                f.close()
+            self._files = None
+
+    def _merge_states(self, current: list, states: list):
+        for function, i, _ in self._slots:
+            value = states[i]
+            if function == 'count':
+                current[i] += value
+            elif function == 'avg':
+                current[i] += value
+                current[i + 1] += states[i + 1]
+            elif value is None:
+                continue
+            elif current[i] is None:
+                current[i] = value
+            elif function == 'sum':
+                current[i] += value
+            elif function == 'min':
+                current[i] = min(current[i], value)
+            else:
+                current[i] = max(current[i], value)
+
+    def _finish(self, states: list) -> list:
+        values = []
+        for function, i, _ in self._slots:
+            if function == 'avg':
+                values.append(states[i] / states[i + 1] if states[i + 1] else None)
+            else:
+                values.append(states[i])
+        return values
+
+    def _check_memory(self):
+        if self.memory_bytes is None:
+            self.max_groups = sys.maxsize
+        elif self.max_groups is None:
+            # размер группы оцениваем по первым группам, дальше считаем только их число
+            sample = list(self.groups.items())[:SAMPLE_GROUPS]
+            group_size = sum(_group_size(key, states) for key, states in sample) / len(sample)
+            self.max_groups = max(SAMPLE_GROUPS, int(self.memory_bytes / group_size))
+
+        if len(self.groups) >= self.max_groups:
+            self._spill()
+
+    def _spill(self):
+        if self._files is None:
+            self._files = [tempfile.TemporaryFile(dir=self.spill_dir) for _ in range(SPILL_PARTITIONS)]
+
+        partitions = [[] for _ in range(SPILL_PARTITIONS)]
+        for item in self.groups.items():
+            partitions[hash(item[0]) % SPILL_PARTITIONS].append(item)
+        for f, items in zip(self._files, partitions):
+            if items:
+                f.seek(0, 2)
+                pickle.dump(items, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self.groups = {}
+        self.spilled += 1
+
+
+def _read_chunks(f):
+    while True:
+        try:
+            yield pickle.load(f)
+        except EOFError:
+            return
+
+
+def _group_size(key: tuple, states: list) -> int:
+    """
+    Примерный размер группы в памяти, в байтах (ключ, состояния и место в словаре).
+    """
+    size = sys.getsizeof(key) + sum(map(sys.getsizeof, key)) + sys.getsizeof(states) + 100
+    for state in states:
+        size += sys.getsizeof(state)
+    return size
@@ -0,0 +1,246 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from server import Server, ClientHandler
+from wire import unpack_frame_header
+
+try:
+    import resource
+except ImportError:      # на Windows модуля нет
+    resource = None
+
+
+class AsyncServer(Server):
+    """
+    Сервер на asyncio: все соединения обслуживает один цикл событий,
+    а выполнение команд уходит в пул потоков. Простаивающий клиент
+    не занимает поток, поэтому сервер держит тысячи соединений.
+    Протокол и набор команд те же, что у Server, остальные параметры
+    (kwargs) передаются в Server без изменений.
+    """
+
+    def __init__(
+            self,
+            database_path='./data',
+            host='localhost',
+            port=7777,
+            backlog=4096,
+            handler_threads=32,
+            **kwargs
+        ):
+        # потоки, в которых выполняются команды; сами запросы ограничивает QueryScheduler,
+        # а ожидание медленных клиентов идёт в цикле событий и потоков не занимает
+        self.handler_threads = handler_threads
+        self.loop = None
+        self.executor = None
+        super().__init__(database_path=database_path, host=host, port=port, backlog=backlog, **kwargs)
+
+    def create_socket(self):
+        # слушающий сокет создаёт asyncio.start_server
+        return None
+
+    def start(self):
+        self.catalog.start()
+        self.start_cache_warmup()
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            self.logger.log("ERROR", f"Ошибка запуска сервера: {e}")
+        finally:
+            self.shutdown()
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.handler_threads, thread_name_prefix='handler')
+        self._raise_fd_limit()
+
+        server = await asyncio.start_server(
+            self.accept_connection,
+            host=self.host,
+            port=self.port,
+            backlog=self.backlog,
+            reuse_address=True
+        )
+        self.logger.log("INFO", f"Асинхронный сервер запущен на {self.host}:{self.port}")
+
+        async with server:
+            await server.serve_forever()
+
+    async def accept_connection(self, reader, writer):
+        handler = AsyncClientHandler(
+            reader=reader,
+            writer=writer,
+            loop=self.loop,
+            executor=self.executor,
+            **self.handler_kwargs()
+        )
+        await handler.handle_async()
+
+    def shutdown(self):
+        self.logger.log("INFO", "Завершение работы сервера...")
+        self.catalog.stop()
+        self.query_executor.close()
+        self.cache_manager.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def _raise_fd_limit(self):
+        """
+        Поднимает мягкий лимит открытых файлов до жёсткого:
+        каждое соединение — это дескриптор.
+        """
+        if resource is None:
+            return
+        try:
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if hard == resource.RLIM_INFINITY or hard > soft:
+                target = 65536 if hard == resource.RLIM_INFINITY else hard
+                resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, target), hard))
+        except (ValueError, OSError) as e:
+            self.logger.log("WARNING", f"Не удалось поднять лимит дескрипторов: {e}")
+
+
+class AsyncClientHandler(ClientHandler):
+    """
+    Обработчик клиента для AsyncServer. Кадры читаются в цикле событий,
+    команды выполняются в пуле потоков теми же методами, что у ClientHandler.
+    Поток пула не ждёт клиента: кадры ответа уходят в цикл событий, drain()
+    ждётся там после команды, а потоковый ответ (send_stream) цикл событий
+    отправляет сам, забирая из пула по одному готовому кадру.
+    """
+
+    def __init__(self, reader, writer, loop, executor, **kwargs):
+        super().__init__(conn=None, addr=writer.get_extra_info('peername'), **kwargs)
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.executor = executor
+
+    async def recv_message_async(self) -> str:
+        """
+        Принимает сообщение с префиксом длины (4 байта), старший бит — сжатие.
+        """
+        return (await self.recv_request_async())[1]
+
+    async def recv_request_async(self) -> tuple:
+        """
+        (номер запроса, сообщение), как ClientHandler.recv_request.
+        """
+        try:
+            length, compressed = unpack_frame_header(await self.reader.readexactly(4))
+            data = await self.reader.readexactly(length)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None, None
+        return self._parse_request(data, compressed)
+
+    def send_frame(self, data: bytes):
+        """
+        Вызывается из потока пула: передаёт кадр циклу событий, не дожидаясь отправки.
+        Кадры одного потока уходят в том порядке, в каком переданы.
+        """
+        self.loop.call_soon_threadsafe(self.writer.write, self._pack(data))
+
+    def send_stream(self, rows, cached: bool, cache_entry: tuple = None, queue_wait: float = None):
+        """
+        Откладывает потоковый ответ: его отправит run_command в цикле событий,
+        а поток пула сразу освободится.
+        """
+        frames = self.stream_frames(rows, cached, cache_entry, queue_wait)
+        self._request.stream = (getattr(self._request, 'id', None), frames)
+
+    async def run_in_executor(self, func, *args):
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    async def run_command(self, func, *args):
+        """
+        Выполняет func(*args) в пуле потоков и дожидается отправки ответа:
+        обычные кадры уже переданы циклу, остаётся drain(); потоковый ответ
+        отправляется здесь кадр за кадром.
+        """
+        result, stream = await self.run_in_executor(self._call, func, *args)
+        if stream is not None:
+            await self._send_frames(*stream)
+        await self.writer.drain()
+        return result
+
+    def _call(self, func, *args) -> tuple:
+        self._request.stream = None
+        try:
+            return func(*args), self._request.stream
+        finally:
+            self._request.stream = None
+
+    async def _send_frames(self, request_id, frames):
+        try:
+            while True:
+                # кадр собирается (и сжимается) в пуле, цикл событий только пишет в сокет
+                frame = await self.run_in_executor(self._next_frame, request_id, frames)
+                if frame is None:
+                    return
+                self.writer.write(frame)
+                await self.writer.drain()
+        finally:
+            frames.close()
+
+    def _next_frame(self, request_id, frames):
+        self._request.id = request_id
+        try:
+            data = next(frames, None)
+            return None if data is None else self._pack(data)
+        finally:
+            self._request.id = None
+
+    async def handle_async(self):
+        try:
+            self.logger.log("INFO", f"Клиент подключен: {self.addr}")
+
+            # аутентификация
+            auth_data = await self.recv_message_async()
+            if not auth_data:
+                self.logger.log("ERROR", "Не удалось получить аутентификационные данные")
+                return
+
+            if not await self.run_command(self.authenticate_client, auth_data):
+                return
+
+            # основной цикл обработки команд; команды конвейера выполняются
+            # параллельно, не больше max_in_flight сразу
+            in_flight = asyncio.Semaphore(self.max_in_flight)
+            requests = set()
+            while True:
+                request_id, msg = await self.recv_request_async()
+                if not msg:
+                    break
+                if request_id is None:
+                    if not await self.run_command(self.process_command, msg):
+                        break
+                    continue
+                if msg.strip().upper() == "EXIT":
+                    break
+                await in_flight.acquire()
+                task = self.loop.create_task(self._run_request(in_flight, request_id, msg))
+                requests.add(task)
+                task.add_done_callback(requests.discard)
+
+            # дожидаемся ответов на уже принятые команды
+            if requests:
+                await asyncio.gather(*requests, return_exceptions=True)
+
+        except Exception as e:
+            self.logger.log("ERROR", f"Ошибка при обработке клиента {self.addr}: {e}")
+
+        finally:
+            self.logger.log("INFO", f"Клиент отключен: {self.addr}")
+            self.close()
+
+    async def _run_request(self, in_flight: asyncio.Semaphore, request_id: int, msg: str):
+        try:
+            await self.run_command(self.process_request, request_id, msg)
+        except Exception as e:
+            self.logger.log("ERROR", f"Ошибка при обработке запроса {request_id} от {self.addr}: {e}")
+        finally:
+            in_flight.release()
+
+    def close(self):
+        self.close_copies()
+        self.writer.close()
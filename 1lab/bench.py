@@ -0,0 +1,846 @@
+"""
+Бенчмарки движка 1lab. Запуск из папки 1lab:
+
+    python bench.py parallel --rows 2000000
+    python bench.py compiled --rows 1000000
+    python bench.py compound --rows 1000000
+    python bench.py limit --rows 1000000
+    python bench.py order --rows 1000000
+    python bench.py aggregate --rows 1000000
+    python bench.py zonemap --rows 1000000
+    python bench.py join --rows 1000000
+    python bench.py wire --rows 1000000
+    python bench.py compression --rows 1000000
+    python bench.py pipeline --rows 100000 --rtt 2
+    python bench.py sharedscan --rows 300000 --clients 50
+    python bench.py catalog --tables 2000
+    python bench.py schema --rows 1000000
+    python bench.py vector --rows 10000000
+    python bench.py write --rows 1000000
+    python bench.py diskcache --rows 1000000
+"""
+import io
+import os
+import csv
+import json
+import time
+import queue
+import random
+import shutil
+import socket
+import logging
+import hashlib
+import argparse
+import tempfile
+import threading
+from itertools import compress
+
+import storage
+from storage import ColumnStore
+from schema import SCHEMA_FILE
+from cache import CacheManager, DiskCache
+from server import Server, SQLParser, QueryExecutor, DatabaseStructureBuilder
+from catalog import Catalog
+from client import Client
+from parallel import ParallelScanner
+from planner import OPERATORS, compile_predicate
+from stats import StatsManager
+from sharedscan import SharedScanner
+from vectorized import VectorEngine
+from writer import CopySession
+from wire import encode_rows, decode_rows, pack_frame, unpack_frame_header, frame_body
+
+
+def make_table(db_path: str, name: str, rows: int, seed: int = 42):
+    """
+    Генерирует таблицу id,name,age,salary,department.
+    """
+    rnd = random.Random(seed)
+    departments = ['HR', 'Engineering', 'Marketing', 'Sales', 'Support']
+
+    table_dir = os.path.join(db_path, name)
+    os.makedirs(table_dir, exist_ok=True)
+    with open(os.path.join(table_dir, 'table.csv'), 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'name', 'age', 'salary', 'department'])
+        for i in range(rows):
+            writer.writerow([i, f'user{i}', rnd.randint(18, 65), rnd.randint(20000, 150000), rnd.choice(departments)])
+
+
+def best_time(func, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def bench_parallel(args):
+    """
+    Скорость полного скана в зависимости от числа процессов.
+    """
+    query = SQLParser().parse('SELECT id, salary FROM people WHERE salary > 140000')
+    counts = sorted({1, 2, 4, os.cpu_count() or 1})
+
+    with tempfile.TemporaryDirectory() as db_path:
+        make_table(db_path, 'people', args.rows)
+        print(f'Строк: {args.rows}, ядер: {os.cpu_count()}')
+
+        baseline = None
+        for processes in counts:
+            executor = QueryExecutor(db_path, parallel_scanner=ParallelScanner(processes=processes, threshold=0))
+            try:
+                executor.execute(query)     # прогрев: сборка колонок и запуск пула
+                seconds = best_time(lambda: executor.execute(query), args.repeat)
+            finally:
+                executor.close()
+
+            baseline = baseline or seconds
+            print(f'  процессов: {processes:>2}  {seconds * 1000:9.1f} мс  ускорение x{baseline / seconds:.2f}')
+
+
+def interpret(table, query: dict) -> list:
+    """
+    Прежнее построчное выполнение: оператор ищется в словаре,
+    float() вызывается на каждой строке, проекция собирается заново.
+    """
+    columns = query['columns']
+    condition = query['condition']
+    names = table.columns if columns == ['*'] else [col for col in columns if col in table.types]
+
+    result = []
+    for i in range(table.row_count):
+        if condition:
+            op_func = OPERATORS.get(condition['operator'])
+            row_val = table.column(condition['column'])[i]
+            value = condition['value']
+            try:
+                row_val = float(row_val)
+                value = float(value)
+            except ValueError: pass
+            if not op_func(row_val, value): continue
+        result.append({name: table.column(name)[i] for name in names})
+    return result
+
+
+def bench_compiled(args):
+    """
+    Строк в секунду: построчная интерпретация против скомпилированного плана.
+    """
+    queries = [
+        'SELECT * FROM people',
+        'SELECT id, salary FROM people WHERE salary > 100000',
+        'SELECT name FROM people WHERE age = 30',
+        "SELECT id FROM people WHERE name = 'user777'"
+    ]
+
+    with tempfile.TemporaryDirectory() as db_path:
+        make_table(db_path, 'people', args.rows)
+        executor = QueryExecutor(db_path, parallel_scanner=ParallelScanner(processes=1))
+        table = executor.column_store.open('people')
+        print(f'Строк: {args.rows}')
+
+        def compiled(query):
+            # план напрямую, без индексов — сравниваем именно выполнение скана
+            names = table.columns if query['columns'] == ['*'] else query['columns']
+            return list(executor.compile(query, table, names).scan(table, 0, table.row_count))
+
+        for raw in queries:
+            query = SQLParser().parse(raw)
+            assert interpret(table, query) == compiled(query)
+
+            before = best_time(lambda: interpret(table, query), args.repeat)
+            after = best_time(lambda: compiled(query), args.repeat)
+            print(f'  {raw}')
+            print(f'    построчно: {args.rows / before:12,.0f} строк/с   план: {args.rows / after:12,.0f} строк/с   x{before / after:.1f}')
+
+
+def evaluate_all(table, condition: dict, types: dict):
+    """
+    Составное условие без упорядочивания и отсечения:
+    каждое сравнение считается на каждой строке, затем маски объединяются.
+    """
+    op = condition['operator']
+    if op in ('and', 'or'):
+        masks = [evaluate_all(table, arg, types) for arg in condition['args']]
+        combine = all if op == 'and' else any
+        return [combine(bits) for bits in zip(*masks)]
+    if op == 'not':
+        return [not bit for bit in evaluate_all(table, condition['args'][0], types)]
+    return list(map(compile_predicate(condition, types), table.column(condition['column'])))
+
+
+def bench_compound(args):
+    """
+    Составные WHERE: полное вычисление каждого условия против
+    дерева фильтров с порядком по избирательности и отсечением.
+    """
+    queries = [
+        "SELECT id FROM people WHERE salary > 100000 AND age = 30 AND id >= 1000",
+        "SELECT id FROM people WHERE salary > 20000 OR age BETWEEN 20 AND 30",
+        "SELECT id FROM people WHERE age IN (20, 30, 40) AND NOT department IN ('sales', 'support')"
+    ]
+
+    with tempfile.TemporaryDirectory() as db_path:
+        make_table(db_path, 'people', args.rows)
+        executor = QueryExecutor(db_path, parallel_scanner=ParallelScanner(processes=1))
+        table = executor.column_store.open('people')
+        print(f'Строк: {args.rows}')
+
+        for raw in queries:
+            query = SQLParser().parse(raw)
+            plan = executor.compile(query, table, query['columns'])
+
+            def full():
+                mask = evaluate_all(table, query['condition'], table.types)
+                return list(plan.take(table, compress(range(table.row_count), mask)))
+
+            def compiled():
+                return list(plan.scan(table, 0, table.row_count))
+
+            assert full() == compiled()
+            before = best_time(full, args.repeat)
+            after = best_time(compiled, args.repeat)
+            print(f'  {raw}')
+            print(f'    полностью: {before * 1000:9.1f} мс   с отсечением: {after * 1000:9.1f} мс   x{before / after:.1f}')
+
+
+def bench_limit(args):
+    """
+    Время первых строк: запрос без LIMIT против LIMIT 10 с остановкой скана.
+    """
+    queries = [
+        'SELECT * FROM people',
+        'SELECT id, name FROM people WHERE salary > 140000',
+        'SELECT id FROM people WHERE age = 30 AND salary > 100000'
+    ]
+
+    with tempfile.TemporaryDirectory() as db_path:
+        make_table(db_path, 'people', args.rows)
+        executor = QueryExecutor(db_path, parallel_scanner=ParallelScanner(processes=1))
+        executor.execute(SQLParser().parse('SELECT id FROM people LIMIT 1'))     # прогрев: сборка колонок
+        print(f'Строк: {args.rows}')
+
+        for raw in queries:
+            full = SQLParser().parse(raw)
+            limited = SQLParser().parse(raw + ' LIMIT 10 OFFSET 5')
+            assert executor.execute(limited) == executor.execute(full)[5:15]
+
+            before = best_time(lambda: executor.execute(full), args.repeat)
+            after = best_time(lambda: executor.execute(limited), args.repeat)
+            print(f'  {raw}')
+            print(f'    без LIMIT: {before * 1000:9.1f} мс   LIMIT 10 OFFSET 5: {after * 1000:9.3f} мс')
+
+
+def bench_order(args):
+    """
+    ORDER BY: сортировка на стороне клиента, top-k куча при LIMIT
+    и внешняя сортировка с маленьким бюджетом памяти.
+    """
+    with tempfile.TemporaryDirectory() as db_path:
+        make_table(db_path, 'people', args.rows)
+        executor = QueryExecutor(db_path, parallel_scanner=ParallelScanner(processes=1), sort_memory_bytes=2 ** 40)
+        spilling = QueryExecutor(db_path, parallel_scanner=ParallelScanner(processes=1), sort_memory_bytes=16 * 1024 * 1024)
+        plain = SQLParser().parse('SELECT id, salary FROM people')
+        executor.execute(plain)     # прогрев: сборка колонок
+        print(f'Строк: {args.rows}')
+
+        def client_side():
+            return sorted(executor.execute(plain), key=lambda row: row['salary'], reverse=True)[:10]
+
+        top = SQLParser().parse('SELECT id, salary FROM people ORDER BY salary DESC LIMIT 10')
+        assert executor.execute(top) == client_side()
+
+        full = SQLParser().parse('SELECT id, salary FROM people ORDER BY salary DESC')
+        assert spilling.execute(full) == executor.execute(full)
+
+        print(f'  все строки + sorted()[:10]: {best_time(client_side, args.repeat) * 1000:9.1f} мс')
+        print(f'  ORDER BY ... LIMIT 10:       {best_time(lambda: executor.execute(top), args.repeat) * 1000:9.1f} мс')
+        print(f'  ORDER BY в памяти:           {best_time(lambda: executor.execute(full), args.repeat) * 1000:9.1f} мс')
+        print(f'  ORDER BY, бюджет 16 МБ:      {best_time(lambda: spilling.execute(full), args.repeat) * 1000:9.1f} мс')
+
+
+def bench_aggregate(args):
+    """
+    GROUP BY: выборка всех строк и подсчёт на клиенте против агрегации на сервере
+    (в одном процессе, в пуле процессов и со сбросом групп на диск).
+    """
+    query = SQLParser().parse('SELECT department, COUNT(*), AVG(salary), MAX(age) FROM people GROUP BY department')
+    groups = SQLParser().parse('SELECT id, COUNT(*) FROM people GROUP BY id')
+    plain = SQLParser().parse('SELECT department, salary, age FROM people')
+
+    with tempfile.TemporaryDirectory() as db_path:
+        make_table(db_path, 'people', args.rows)
+        serial = QueryExecutor(db_path, parallel_scanner=ParallelScanner(processes=1))
+        parallel = QueryExecutor(db_path, parallel_scanner=ParallelScanner(threshold=0))
+        spilling = QueryExecutor(db_path, parallel_scanner=ParallelScanner(processes=1), aggregate_memory_bytes=16 * 1024 * 1024)
+        print(f'Строк: {args.rows}, ядер: {os.cpu_count()}')
+
+        def client_side():
+            result = {}
+            for row in serial.execute(plain):
+                state = result.setdefault(row['department'], [0, 0, None])
+                state[0] += 1
+                state[1] += row['salary']
+                state[2] = row['age'] if state[2] is None else max(state[2], row['age'])
+            return result
+
+        try:
+            serial.execute(query)
+            parallel.execute(query)     # прогрев: сборка колонок и запуск пула
+            print(f'  на клиенте:          {best_time(client_side, args.repeat) * 1000:9.1f} мс')
+            print(f'  GROUP BY:            {best_time(lambda: serial.execute(query), args.repeat) * 1000:9.1f} мс')
+            print(f'  GROUP BY, процессы:  {best_time(lambda: parallel.execute(query), args.repeat) * 1000:9.1f} мс')
+            print(f'  {args.rows} групп:')
+            print(f'    в памяти:          {best_time(lambda: serial.execute(groups), args.repeat) * 1000:9.1f} мс')
+            print(f'    бюджет 16 МБ:      {best_time(lambda: spilling.execute(groups), args.repeat) * 1000:9.1f} мс')
+        finally:
+            parallel.close()
+
+
+class NoStats(StatsManager):
+    """
+    Менеджер, у которого статистики никогда нет, — запросы читают все строки.
+    """
+
+    def get_ready(self, table):
+        return None
+
+
+def bench_zonemap(args):
+    """
+    Запросы по диапазону упорядоченной колонки id со статистикой (пропуск зон)
+    и без неё, плюс время сбора статистики.
+    """
+    queries = [
+        f'SELECT id, name FROM people WHERE id BETWEEN {args.rows // 2} AND {args.rows // 2 + 5000}',
+        f'SELECT id FROM people WHERE age = 30 AND id < {args.rows // 50}',
+        'SELECT COUNT(*) FROM people WHERE id > 100 AND id < 200',
+        'SELECT id FROM people WHERE salary > 149990'
+    ]
+
+    with tempfile.TemporaryDirectory() as db_path:
+        make_table(db_path, 'people', args.rows)
+        plain = QueryExecutor(db_path, parallel_scanner=ParallelScanner(processes=1), stats_manager=NoStats(None))
+        zoned = QueryExecutor(db_path, parallel_scanner=ParallelScanner(processes=1))
+        table = zoned.column_store.open('people')
+        plain.column_store = zoned.column_store
+        print(f'Строк: {args.rows}')
+
+        start = time.perf_counter()
+        zoned.stats_manager.get(table)
+        print(f'  сбор статистики: {(time.perf_counter() - start) * 1000:9.1f} мс')
+
+        for raw in queries:
+            query = SQLParser().parse(raw)
+            assert zoned.execute(query) == plain.execute(query)
+            before = best_time(lambda: plain.execute(query), args.repeat)
+            after = best_time(lambda: zoned.execute(query), args.repeat)
+            print(f'  {raw}')
+            print(f'    без статистики: {before * 1000:9.1f} мс   с зонами: {after * 1000:9.1f} мс')
+
+
+def bench_join(args):
+    """
+    JOIN: два SELECT и соединение на стороне клиента против хэш-соединения
+    на сервере (в памяти и с grace-разбиением при маленьком бюджете).
+    """
+    query = SQLParser().parse(
+        'SELECT people.id, salary, title FROM people JOIN departments ON people.age = departments.age WHERE salary > 100000'
+    )
+    big_build = SQLParser().parse('SELECT a.id, people.salary FROM people JOIN a ON people.id = a.id')
+
+    with tempfile.TemporaryDirectory() as db_path:
+        make_table(db_path, 'people', args.rows)
+        make_table(db_path, 'a', args.rows // 2, seed=7)
+        os.makedirs(os.path.join(db_path, 'departments'))
+        with open(os.path.join(db_path, 'departments', 'table.csv'), 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['age', 'title'])
+            for age in range(18, 66):
+                writer.writerow([age, f'group{age // 10}'])
+
+        executor = QueryExecutor(db_path, parallel_scanner=ParallelScanner(processes=1), join_memory_bytes=2 ** 40)
+        spilling = QueryExecutor(db_path, parallel_scanner=ParallelScanner(processes=1), join_memory_bytes=16 * 1024 * 1024)
+        print(f'Строк: {args.rows}')
+
+        def client_side():
+            titles = {row['age']: row['title'] for row in executor.execute(SQLParser().parse('SELECT age, title FROM departments'))}
+            people = executor.execute(SQLParser().parse('SELECT id, salary, age FROM people WHERE salary > 100000'))
+            return [{'people.id': row['id'], 'salary': row['salary'], 'title': titles[row['age']]} for row in people if row['age'] in titles]
+
+        assert executor.execute(query) == client_side()
+        print(f'  на клиенте:                 {best_time(client_side, args.repeat) * 1000:9.1f} мс')
+        print(f'  JOIN:                       {best_time(lambda: executor.execute(query), args.repeat) * 1000:9.1f} мс')
+        print(f'  {args.rows // 2} строк в хэш-таблице:')
+        print(f'    в памяти:                 {best_time(lambda: executor.execute(big_build), args.repeat) * 1000:9.1f} мс')
+        print(f'    бюджет 16 МБ:             {best_time(lambda: spilling.execute(big_build), args.repeat) * 1000:9.1f} мс')
+
+
+def bench_wire(args):
+    """
+    Формат ответа: байты и время кодирования/разбора результата
+    кадрами по 1000 строк в JSON и в двоичном формате.
+    """
+    with tempfile.TemporaryDirectory() as db_path:
+        make_table(db_path, 'people', args.rows)
+        executor = QueryExecutor(db_path, parallel_scanner=ParallelScanner(processes=1))
+        rows = executor.execute(SQLParser().parse('SELECT * FROM people'))
+        chunks = [rows[i:i + 1000] for i in range(0, len(rows), 1000)]
+        print(f'Строк: {args.rows}, на 1М строк:')
+
+        formats = {
+            'JSON': (lambda chunk: json.dumps({'rows': chunk}).encode('utf-8'), lambda frame: json.loads(frame)['rows']),
+            'двоичный': (encode_rows, decode_rows)
+        }
+        scale = 1_000_000 / args.rows
+        for name, (encode, decode) in formats.items():
+            frames = [encode(chunk) for chunk in chunks]
+            assert [row for frame in frames for row in decode(frame)] == rows
+
+            size = sum(map(len, frames))
+            encode_time = best_time(lambda: [encode(chunk) for chunk in chunks], args.repeat)
+            decode_time = best_time(lambda: [decode(frame) for frame in frames], args.repeat)
+            print(
+                f'  {name:9} {size * scale / 2 ** 20:8.1f} МБ   '
+                f'кодирование {encode_time * scale * 1000:8.1f} мс   разбор {decode_time * scale * 1000:8.1f} мс'
+            )
+
+
+def bench_compression(args):
+    """
+    Сжатие кадров: байты на 1М строк, время сжатия/распаковки и оценка
+    передачи по каналу 100 Мбит/с для JSON и двоичного формата.
+    """
+    link_bytes_per_second = 100 * 10 ** 6 / 8
+
+    with tempfile.TemporaryDirectory() as db_path:
+        make_table(db_path, 'people', args.rows)
+        executor = QueryExecutor(db_path, parallel_scanner=ParallelScanner(processes=1))
+        rows = executor.execute(SQLParser().parse('SELECT * FROM people'))
+        chunks = [rows[i:i + 1000] for i in range(0, len(rows), 1000)]
+        scale = 1_000_000 / args.rows
+        print(f'Строк: {args.rows}, на 1М строк:')
+
+        payloads = {
+            'JSON': [json.dumps({'rows': chunk}).encode('utf-8') for chunk in chunks],
+            'двоичный': [encode_rows(chunk) for chunk in chunks]
+        }
+        for name, frames in payloads.items():
+            for level in (None, 1, 6, 9):
+                compression = {'level': level, 'threshold': 1024} if level else None
+                packed = [pack_frame(frame, compression) for frame in frames]
+
+                def unpack():
+                    return [frame_body(frame[4:], unpack_frame_header(frame[:4])[1]) for frame in packed]
+
+                assert unpack() == frames
+                size = sum(map(len, packed)) * scale
+                pack_time = best_time(lambda: [pack_frame(frame, compression) for frame in frames], args.repeat) * scale
+                unpack_time = best_time(unpack, args.repeat) * scale
+                total = pack_time + unpack_time + size / link_bytes_per_second
+                print(
+                    f'  {name:9} {"без сжатия" if level is None else f"zlib {level}":10} {size / 2 ** 20:7.1f} МБ   '
+                    f'сжатие {pack_time * 1000:7.1f} мс   распаковка {unpack_time * 1000:6.1f} мс   '
+                    f'всего при 100 Мбит/с {total:5.2f} с'
+                )
+
+
+def _delayed_link(target_port: int, delay: float) -> int:
+    """
+    Прокси на localhost, который задерживает данные в каждую сторону на delay секунд,
+    как сеть с задержкой 2 * delay туда-обратно. Возвращает свой порт.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('localhost', 0))
+    listener.listen()
+
+    def forward(src, dst):
+        packets = queue.Queue()
+
+        def send():
+            while True:
+                due, data = packets.get()
+                time.sleep(max(0.0, due - time.perf_counter()))
+                dst.sendall(data)
+
+        threading.Thread(target=send, daemon=True).start()
+        while data := src.recv(1 << 16):
+            packets.put((time.perf_counter() + delay, data))
+
+    def accept():
+        while True:
+            conn, _ = listener.accept()
+            upstream = socket.create_connection(('localhost', target_port))
+            for sock in (conn, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=forward, args=(conn, upstream), daemon=True).start()
+            threading.Thread(target=forward, args=(upstream, conn), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def bench_pipeline(args):
+    """
+    Короткие запросы по одному соединению через канал с задержкой --rtt мс:
+    по очереди (ждём ответ на каждый) и конвейером (все сразу, ответы по номерам).
+    """
+    queries = [f'SELECT * FROM people WHERE id = {i}' for i in range(0, args.rows, max(1, args.rows // 200))]
+
+    with tempfile.TemporaryDirectory() as db_path:
+        make_table(db_path, 'people', args.rows)
+        server = Server(database_path=db_path, port=0, cache_bytes=0)
+        server.auth_manager.users = {'bench': hashlib.md5(b'bench').hexdigest()}
+        server.logger.logger.setLevel(logging.WARNING)
+        threading.Thread(target=server.start, daemon=True).start()
+        while not server.server_socket.getsockname()[1]:
+            time.sleep(0.01)
+        port = _delayed_link(server.server_socket.getsockname()[1], args.rtt / 2000)
+
+        clients = {}
+        for name, pipeline in (('по очереди', False), ('конвейер', True)):
+            client = Client(port=port)
+            client.connect()
+            capabilities = {'format': 'binary', 'pipeline': pipeline}
+            client.send_message(json.dumps({'username': 'bench', 'password': 'bench', 'capabilities': capabilities}))
+            client.pipelining = bool(json.loads(client.recv_message())['capabilities'].get('pipeline'))
+            clients[name] = client
+
+        # первый проход строит колонки и хэш-индекс
+        results = [[response['result'] for response in client.pipeline(queries)] for client in clients.values()]
+        assert results[0] == results[1]
+
+        print(f'Строк: {args.rows}, запросов: {len(queries)}, задержка туда-обратно {args.rtt} мс')
+        for name, client in clients.items():
+            elapsed = best_time(lambda: client.pipeline(queries), args.repeat)
+            print(f'  {name:11} {elapsed * 1000:8.1f} мс   {len(queries) / elapsed:8.0f} запросов/с')
+
+
+def bench_sharedscan(args):
+    """
+    --clients одновременных запросов к одной таблице, у каждого своё условие:
+    каждый читает таблицу сам или все присоединяются к общему скану.
+    """
+    departments = ['HR', 'Engineering', 'Marketing', 'Sales', 'Support']
+    queries = [
+        SQLParser().parse(
+            f"SELECT id, name, department FROM people WHERE department != '{departments[i % 5]}' "
+            f"AND name BETWEEN 'user{i}0' AND 'user{i}1'"
+        )
+        for i in range(args.clients)
+    ]
+
+    with tempfile.TemporaryDirectory() as db_path:
+        make_table(db_path, 'people', args.rows)
+        print(f'Строк: {args.rows}, одновременных запросов: {args.clients}')
+
+        results = {}
+        for name, max_blocks in (('каждый сам', 0), ('общий скан', SharedScanner().max_blocks)):
+            executor = QueryExecutor(
+                db_path,
+                parallel_scanner=ParallelScanner(processes=1),
+                shared_scanner=SharedScanner(max_blocks=max_blocks)
+            )
+            executor.execute(queries[0])
+
+            def run_all():
+                threads = [threading.Thread(target=executor.execute, args=(query,)) for query in queries]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            results[name] = [sorted(map(json.dumps, executor.execute(query))) for query in queries]
+            elapsed = best_time(run_all, args.repeat)
+            print(f'  {name:11} {elapsed * 1000:8.1f} мс   {executor.shared_scanner.stats()}')
+        assert len({json.dumps(rows) for rows in results.values()}) == 1
+
+
+def bench_catalog(args):
+    """
+    Структура базы из --tables таблиц: обход папки с чтением заголовков
+    каждого table.csv против каталога в памяти; стоимость фоновой сверки
+    и запуска с сохранённым каталогом.
+    """
+    with tempfile.TemporaryDirectory() as db_path:
+        for i in range(args.tables):
+            make_table(db_path, f't{i}', 10, seed=i)
+
+        print(f'Таблиц: {args.tables}')
+        builder = DatabaseStructureBuilder(db_path)
+        walk = best_time(builder.build, args.repeat)
+        print(f'  обход папки               {walk * 1000:8.2f} мс')
+
+        started = time.perf_counter()
+        catalog = Catalog(db_path, poll_interval=0)
+        cold = time.perf_counter() - started
+        assert catalog.structure() == builder.build()
+
+        print(f'  каталог: структура         {best_time(catalog.structure, args.repeat) * 1000:8.2f} мс')
+        print(f'  каталог: таблица по имени  {best_time(lambda: catalog.resolve("t0"), args.repeat) * 1e6:8.2f} мкс')
+        print(f'  каталог: фоновая сверка    {best_time(catalog.refresh, args.repeat) * 1000:8.2f} мс')
+        print(f'  каталог: первый запуск     {cold * 1000:8.2f} мс')
+        warm = best_time(lambda: Catalog(db_path, poll_interval=0), args.repeat)
+        print(f'  каталог: запуск с файлом   {warm * 1000:8.2f} мс')
+
+
+def bench_schema(args):
+    """
+    Типы колонок: конвертация table.csv за один проход с типами по выборке
+    против двух полных проходов, и условия по колонкам bool и date
+    против тех же колонок, прочитанных как строки (schema.json).
+    """
+    with tempfile.TemporaryDirectory() as db_path:
+        table_dir = os.path.join(db_path, 'people')
+        os.makedirs(table_dir)
+        rnd = random.Random(42)
+        with open(os.path.join(table_dir, 'table.csv'), 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['id', 'active', 'hired', 'salary'])
+            for i in range(args.rows):
+                hired = f'{rnd.randint(2000, 2024)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}'
+                writer.writerow([i, rnd.choice(['true', 'false']), hired, rnd.randint(20000, 150000)])
+
+        def build(sample_rows):
+            storage.SAMPLE_ROWS = sample_rows
+            shutil.rmtree(os.path.join(table_dir, storage.STORE_DIR), ignore_errors=True)
+            return ColumnStore(db_path).open('people')
+
+        print(f'Строк: {args.rows}')
+        default_sample = storage.SAMPLE_ROWS
+        two_pass = best_time(lambda: build(args.rows + 1), args.repeat)
+        one_pass = best_time(lambda: build(default_sample), args.repeat)
+        print(f'  конвертация: два прохода          {two_pass:8.3f} с')
+        print(f'  конвертация: выборка + один проход {one_pass:8.3f} с')
+        print(f'  типы: {build(default_sample).types}')
+
+        queries = [
+            "SELECT id FROM people WHERE active = true",
+            "SELECT id FROM people WHERE hired >= '2020-01-01'",
+            "SELECT id FROM people WHERE hired BETWEEN '2010-01-01' AND '2010-12-31'"
+        ]
+        with open(os.path.join(table_dir, SCHEMA_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'active': 'str', 'hired': 'str'}, f)
+        as_strings = QueryExecutor(db_path)
+        baseline = {sql: as_strings.execute(SQLParser().parse(sql)) for sql in queries}
+        times = {sql: best_time(lambda: as_strings.execute(SQLParser().parse(sql)), args.repeat) for sql in queries}
+        as_strings.close()
+
+        os.remove(os.path.join(table_dir, SCHEMA_FILE))
+        typed = QueryExecutor(db_path)
+        for sql in queries:
+            assert len(typed.execute(SQLParser().parse(sql))) == len(baseline[sql])
+            elapsed = best_time(lambda: typed.execute(SQLParser().parse(sql)), args.repeat)
+            print(f'  {sql}\n    строки {times[sql]:7.3f} с   типы {elapsed:7.3f} с')
+        typed.close()
+
+
+def bench_vector(args):
+    """
+    Векторный движок на numpy против построчного: избирательный фильтр,
+    агрегат с условием и GROUP BY. Первый запрос векторного движка
+    включает подготовку массивов, дальше они берутся из кэша.
+    """
+    with tempfile.TemporaryDirectory() as db_path:
+        make_table(db_path, 'people', args.rows)
+        queries = [
+            "SELECT id, name FROM people WHERE age > 60 AND salary < 25000",
+            "SELECT COUNT(*), AVG(salary) FROM people WHERE age BETWEEN 30 AND 40",
+            "SELECT age, COUNT(*), MAX(salary) FROM people GROUP BY age"
+        ]
+
+        row_engine = QueryExecutor(db_path, vector_engine=VectorEngine(threshold=None))
+        vector_engine = QueryExecutor(db_path, column_store=row_engine.column_store, vector_engine=VectorEngine())
+        row_engine.column_store.open('people')
+        print(f'Строк: {args.rows}')
+
+        for sql in queries:
+            query = SQLParser().parse(sql)
+            started = time.perf_counter()
+            expected = vector_engine.execute(query)
+            first = time.perf_counter() - started
+            assert row_engine.execute(query) == expected
+
+            rows_time = best_time(lambda: row_engine.execute(query), args.repeat)
+            vector_time = best_time(lambda: vector_engine.execute(query), args.repeat)
+            print(f'  {sql}')
+            print(f'    построчно {rows_time:7.3f} с   numpy {vector_time:7.3f} с (первый раз {first:.3f} с)'
+                  f'   x{rows_time / vector_time:.1f}')
+        print(f'  {vector_engine.vector_engine.stats()}')
+        row_engine.close()
+        vector_engine.close()
+
+
+def bench_write(args):
+    """
+    Дозапись строк: INSERT и COPY новыми сегментами с дополнением файлов колонок,
+    индексов и статистики против дописывания в table.csv, после которого всё
+    собирается заново. Время включает запросы, которым нужны индекс, хэш-индекс
+    и статистика, — их подготовка и есть основная цена записи.
+    """
+    departments = ['HR', 'Engineering', 'Marketing', 'Sales', 'Support']
+    rnd = random.Random(7)
+
+    def new_rows(count: int, start: int) -> list:
+        return [
+            [str(i), f'user{i}', str(rnd.randint(18, 65)), str(rnd.randint(20000, 150000)), rnd.choice(departments)]
+            for i in range(start, start + count)
+        ]
+
+    def as_insert(rows: list) -> str:
+        values = ', '.join(f"({r[0]}, '{r[1]}', {r[2]}, {r[3]}, '{r[4]}')" for r in rows)
+        return f'INSERT INTO people VALUES {values}'
+
+    def as_copy(rows: list) -> CopySession:
+        session = CopySession('people')
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        session.feed(0, buffer.getvalue())
+        return session
+
+    queries = [SQLParser().parse(sql) for sql in (
+        "SELECT id FROM people WHERE age BETWEEN 30 AND 31 LIMIT 100",
+        "SELECT id FROM people WHERE name = 'user12345'",
+        "SELECT COUNT(*) FROM people WHERE salary > 149000"
+    )]
+
+    def prepare(executor: QueryExecutor):
+        for query in queries:
+            executor.execute(query)
+        return executor.stats_manager.get(executor.column_store.open('people'))
+
+    with tempfile.TemporaryDirectory() as segments_db, tempfile.TemporaryDirectory() as rewrite_db:
+        make_table(segments_db, 'people', args.rows)
+        make_table(rewrite_db, 'people', args.rows)
+        segments = QueryExecutor(segments_db)
+        rewrite = QueryExecutor(rewrite_db)
+        for executor in (segments, rewrite):
+            executor.create_index('people', 'age')
+            prepare(executor)
+        print(f'Строк: {args.rows}')
+
+        next_id = args.rows
+        for method, count in (('INSERT', 1), ('INSERT', 1000), ('COPY', 100_000)):
+            rows = new_rows(count, next_id)
+            next_id += count
+
+            started = time.perf_counter()
+            if method == 'INSERT':
+                parsed = SQLParser().parse(as_insert(rows))
+                segments.insert('people', parsed['rows'], parsed['columns'])
+            else:
+                session = as_copy(rows)
+                columns, records = session.rows()
+                segments.insert('people', records, columns)
+                session.close()
+            written = time.perf_counter() - started
+            appended = prepare(segments)
+            incremental = time.perf_counter() - started
+
+            started = time.perf_counter()
+            with open(os.path.join(rewrite_db, 'people', 'table.csv'), 'a', encoding='utf-8', newline='') as f:
+                csv.writer(f).writerows(rows)
+            rebuilt = prepare(rewrite)
+            full = time.perf_counter() - started
+
+            assert appended.columns == rebuilt.columns
+            assert all(segments.execute(q) == rewrite.execute(q) for q in queries)
+            print(f'  {method} {count:>7} строк: запись {written:7.3f} с ({count / written:10.0f} строк/с)'
+                  f'   с индексами и статистикой {incremental:7.3f} с   пересборка {full:7.3f} с   x{full / incremental:.1f}')
+        segments.close()
+        rewrite.close()
+
+
+def bench_diskcache(args):
+    """
+    Первые запросы после перезапуска: пустой кэш в памяти против кэша на диске —
+    чтение результатов через mmap при промахе и прогрев памяти при старте.
+    Перезапуск — новые QueryExecutor и CacheManager над теми же файлами.
+    """
+    queries = [SQLParser().parse(sql) for sql in (
+        "SELECT department, COUNT(*), AVG(salary) FROM people GROUP BY department",
+        "SELECT age, MAX(salary) FROM people GROUP BY age",
+        "SELECT COUNT(*) FROM people WHERE salary > 100000",
+        "SELECT id, name FROM people WHERE age = 30 AND department = 'Sales'",
+        "SELECT * FROM people WHERE salary BETWEEN 50000 AND 50500",
+        "SELECT id, salary FROM people WHERE age < 20 ORDER BY salary DESC LIMIT 1000"
+    )]
+
+    def first_pass(executor: QueryExecutor, cache: CacheManager) -> list:
+        results = []
+        for query in queries:
+            key = SQLParser.cache_key(query)
+            version = executor.version(query)
+            result = cache.get(query['table'], key, version)
+            if result is None:
+                result = executor.execute(query)
+                cache.set(query['table'], key, version, result)
+            results.append(result)
+        return results
+
+    with tempfile.TemporaryDirectory() as db_path:
+        make_table(db_path, 'people', args.rows)
+        cache_dir = os.path.join(db_path, '.cache')
+        executor = QueryExecutor(db_path)
+        cache = CacheManager(disk=DiskCache(cache_dir))
+        expected = first_pass(executor, cache)
+        # результаты пишутся на диск в фоне; close дожидается записи, как при остановке сервера
+        cache.close()
+        executor.close()
+        print(f'Строк: {args.rows}, запросов: {len(queries)}, строк в результатах: {sum(map(len, expected))}')
+
+        def restart(disk: bool, warm: bool):
+            executor = QueryExecutor(db_path)
+            try:
+                started = time.perf_counter()
+                cache = CacheManager(disk=DiskCache(cache_dir) if disk else None)
+                if warm:
+                    cache.warm(lambda table, query_key: executor.version(json.loads(query_key)))
+                warmed = time.perf_counter() - started
+                assert first_pass(executor, cache) == expected
+                return warmed, time.perf_counter() - started
+            finally:
+                executor.close()
+
+        cold = min(restart(False, False)[1] for _ in range(args.repeat))
+        mapped = min(restart(True, False)[1] for _ in range(args.repeat))
+        warm, total = min((restart(True, True) for _ in range(args.repeat)), key=lambda t: t[1])
+        print(f'  без кэша на диске         {cold:8.3f} с')
+        print(f'  чтение с диска (mmap)     {mapped:8.3f} с   x{cold / mapped:.1f}')
+        print(f'  прогрев при старте        {total:8.3f} с   x{cold / total:.1f}   (из них прогрев {warm:.3f} с)')
+
+
+BENCHMARKS = {
+    'parallel': bench_parallel,
+    'compiled': bench_compiled,
+    'compound': bench_compound,
+    'limit': bench_limit,
+    'order': bench_order,
+    'aggregate': bench_aggregate,
+    'zonemap': bench_zonemap,
+    'join': bench_join,
+    'wire': bench_wire,
+    'compression': bench_compression,
+    'pipeline': bench_pipeline,
+    'sharedscan': bench_sharedscan,
+    'catalog': bench_catalog,
+    'schema': bench_schema,
+    'vector': bench_vector,
+    'write': bench_write,
+    'diskcache': bench_diskcache
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmark', choices=BENCHMARKS)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--clients', type=int, default=50, help='одновременных запросов для sharedscan')
+    parser.add_argument('--tables', type=int, default=2000, help='число таблиц для catalog')
+    parser.add_argument('--rtt', type=float, default=2.0, help='задержка туда-обратно для pipeline, мс')
+    args = parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
@@ -0,0 +1,621 @@
+import os
+import json
+import mmap
+import time
+import uuid
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+
+from wire import encode_rows, decode_rows
+
+
+# второй уровень кэша лежит в папке базы; имя с точкой, чтобы не путать его с таблицами
+DISK_CACHE_DIR = '.cache'
+DISK_INDEX_FILE = 'index.json'
+DISK_ENTRY_EXT = '.rows'
+
+# заголовок файла результата: сигнатура и длина JSON с таблицей, ключом запроса и версией
+DISK_HEADER = struct.Struct('=8sI')
+DISK_MAGIC = b'1LABRES3'
+
+# через сколько изменений счётчиков index.json сохраняется без остановки сервера
+INDEX_SAVE_EVERY = 100
+
+# сколько байт результатов (по оценке в памяти) может ждать записи на диск;
+# что не помещается, на диск не попадает, а запрос не ждёт
+DISK_PENDING_BYTES = 128 * 1024 * 1024
+
+
+class CacheManager:
+    """
+    Кэширует результаты запросов.
+    Вытеснение LRU по суммарному размеру результатов в байтах.
+    Каждая запись помнит версию таблицы, на которой получен результат:
+    если таблица изменилась, запись считается устаревшей и удаляется.
+    Когда в таблицу только дописаны строки, записи можно обновить через refresh.
+    С disk результаты дублируются в DiskCache: промах в памяти ищется на диске,
+    а warm после перезапуска поднимает в память самые востребованные из них.
+    На диск результаты пишет фоновый поток DiskCache, set его не ждёт.
+    Безопасен для одновременного использования из нескольких потоков.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entry_bytes: int = None, disk: 'DiskCache' = None):
+        self.max_bytes = max_bytes
+        # один большой результат не должен вытеснять весь кэш
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 4
+        self.cache = OrderedDict()
+        self.size = 0
+        self._lock = threading.Lock()
+        # второй уровень на диске: переживает перезапуск, промахи памяти ищутся в нём
+        self.disk = disk
+
+        # статистика
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.rejected = 0
+
+
+    def get(self, table: str, query_key: str, version):
+        """
+        Возвращает результат запроса к table для версии version или None.
+        Результат, найденный на диске, поднимается в память.
+        """
+        key = (table, query_key)
+        found = None
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                entry_version, result, size = entry
+                if entry_version == version:
+                    self.cache.move_to_end(key)
+                    self.hits += 1
+                    found = result
+                else:
+                    # таблица поменялась — результат больше не верен
+                    self._remove(key)
+                    self.invalidations += 1
+
+        if found is not None:
+            if self.disk is not None:
+                # попадания в память тоже решают, что прогревать после перезапуска
+                self.disk.touch(table, query_key)
+            return found
+
+        found = self.disk.get(table, query_key, version) if self.disk is not None else None
+        with self._lock:
+            if found is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            result, size = found
+            self._store(key, version, result, size)
+            return result
+
+
+    def set(self, table: str, query_key: str, version, result, size: int = None):
+        """
+        Сохраняет результат запроса в памяти и ставит его в очередь записи на диск.
+        size — размер результата в байтах, если он уже известен (например, посчитан при отправке).
+        """
+        if size is None:
+            size = estimate_size(result)
+
+        with self._lock:
+            self._store((table, query_key), version, result, size)
+        if self.disk is not None:
+            self.disk.set(table, query_key, version, result, size)
+
+
+    def warm(self, version_of) -> int:
+        """
+        Поднимает в память самые востребованные результаты с диска, пока они
+        помещаются в max_bytes. version_of(table, query_key) — текущая версия
+        данных запроса; результаты устаревших версий удаляются с диска.
+        Возвращает число загруженных результатов.
+        """
+        if self.disk is None:
+            return 0
+
+        loaded = 0
+        budget = self.max_bytes
+        for table, query_key, version, size in self.disk.top():
+            if size > min(budget, self.max_entry_bytes):
+                continue
+            try:
+                current = version_of(table, query_key)
+            except (OSError, ValueError, KeyError):
+                current = None
+            if current != version:
+                self.disk.remove(table, query_key)
+                continue
+
+            found = self.disk.get(table, query_key, version, count=False)
+            if found is None:
+                continue
+            with self._lock:
+                if (table, query_key) in self.cache:
+                    continue
+                self._store((table, query_key), version, *found)
+            budget -= size
+            loaded += 1
+        return loaded
+
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+
+    def refresh(self, table: str, old_version, new_version, extend):
+        """
+        В таблицу дописаны строки: версия old_version сменилась на new_version.
+        Для записей версии old_version extend(query_key, result) возвращает строки,
+        которые надо добавить к результату, или None — тогда запись удаляется.
+        Возвращает число обновлённых записей.
+        """
+        with self._lock:
+            entries = [
+                (key, entry) for key, entry in self.cache.items()
+                if key[0] == table and entry[0] == old_version
+            ]
+
+        refreshed = []
+        for key, entry in entries:
+            # строки считаются без блокировки, поэтому запись могли уже заменить
+            added = extend(key[1], entry[1])
+            with self._lock:
+                if self.cache.get(key) is not entry:
+                    continue
+                if added is None:
+                    self._remove(key)
+                    self.invalidations += 1
+                    continue
+
+                size = entry[2] + (estimate_size(added) if added else 0)
+                if size > self.max_entry_bytes:
+                    self._remove(key)
+                    self.rejected += 1
+                    continue
+                # старый список могут ещё отправлять клиенту, поэтому он не меняется
+                self.cache[key] = (new_version, entry[1] + added, size)
+                self.size += size - entry[2]
+                refreshed.append((key, self.cache[key]))
+
+                while self.size > self.max_bytes:
+                    self._remove(next(iter(self.cache)))
+                    self.evictions += 1
+
+        if self.disk is not None:
+            for (table_name, query_key), (version, result, size) in refreshed:
+                self.disk.set(table_name, query_key, version, result, size)
+        return len(refreshed)
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.disk_hits + self.misses
+            stats = {
+                'entries': len(self.cache),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.disk_hits) / requests, 4) if requests else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'rejected': self.rejected
+            }
+        if self.disk is not None:
+            stats['disk'] = self.disk.stats()
+        return stats
+
+
+    def _store(self, key, version, result, size: int):
+        if key in self.cache:
+            self._remove(key)
+
+        if size > self.max_entry_bytes:
+            self.rejected += 1
+            return
+
+        self.cache[key] = (version, result, size)
+        self.size += size
+
+        # удаляем давно не использованные записи
+        while self.size > self.max_bytes:
+            old_key = next(iter(self.cache))
+            self._remove(old_key)
+            self.evictions += 1
+
+
+    def _remove(self, key):
+        _, _, size = self.cache.pop(key)
+        self.size -= size
+
+
+class DiskCache:
+    """
+    Второй уровень кэша результатов: по файлу на запрос в cache_dir.
+    Имя файла — хэш таблицы и ключа запроса (канонического вида запроса),
+    версия таблицы записана в заголовке файла и в index.json: результат
+    другой версии устарел и удаляется при обращении. Строки хранятся
+    в двоичном формате протокола (wire.encode_rows) и читаются через mmap.
+
+    index.json помнит для каждого результата размер файла, число попаданий
+    и время последнего обращения: по суммарному размеру файлов вытесняются
+    давно не использованные результаты, по числу попаданий выбираются
+    результаты для прогрева памяти после перезапуска.
+
+    set только ставит результат в очередь: кодирует и пишет его фоновый поток,
+    чтобы промах кэша не ждал диска. Пока результат ждёт записи, на диске его нет
+    (в памяти он уже есть). Очередь ограничена pending_bytes; новый результат
+    того же запроса заменяет ещё не записанный.
+    """
+
+    def __init__(
+            self,
+            cache_dir: str,
+            max_bytes: int = 1024 * 1024 * 1024,
+            max_entry_bytes: int = None,
+            logger=None,
+            pending_bytes: int = DISK_PENDING_BYTES
+        ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 4
+        self.logger = logger
+        self.index_file = os.path.join(cache_dir, DISK_INDEX_FILE)
+        self._lock = threading.Lock()
+        self._changes = 0
+
+        # очередь записи: имя файла -> (таблица, ключ, версия, результат, размер)
+        self.pending_bytes = pending_bytes
+        self._pending = OrderedDict()
+        self._pending_size = 0
+        self._writing = False
+        self._stopped = False
+        self._queue = threading.Condition()
+        self._writer = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.rejected = 0
+        self.dropped = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._entries = self._load()
+        self.size = sum(entry['bytes'] for entry in self._entries.values())
+        self._evict()
+
+    def get(self, table: str, query_key: str, version, count: bool = True):
+        """
+        (результат, его размер в памяти) для версии version или None.
+        count=False — не считать обращение попаданием (прогрев).
+        """
+        name = _entry_name(table, query_key)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry['version'] != version:
+                self._drop(name)
+                self.invalidations += 1
+                entry = None
+            if entry is None:
+                self.misses += count
+                return None
+
+        try:
+            result = self._read(name, table, query_key, version)
+        except (OSError, ValueError) as e:
+            self._log("WARNING", f"Не удалось прочитать результат из кэша {name}: {e}")
+            result = None
+
+        with self._lock:
+            if result is None:
+                if self._entries.get(name) is entry:
+                    self._drop(name)
+                self.misses += count
+                return None
+            if count:
+                entry['hits'] += 1
+                entry['used'] = time.time()
+                self.hits += 1
+                self._changed()
+            return result, entry['size']
+
+    def set(self, table: str, query_key: str, version, result: list, size: int):
+        """
+        Ставит результат в очередь записи на диск и сразу возвращается.
+        size — его размер в памяти (для прогрева и ограничения очереди).
+        Если очередь переполнена, результат на диск не пишется.
+        """
+        name = _entry_name(table, query_key)
+        with self._queue:
+            if self._stopped:
+                return
+            previous = self._pending.pop(name, None)
+            if previous is not None:
+                self._pending_size -= previous[4]
+            if self._pending_size + size > self.pending_bytes:
+                self.dropped += 1
+                return
+            self._pending[name] = (table, query_key, version, result, size)
+            self._pending_size += size
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_pending, name='disk-cache-writer', daemon=True)
+                self._writer.start()
+            self._queue.notify_all()
+
+    def _write_pending(self):
+        while True:
+            with self._queue:
+                while not self._pending and not self._stopped:
+                    self._queue.wait()
+                if not self._pending:
+                    return
+                _, item = self._pending.popitem(last=False)
+                self._pending_size -= item[4]
+                self._writing = True
+            try:
+                self._write(*item)
+            except Exception as e:
+                self._log("ERROR", f"Не удалось записать результат в кэш: {e}")
+            finally:
+                with self._queue:
+                    self._writing = False
+                    self._queue.notify_all()
+
+    def _write(self, table: str, query_key: str, version, result: list, size: int):
+        header = json.dumps({'table': table, 'query': query_key, 'version': version}, ensure_ascii=False).encode('utf-8')
+        body = encode_rows(result)
+        file_bytes = DISK_HEADER.size + len(header) + len(body)
+        if file_bytes > self.max_entry_bytes:
+            with self._lock:
+                self.rejected += 1
+            return
+
+        name = _entry_name(table, query_key)
+        tmp_file = os.path.join(self.cache_dir, f'tmp-{uuid.uuid4().hex}')
+        try:
+            with open(tmp_file, 'wb') as f:
+                f.write(DISK_HEADER.pack(DISK_MAGIC, len(header)))
+                f.write(header)
+                f.write(body)
+            # читатели старого файла дочитывают его через свой mmap
+            os.replace(tmp_file, os.path.join(self.cache_dir, name))
+        except OSError as e:
+            self._log("WARNING", f"Не удалось записать результат в кэш {name}: {e}")
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            previous = self._entries.pop(name, None)
+            if previous is not None:
+                self.size -= previous['bytes']
+            self._entries[name] = {
+                'table': table,
+                'query': query_key,
+                'version': version,
+                'bytes': file_bytes,
+                'size': size,
+                'hits': previous['hits'] if previous is not None else 0,
+                'used': time.time()
+            }
+            self.size += file_bytes
+            self._evict(keep=name)
+            self._changed()
+
+    def touch(self, table: str, query_key: str):
+        """
+        Учитывает попадание в память: результат не вытесняется с диска
+        и первым прогревается после перезапуска.
+        """
+        with self._lock:
+            entry = self._entries.get(_entry_name(table, query_key))
+            if entry is not None:
+                entry['hits'] += 1
+                entry['used'] = time.time()
+                self._changed()
+
+    def remove(self, table: str, query_key: str):
+        name = _entry_name(table, query_key)
+        with self._queue:
+            pending = self._pending.pop(name, None)
+            if pending is not None:
+                self._pending_size -= pending[4]
+        with self._lock:
+            if name in self._entries:
+                self._drop(name)
+                self.invalidations += 1
+
+    def top(self) -> list:
+        """
+        Результаты по убыванию числа попаданий: (таблица, ключ запроса, версия, размер в памяти).
+        """
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda e: (e['hits'], e['used']), reverse=True)
+        return [(e['table'], e['query'], e['version'], e['size']) for e in entries]
+
+    def flush(self):
+        """
+        Дожидается записи результатов из очереди и сохраняет index.json, если счётчики менялись.
+        """
+        with self._queue:
+            while self._pending or self._writing:
+                self._queue.wait()
+        with self._lock:
+            if self._changes:
+                self._save()
+
+    def close(self):
+        """
+        Дописывает очередь, сохраняет index.json и останавливает фоновый поток.
+        """
+        self.flush()
+        with self._queue:
+            self._stopped = True
+            self._queue.notify_all()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'rejected': self.rejected,
+                'dropped': self.dropped,
+                'pending': len(self._pending)
+            }
+
+    def _read(self, name: str, table: str, query_key: str, version):
+        with open(os.path.join(self.cache_dir, name), 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                result = None
+                try:
+                    header = _read_header(view)
+                    if header == {'table': table, 'query': query_key, 'version': version, 'length': header['length']}:
+                        result = decode_rows(view[DISK_HEADER.size + header['length']:])
+                except (ValueError, KeyError, IndexError, struct.error):
+                    # испорченный файл; исключение разбирается здесь, чтобы его кадры
+                    # не держали ссылки на mmap при закрытии
+                    self._log("WARNING", f"Испорченный файл кэша {name}")
+                view.release()
+                return result
+
+    def _load(self) -> dict:
+        """
+        Читает index.json и сверяет его с файлами: файлы без записи в индексе
+        (сервер остановился до сохранения индекса) добавляются по заголовку,
+        записи без файла выбрасываются.
+        """
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = {}
+
+        files = set()
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith('tmp-'):
+                # недописанный файл
+                _remove_file(path)
+            elif name.endswith(DISK_ENTRY_EXT):
+                files.add(name)
+
+        loaded = {}
+        for name in files:
+            entry = entries.get(name)
+            if entry is None:
+                entry = self._recover(name)
+            if entry is not None:
+                loaded[name] = entry
+        self._changes = len(loaded) != len(entries)
+        return loaded
+
+    def _recover(self, name: str):
+        path = os.path.join(self.cache_dir, name)
+        try:
+            with open(path, 'rb') as f:
+                head = f.read(DISK_HEADER.size)
+                magic, length = DISK_HEADER.unpack(head)
+                if magic != DISK_MAGIC:
+                    raise ValueError(magic)
+                meta = json.loads(f.read(length))
+            # размер в памяти неизвестен, оцениваем размером файла
+            file_bytes = os.path.getsize(path)
+            return {
+                'table': meta['table'],
+                'query': meta['query'],
+                'version': meta['version'],
+                'bytes': file_bytes,
+                'size': file_bytes,
+                'hits': 0,
+                'used': os.path.getmtime(path)
+            }
+        except (OSError, ValueError, KeyError, struct.error):
+            _remove_file(path)
+            return None
+
+    def _evict(self, keep: str = None):
+        """
+        Удаляет давно не использованные результаты, пока файлы не уложатся в max_bytes.
+        """
+        if self.size <= self.max_bytes:
+            return
+        for name, _ in sorted(self._entries.items(), key=lambda item: item[1]['used']):
+            if self.size <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            self._drop(name)
+            self.evictions += 1
+
+    def _drop(self, name: str):
+        entry = self._entries.pop(name)
+        self.size -= entry['bytes']
+        _remove_file(os.path.join(self.cache_dir, name))
+        self._changed()
+
+    def _changed(self):
+        self._changes += 1
+        if self._changes >= INDEX_SAVE_EVERY:
+            self._save()
+
+    def _save(self):
+        tmp_file = f'{self.index_file}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp_file, self.index_file)
+            self._changes = 0
+        except OSError as e:
+            self._log("WARNING", f"Не удалось сохранить индекс кэша {self.index_file}: {e}")
+
+    def _log(self, level: str, message: str):
+        if self.logger is not None:
+            self.logger.log(level, message)
+
+
+def _entry_name(table: str, query_key: str) -> str:
+    digest = hashlib.sha1(json.dumps([table, query_key], ensure_ascii=False).encode('utf-8')).hexdigest()
+    return digest + DISK_ENTRY_EXT
+
+
+def _read_header(view: memoryview) -> dict:
+    magic, length = DISK_HEADER.unpack_from(view, 0)
+    if magic != DISK_MAGIC:
+        raise ValueError('неизвестная сигнатура файла')
+    header = json.loads(str(view[DISK_HEADER.size:DISK_HEADER.size + length], 'utf-8'))
+    header['length'] = length
+    return header
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        # файл уже удалён или открыт (Windows) — его место займёт следующая запись
+        pass
+
+
+def estimate_size(result) -> int:
+    """
+    Размер результата в байтах — длина его JSON-представления.
+    """
+    return len(json.dumps(result))
@@ -0,0 +1,357 @@
+import os
+import csv
+import json
+import threading
+from itertools import islice
+
+from indexes import INDEX_DIR, INDEX_EXT
+from schema import SAMPLE_ROWS, infer_types, load_overrides
+from stats import STATS_FILE, TableStats
+from storage import META_FILE, STORE_FORMAT, iter_csv_records, table_version, version_dir
+
+
+# каталог лежит в папке базы; имя с точкой, чтобы не путать его с таблицами
+CATALOG_FILE = '.catalog.json'
+CATALOG_VERSION = 6
+
+# как часто фоновый поток сверяет время изменения и размер table.csv, в секундах
+POLL_INTERVAL = 2.0
+
+
+class Catalog:
+    """
+    Каталог таблиц: для каждой таблицы колонки, их типы, число строк,
+    индексированные колонки, сводка статистики и версия таблицы (время изменения
+    и размер table.csv, число сегментов). Хранится в памяти и в CATALOG_FILE,
+    поэтому после перезапуска заголовки читаются только у изменившихся таблиц.
+
+    Фоновый поток раз в poll_interval секунд сверяет версии файлов
+    (stat table.csv и список сегментов) и перечитывает только изменившиеся.
+    Запросы и GET_STRUCTURE берут таблицы из памяти, без обхода папки.
+    Число строк известно, когда таблица уже сконвертирована
+    в колоночный вид (ColumnStore сообщает о ней через record); до этого
+    типы колонок определяются по первым строкам table.csv и schema.json.
+    Индексы и статистику сообщают IndexManager и StatsManager.
+
+    Записи не меняются на месте: изменение собирает новый словарь таблиц
+    и подменяет self._tables под блокировкой, поэтому читатели её не берут.
+    Изменения из запросов сохраняются на диск пачкой при следующей сверке.
+    """
+
+    def __init__(self, database_path: str, poll_interval: float = POLL_INTERVAL, logger=None):
+        self.db_path = database_path
+        self.catalog_file = os.path.join(database_path, CATALOG_FILE)
+        self.poll_interval = poll_interval
+        self.logger = logger
+        self._tables = self._load()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._stop = threading.Event()
+        self._thread = None
+
+        # статистика
+        self.refreshes = 0
+        self.reloaded = 0
+
+        self.refresh()
+
+    def start(self):
+        """
+        Запускает фоновую сверку версий таблиц.
+        """
+        if self._thread is None and self.poll_interval:
+            self._thread = threading.Thread(target=self._poll, name='catalog-poller', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+    def csv_path(self, table_name: str) -> str:
+        return os.path.join(self.db_path, table_name, 'table.csv')
+
+    def get(self, table_name: str):
+        """
+        Запись каталога {'version', 'columns', 'types', 'rows'} или None.
+        """
+        return self._tables.get(table_name)
+
+    def resolve(self, table_name: str) -> str:
+        """
+        Путь к table.csv известной таблицы. Таблицу, которой ещё нет в каталоге
+        (создана после последней сверки), ищет на диске.
+        """
+        if table_name not in self._tables and self.refresh_table(table_name) is None:
+            raise FileNotFoundError(f'Файл таблицы не найден: {self.csv_path(table_name)}')
+        return self.csv_path(table_name)
+
+    def structure(self) -> dict:
+        """
+        {таблица: [колонки]} для GET_STRUCTURE.
+        """
+        return {name: list(entry['columns']) for name, entry in sorted(self._tables.items())}
+
+    def describe(self) -> dict:
+        """
+        {таблица: {'rows', 'types'}} — то, что известно без чтения таблиц.
+        """
+        return {
+            name: {'rows': entry['rows'], 'types': entry['types']}
+            for name, entry in sorted(self._tables.items())
+        }
+
+    def indexes(self) -> dict:
+        """
+        {таблица: [индексированные колонки]} для GET_STRUCTURE.
+        """
+        return {name: list(entry['indexes']) for name, entry in sorted(self._tables.items()) if entry['indexes']}
+
+    def table_stats(self) -> dict:
+        """
+        {таблица: сводка статистики} по таблицам, для текущей версии которых она уже посчитана.
+        """
+        return {name: entry['stats'] for name, entry in sorted(self._tables.items()) if entry['stats'] is not None}
+
+    def stats(self) -> dict:
+        return {'tables': len(self._tables), 'refreshes': self.refreshes, 'reloaded': self.reloaded}
+
+    def refresh(self) -> int:
+        """
+        Сверяет каталог с папкой базы: новые и изменившиеся таблицы перечитывает,
+        удалённые убирает. Возвращает число изменений. Таблицы читаются без блокировки,
+        чтобы сверка не задерживала запросы; блокировка нужна только для подмены записей.
+        """
+        found = {}
+        try:
+            entries = list(os.scandir(self.db_path))
+        except OSError as e:
+            self._log("ERROR", f"Не удалось прочитать папку базы {self.db_path}: {e}")
+            return 0
+
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.is_dir():
+                continue
+            try:
+                found[entry.name] = table_version(self.csv_path(entry.name))
+            except OSError:
+                continue  # пропускаем папки без table.csv
+
+        known = self._tables
+        read = {}
+        for name, version in found.items():
+            current = known.get(name)
+            if current is None or current['version'] != version:
+                read[name] = self._read_table(name, version)
+
+        changed = 0
+        with self._lock:
+            tables = dict(self._tables)
+            for name in known:
+                # запись, которую за это время обновил запрос, не трогаем
+                if name not in found and tables.get(name) is known[name]:
+                    del tables[name]
+                    changed += 1
+            for name, table in read.items():
+                if tables.get(name) is not known.get(name):
+                    continue
+                if table is None:
+                    tables.pop(name, None)
+                else:
+                    tables[name] = table
+                    self.reloaded += 1
+                changed += 1
+            self._tables = tables
+            self.refreshes += 1
+            self._dirty = self._dirty or bool(changed)
+        self.flush()
+        return changed
+
+    def refresh_table(self, table_name: str):
+        """
+        Перечитывает одну таблицу, если её table.csv изменился. Возвращает запись или None.
+        """
+        try:
+            version = table_version(self.csv_path(table_name))
+        except OSError:
+            version = None
+
+        current = self._tables.get(table_name)
+        if current is None and version is None:
+            # таблицы нет ни на диске, ни в каталоге — менять нечего
+            return None
+        if current is not None and current['version'] == version:
+            return current
+
+        table = self._read_table(table_name, version) if version is not None else None
+        with self._lock:
+            if self._tables.get(table_name) is not current:
+                # запись уже обновили параллельно
+                return self._tables.get(table_name)
+            tables = dict(self._tables)
+            if table is None:
+                tables.pop(table_name, None)
+            else:
+                tables[table_name] = table
+                self.reloaded += 1
+            self._tables = tables
+            self._dirty = True
+        return table
+
+    def record(self, table):
+        """
+        Сведения о версии таблицы, открытой ColumnStore: колонки, типы и число строк.
+        """
+        with self._lock:
+            current = self._tables.get(table.name)
+            entry = {
+                'version': table.version,
+                'columns': list(table.columns),
+                'types': dict(table.types),
+                'rows': table.row_count,
+                'indexes': current['indexes'] if current is not None else [],
+                # сводка статистики прежней версии к этой не подходит
+                'stats': current['stats'] if current is not None and current['version'] == table.version else None
+            }
+            if current == entry:
+                return
+            self._update(table.name, entry)
+
+    def record_index(self, table_name: str, column: str):
+        """
+        По колонке таблицы построен индекс (CREATE INDEX).
+        """
+        with self._lock:
+            current = self._tables.get(table_name)
+            if current is None or column in current['indexes']:
+                return
+            self._update(table_name, dict(current, indexes=sorted(current['indexes'] + [column])))
+
+    def record_stats(self, table_name: str, version: list, summary: dict):
+        """
+        Посчитана статистика версии version таблицы (сводка для GET_STRUCTURE).
+        """
+        with self._lock:
+            current = self._tables.get(table_name)
+            if current is None or current['version'] != version or current['stats'] == summary:
+                return
+            self._update(table_name, dict(current, stats=summary))
+
+    def flush(self):
+        """
+        Сохраняет каталог на диск, если он менялся с прошлого сохранения.
+        """
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                tables = self._tables
+                self._dirty = False
+            self._save(tables)
+
+    def _update(self, table_name: str, entry: dict):
+        """
+        Подменяет запись таблицы. Вызывается под self._lock; на диск запись попадёт при flush.
+        """
+        tables = dict(self._tables)
+        tables[table_name] = entry
+        self._tables = tables
+        self._dirty = True
+
+    def _read_table(self, table_name: str, version: list):
+        """
+        Запись каталога для версии таблицы: колонки, типы и число строк из колоночного
+        хранилища, если эта версия уже сконвертирована, иначе заголовок table.csv
+        и типы по первым SAMPLE_ROWS строкам. Индексы — по файлам <table>/indexes,
+        статистика — из stats.json этой версии, если она уже посчитана.
+        """
+        csv_file = self.csv_path(table_name)
+        indexes = self._read_indexes(table_name)
+        try:
+            with open(os.path.join(version_dir(csv_file, version), META_FILE), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('format') != STORE_FORMAT or meta['version'] != version:
+                # строки новых сегментов ещё не дописаны в колонки или каталог будет собран заново
+                raise ValueError(meta['version'])
+            return {
+                'version': version,
+                'columns': [col['name'] for col in meta['columns']],
+                'types': {col['name']: col['type'] for col in meta['columns']},
+                'rows': meta['rows'],
+                'indexes': indexes,
+                'stats': self._read_stats(csv_file, version)
+            }
+        except (OSError, ValueError, KeyError):
+            pass
+
+        try:
+            records = iter_csv_records(csv_file)
+            headers = next(records, (0, None))[1]
+            sample = [record for _, record in islice(records, SAMPLE_ROWS)]
+            overrides = load_overrides(os.path.dirname(csv_file))
+        except (OSError, UnicodeDecodeError, csv.Error, ValueError) as e:
+            self._log("ERROR", f"Ошибка при чтении {csv_file}: {e}")
+            return None
+        if not headers:
+            return None
+        types = dict(zip(headers, infer_types(headers, sample, overrides)))
+        return {
+            'version': version,
+            'columns': headers,
+            'types': types,
+            'rows': None,
+            'indexes': indexes,
+            'stats': None
+        }
+
+    def _read_indexes(self, table_name: str) -> list:
+        try:
+            names = os.listdir(os.path.join(self.db_path, table_name, INDEX_DIR))
+        except OSError:
+            return []
+        return sorted(name[:-len(INDEX_EXT)] for name in names if name.endswith(INDEX_EXT))
+
+    def _read_stats(self, csv_file: str, version: list):
+        try:
+            with open(os.path.join(version_dir(csv_file, version), STATS_FILE), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data['version'] != version:
+                # статистика без дописанных строк досчитается при следующем запросе
+                return None
+            return TableStats(data).summary()
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _load(self) -> dict:
+        try:
+            with open(self.catalog_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('version') != CATALOG_VERSION:
+            return {}
+        return data.get('tables', {})
+
+    def _save(self, tables: dict):
+        """
+        Записывает каталог атомарно: во временный файл, затем переименование.
+        Вызывается под self._save_lock.
+        """
+        tmp_file = f'{self.catalog_file}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'version': CATALOG_VERSION, 'tables': tables}, f)
+            os.replace(tmp_file, self.catalog_file)
+        except OSError as e:
+            self._log("WARNING", f"Не удалось сохранить каталог {self.catalog_file}: {e}")
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                self._log("ERROR", f"Ошибка при обновлении каталога: {e}")
+
+    def _log(self, level: str, message: str):
+        if self.logger is not None:
+            self.logger.log(level, message)
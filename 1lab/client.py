@@ -1,8 +1,12 @@
+import re
 import socket
-import struct
 import json
 import sys
 
+from wire import (
+    is_binary, decode_rows, pack_frame, unpack_frame_header, frame_body, tag_request, untag_request,
+    MAX_RESULT_BYTES
+)
 
 try:
     from tabulate import tabulate
@@ -11,11 +15,82 @@ except ImportError:
     USE_TABULATE = False
 
 
+# COPY table FROM файл [HEADER]: клиент читает файл сам и отправляет его серверу кусками
+COPY_PATTERN = re.compile(r'^copy\s+(?P<table>\w+)\s+from\s+(?P<path>.+?)(?:\s+(?:with\s+)?(?P<header>header))?$', re.IGNORECASE)
+# символов файла в одном куске COPY_DATA
+COPY_CHUNK_CHARS = 1 << 20
+
+
+def split_commands(text: str) -> list:
+    """
+    Делит ввод на команды по ';' вне строк в одинарных и двойных кавычках,
+    чтобы ';' внутри значения INSERT или условия WHERE не разрезал команду.
+    Удвоенная кавычка ('it''s') закрывает и снова открывает строку, поэтому тоже учитывается.
+    """
+    parts = []
+    quote = None
+    start = 0
+    for i, char in enumerate(text):
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char == ';':
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+class _Response:
+    """
+    Сборка одного ответа конвейера из кадров: заголовок JSON, затем
+    кадры потока до 'end' или двоичный кадр со строками.
+    """
+
+    def __init__(self):
+        self.response = None
+        self.streaming = False
+
+    def feed(self, data: bytes) -> bool:
+        """
+        Добавляет кадр; True, когда ответ собран.
+        """
+        if self.response is None:
+            self.response = json.loads(data)
+            self.streaming = bool(self.response.pop('stream', False))
+            if self.streaming:
+                self.response['result'] = []
+            return not self.streaming and not self.response.get('binary')
+
+        if not self.streaming:
+            self.response.pop('binary')
+            self.response['result'] = decode_rows(data)
+            return True
+
+        if is_binary(data):
+            self.response['result'].extend(decode_rows(data))
+            return False
+        frame = json.loads(data)
+        if frame.get('status') == 'error':
+            self.response.update(status='error', message=frame.get('message'))
+            return True
+        self.response['result'].extend(frame.get('rows', []))
+        return bool(frame.get('end'))
+
+
 class Client:
-    def __init__(self, host='localhost', port=7777):
+    def __init__(self, host='localhost', port=7777, max_decompressed_bytes=MAX_RESULT_BYTES):
         self.host = host
         self.port = port
+        # во сколько байт можно распаковать сжатый кадр ответа
+        self.max_decompressed_bytes = max_decompressed_bytes
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.capabilities = {}
+        self.compression = None
+        self.pipelining = False
+        self.next_request_id = 0
 
 
     def authenticate(self):
@@ -34,11 +109,21 @@ class Client:
                 self.connect()
 
             try:
-                auth_data = json.dumps({'username': username, 'password': password})
+                # сообщение входа и ответ на него всегда без сжатия
+                self.compression = None
+                self.pipelining = False
+                auth_data = json.dumps({
+                    'username': username,
+                    'password': password,
+                    'capabilities': {'stream': True, 'format': 'binary', 'compression': True, 'pipeline': True}
+                })
                 self.send_message(auth_data)
                 response = json.loads(self.recv_message())
 
                 if response.get("status") == "ok":
+                    self.capabilities = response.get('capabilities', {})
+                    self.compression = self.capabilities.get('compression')
+                    self.pipelining = bool(self.capabilities.get('pipeline'))
                     print("✅ Успешный вход!")
                     return True
                 else:
@@ -55,15 +140,95 @@ class Client:
     def connect(self):
         try:
             self.socket.connect((self.host, self.port))
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         except ConnectionRefusedError:
             print("❌ Не удалось подключиться к серверу. Убедитесь, что сервер запущен.")
             sys.exit(1)
 
 
-    def send_message(self, message: str):
-        encoded = message.encode('utf-8')
-        length = struct.pack('!I', len(encoded))
-        self.socket.sendall(length + encoded)
+    def send_message(self, message: str) -> int:
+        """
+        Отправляет команду. В конвейере кадр получает следующий номер запроса,
+        который и возвращается.
+        """
+        data = message.encode('utf-8')
+        request_id = None
+        if self.pipelining:
+            request_id = self.next_request_id
+            self.next_request_id = (self.next_request_id + 1) & 0xFFFFFFFF
+            data = tag_request(request_id, data)
+        self.socket.sendall(pack_frame(data, self.compression))
+        return request_id
+
+
+    def pipeline(self, commands: list) -> list:
+        """
+        Отправляет все команды сразу и собирает ответы, которые сервер
+        может прислать в любом порядке. Возвращает ответы в порядке команд;
+        строки потокового или двоичного результата собраны в 'result'.
+        Без согласованного конвейера команды выполняются по очереди.
+        """
+        if not self.pipelining:
+            responses = []
+            for command in commands:
+                self.send_message(command)
+                responses.append(self._collect(self.recv_frame))
+            return responses
+
+        pending = {self.send_message(command): i for i, command in enumerate(commands)}
+        responses = [None] * len(commands)
+        # ответ собран, когда пришёл заголовок и все его кадры со строками
+        states = {}
+        while pending:
+            request_id, data = self.recv_tagged()
+            if data is None:
+                raise ConnectionResetError("Соединение с сервером разорвано.")
+            state = states.setdefault(request_id, _Response())
+            if state.feed(data):
+                responses[pending.pop(request_id)] = state.response
+                del states[request_id]
+        return responses
+
+
+    def copy_file(self, table: str, path: str, header: bool = False) -> dict:
+        """
+        COPY table FROM файл: отправляет локальный csv кусками COPY_DATA
+        (в конвейере — по несколько сразу) и возвращает ответ сервера на COPY_END.
+        """
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            self.send_message(f"COPY {table} FROM STDIN{' HEADER' if header else ''}")
+            response = self._collect(self.recv_frame)
+            if response.get('status') != 'ok':
+                return response
+
+            copy_id = response['copy_id']
+            batch_size = self.capabilities.get('max_in_flight', 1) if self.pipelining else 1
+            seq = 0
+            while True:
+                batch = []
+                for data in iter(lambda: f.read(COPY_CHUNK_CHARS), ''):
+                    batch.append(json.dumps({'command': 'COPY_DATA', 'copy_id': copy_id, 'seq': seq, 'data': data}))
+                    seq += 1
+                    if len(batch) >= batch_size:
+                        break
+                if not batch:
+                    break
+                for response in self.pipeline(batch):
+                    if response.get('status') != 'ok':
+                        self.pipeline([json.dumps({'command': 'COPY_CANCEL', 'copy_id': copy_id})])
+                        return response
+
+        return self.pipeline([json.dumps({'command': 'COPY_END', 'copy_id': copy_id})])[0]
+
+
+    def _collect(self, recv) -> dict:
+        state = _Response()
+        while True:
+            data = recv()
+            if data is None:
+                raise ConnectionResetError("Соединение с сервером разорвано.")
+            if state.feed(data):
+                return state.response
 
 
     def register_user(self):
@@ -107,22 +272,188 @@ class Client:
     def print_help(self):
         print("\n📘 Доступные команды:")
         print("  ▶ SQL-запрос: например, SELECT * FROM people WHERE age >= 25")
+        print("    WHERE поддерживает AND, OR, NOT, скобки, IN (...) и BETWEEN ... AND ...")
+        print("    COUNT/SUM/AVG/MIN/MAX и GROUP BY col, ... — агрегация на сервере")
+        print("    ORDER BY col [ASC|DESC], ... — сортировка на сервере")
+        print("    LIMIT n [OFFSET m] — только первые n строк, начиная с m-й")
+        print("    FROM a JOIN b ON a.x = b.y — соединение таблиц (колонки: a.col или col)")
+        print("  ▶ CREATE INDEX ON table(column) — создать индекс по колонке")
+        print("  ▶ INSERT INTO table [(col, ...)] VALUES ('text', 10), ... — добавить строки")
+        print("  ▶ COPY table FROM файл.csv [HEADER] — загрузить строки из локального csv")
         print("  ▶ GET_STRUCTURE — показать структуру базы данных")
+        print("  ▶ INDEX_STATS — память и время построения хэш-индексов")
+        print("  ▶ SCHEDULER_STATS — очередь и пул выполнения запросов")
+        print("  ▶ CACHE_STATS — попадания, промахи и вытеснения кэша")
+        print("  ▶ Несколько команд через ';' отправляются сразу, не дожидаясь ответов")
         print("  ▶ EXIT — завершить работу\n")
 
 
+    def print_rows(self, result: list, show_headers: bool = True):
+        headers = list(result[0].keys())
+        rows = [[row[col] for col in headers] for row in result]
+
+        if USE_TABULATE:
+            print(tabulate(rows, headers if show_headers else (), tablefmt="grid"))
+        else:
+            if show_headers:
+                print(", ".join(headers))
+            for row in rows:
+                print(", ".join(str(cell) for cell in row))
+
+
+    def receive_stream(self, header: dict) -> bool:
+        """
+        Принимает потоковый результат и печатает его по мере прихода кадров.
+        Возвращает False, если соединение оборвалось.
+        """
+        first = True
+        while True:
+            response = self.recv_frame()
+            if response is None:
+                print("🔌 Соединение с сервером разорвано.")
+                return False
+
+            if is_binary(response):
+                frame = {'rows': decode_rows(response)}
+            else:
+                frame = json.loads(response)
+            if frame.get('status') == 'error':
+                print("⚠️ Ошибка:", frame.get('message'))
+                return True
+
+            if frame.get('end'):
+                if frame.get('count'):
+                    print(f"📊 Всего строк: {frame.get('count')}")
+                else:
+                    print("📭 Запрос выполнен. Результатов нет.")
+                if header.get('cached'):
+                    print("🧠 [Результат получен из кэша]")
+                return True
+
+            rows = frame.get('rows', [])
+            if rows:
+                if first:
+                    print("📥 Результаты запроса:")
+                self.print_rows(rows, show_headers=first)
+                first = False
+
+
     def recv_message(self) -> str:
-        raw_length = self.socket.recv(4)
-        if not raw_length:
-            return None
-        length = struct.unpack('!I', raw_length)[0]
-        data = b''
-        while len(data) < length:
-            packet = self.socket.recv(length - len(data))
+        data = self.recv_frame()
+        return data.decode('utf-8') if data is not None else None
+
+
+    def recv_frame(self) -> bytes:
+        """
+        Принимает один кадр: текст JSON или двоичные строки результата.
+        Сжатый кадр (флаг в заголовке) распаковывается.
+        """
+        return self.recv_tagged()[1]
+
+
+    def recv_tagged(self) -> tuple:
+        """
+        (номер запроса, тело кадра); номер None, если конвейер не согласован.
+        """
+        header = self.recv_exact(4)
+        if len(header) < 4:
+            return None, None
+        length, compressed = unpack_frame_header(header)
+        data = frame_body(self.recv_exact(length), compressed, self.max_decompressed_bytes)
+        if self.pipelining:
+            return untag_request(data)
+        return None, data
+
+
+    def recv_exact(self, size: int) -> bytes:
+        chunks = []
+        received = 0
+        while received < size:
+            packet = self.socket.recv(min(size - received, 1 << 20))
             if not packet:
                 break
-            data += packet
-        return data.decode('utf-8')
+            chunks.append(packet)
+            received += len(packet)
+        return b''.join(chunks)
+
+
+    def recv_result(self, response_data: dict) -> list:
+        """
+        Строки ответа без потока: из JSON или из следующего двоичного кадра.
+        """
+        if response_data.get('binary'):
+            return decode_rows(self.recv_frame())
+        return response_data.get('result', [])
+
+
+    def show_response(self, cmd: str, response_data: dict) -> bool:
+        """
+        Печатает ответ на команду. Возвращает False, если соединение оборвалось.
+        """
+        if response_data.get('stream'):
+            return self.receive_stream(response_data)
+
+        elif response_data.get('status') == 'error':
+            print("⚠️ Ошибка:", response_data.get('message'))
+
+        elif response_data.get('status') == 'busy':
+            print(f"⏳ {response_data.get('message')} Повторите через {response_data.get('retry_after')} с.")
+
+        elif cmd.upper() == "CACHE_STATS":
+            print("📥 Кэш результатов:")
+            self.print_rows([response_data.get('cache_stats', {})])
+
+        elif cmd.upper() == "SCHEDULER_STATS":
+            print("📥 Планировщик запросов:")
+            self.print_rows([response_data.get('scheduler_stats', {})])
+            if response_data.get('shared_scan_stats'):
+                print("📥 Общие сканы таблиц:")
+                self.print_rows([response_data['shared_scan_stats']])
+            if response_data.get('vector_stats'):
+                print("📥 Векторный движок:")
+                self.print_rows([response_data['vector_stats']])
+
+        elif 'message' in response_data:
+            print("✅", response_data.get('message'))
+
+        elif cmd.upper() == "INDEX_STATS":
+            stats = response_data.get('index_stats', [])
+            if not stats:
+                print("📭 Хэш-индексы ещё не построены.")
+            else:
+                print("📥 Хэш-индексы:")
+                self.print_rows(stats)
+
+        elif cmd.upper() == "GET_STRUCTURE":
+            print("\n📊 Структура базы данных:")
+            indexes = response_data.get('indexes', {})
+            stats = response_data.get('stats', {})
+            tables = response_data.get('tables', {})
+            for table, columns in response_data.get('structure', {}).items():
+                types = tables.get(table, {}).get('types') or {}
+                print(f"  📁 {table}: {', '.join(f'{col} {types[col]}' if col in types else col for col in columns)}")
+                if indexes.get(table):
+                    print(f"     🔎 индексы: {', '.join(indexes[table])}")
+                if stats.get(table):
+                    distinct = ', '.join(
+                        f"{col} ~{info['distinct']}" for col, info in stats[table]['columns'].items()
+                    )
+                    print(f"     📈 строк: {stats[table]['rows']}; различных значений: {distinct}")
+                elif tables.get(table, {}).get('rows') is not None:
+                    print(f"     📈 строк: {tables[table]['rows']}")
+
+        else:
+            result = self.recv_result(response_data)
+            if not result:
+                print("📭 Запрос выполнен. Результатов нет.")
+            else:
+                print("📥 Результаты запроса:")
+                self.print_rows(result)
+
+                if response_data.get('cached'):
+                    print("🧠 [Результат получен из кэша]")
+
+        return True
 
 
     def run(self):
@@ -171,6 +502,26 @@ class Client:
                     self.print_help()
                     continue
 
+                copy_match = COPY_PATTERN.match(cmd)
+                if copy_match and copy_match.group('path').lower() != 'stdin':
+                    try:
+                        response_data = self.copy_file(
+                            copy_match.group('table'), copy_match.group('path').strip('\'"'), bool(copy_match.group('header'))
+                        )
+                    except (FileNotFoundError, PermissionError, IsADirectoryError, UnicodeDecodeError) as e:
+                        print("⚠️ Не удалось прочитать файл:", e)
+                        continue
+                    self.show_response(cmd, response_data)
+                    continue
+
+                parts = split_commands(cmd)
+                if len(parts) > 1:
+                    commands = [c.strip() for c in parts if c.strip()]
+                    for command, response_data in zip(commands, self.pipeline(commands)):
+                        print(f"\n▶ {command}")
+                        self.show_response(command, response_data)
+                    continue
+
                 self.send_message(cmd)
                 response = self.recv_message()
 
@@ -178,34 +529,8 @@ class Client:
                     print("🔌 Соединение с сервером разорвано.")
                     break
 
-                response_data = json.loads(response)
-
-                if response_data.get('status') == 'error':
-                    print("⚠️ Ошибка:", response_data.get('message'))
-
-                elif cmd.upper() == "GET_STRUCTURE":
-                    print("\n📊 Структура базы данных:")
-                    for table, columns in response_data.get('structure', {}).items():
-                        print(f"  📁 {table}: {', '.join(columns)}")
-
-                else:
-                    result = response_data.get('result', [])
-                    if not result:
-                        print("📭 Запрос выполнен. Результатов нет.")
-                    else:
-                        print("📥 Результаты запроса:")
-                        headers = result[0].keys()
-                        rows = [[row[col] for col in headers] for row in result]
-
-                        if USE_TABULATE:
-                            print(tabulate(rows, headers, tablefmt="grid"))
-                        else:
-                            print(", ".join(headers))
-                            for row in rows:
-                                print(", ".join(str(cell) for cell in row))
-
-                        if response_data.get('cached'):
-                            print("🧠 [Результат получен из кэша]")
+                if not self.show_response(cmd, json.loads(response)):
+                    break
 
         except Exception as e:
             print("❗ Ошибка:", e)
@@ -0,0 +1,438 @@
+import os
+import sys
+import time
+import struct
+import bisect
+import threading
+from array import array
+from collections import OrderedDict
+
+from schema import typed_constant
+from storage import ColumnStore, ColumnTable, appended_version
+
+
+INDEX_DIR = 'indexes'
+INDEX_EXT = '.idx'
+
+# заголовок файла индекса: сигнатура, версия таблицы (mtime, размер, число сегментов, поколение типов), число строк
+INDEX_HEADER = struct.Struct('=8sqqqqq')
+INDEX_MAGIC = b'1LABIDX5'
+
+RANGE_OPERATORS = {'=', '<', '<=', '>', '>=', 'between'}
+
+
+class SortedIndex:
+    """
+    Отсортированный индекс по колонке: номера строк в порядке возрастания значения.
+    Диапазоны ищутся бинарным поиском.
+    """
+
+    def __init__(self, column: str, version: list, positions: array):
+        self.column = column
+        self.version = version
+        self.positions = positions
+
+    def lookup(self, values, op: str, value) -> list:
+        """
+        Возвращает номера строк (в исходном порядке), для которых
+        выполняется условие `values[row] op value`.
+        Для 'between' value — пара [low, high].
+        """
+        key = values.__getitem__
+        lo, hi = 0, len(self.positions)
+
+        if op == 'between':
+            low, high = value
+            lo = bisect.bisect_left(self.positions, low, key=key)
+            hi = bisect.bisect_right(self.positions, high, lo=lo, key=key)
+        elif op in ('=', '>='):
+            lo = bisect.bisect_left(self.positions, value, key=key)
+        elif op == '>':
+            lo = bisect.bisect_right(self.positions, value, key=key)
+
+        if op in ('=', '<='):
+            hi = bisect.bisect_right(self.positions, value, lo=lo, key=key)
+        elif op == '<':
+            hi = bisect.bisect_left(self.positions, value, lo=lo, key=key)
+
+        return sorted(self.positions[lo:hi])
+
+
+class HashIndex:
+    """
+    Хэш-индекс по колонке: значение -> номер строки (или список номеров).
+    Номер строки — позиция в файлах колонок, по нему строка читается напрямую.
+    """
+
+    def __init__(self, table_name: str, column: str, version: list, values):
+        self.table_name = table_name
+        self.column = column
+        self.version = version
+        self.hits = 0
+
+        started = time.perf_counter()
+        self.mapping = {}
+        self.rows = 0
+        self._add(values, 0)
+        self.build_time = time.perf_counter() - started
+        self.memory = _mapping_size(self.mapping)
+
+    def extend(self, values, version: list):
+        """
+        Добавляет в индекс строки, дописанные в таблицу после self.rows.
+        Номера новых строк больше старых, поэтому списки остаются упорядоченными,
+        а читатели прежней версии отсекают их по своему числу строк (lookup(limit=...)).
+        Списки дописываются на месте, поэтому наружу отдаются только их копии.
+        """
+        size = sys.getsizeof(self.mapping)
+        self.memory += self._add(values[self.rows:], self.rows) + sys.getsizeof(self.mapping) - size
+        self.version = version
+
+    def _add(self, values, start: int) -> int:
+        """
+        Вносит values как строки start, start + 1, ... и возвращает, на сколько байт вырос индекс
+        (без роста самой хэш-таблицы).
+        """
+        mapping = self.mapping
+        grown = 0
+        for i, value in enumerate(values, start):
+            rows = mapping.get(value)
+            if rows is None:
+                # у ключевых колонок значения уникальны, список не нужен
+                mapping[value] = i
+                grown += sys.getsizeof(value) + sys.getsizeof(i)
+            elif isinstance(rows, int):
+                mapping[value] = [rows, i]
+                grown += sys.getsizeof(mapping[value]) - sys.getsizeof(rows)
+            else:
+                rows.append(i)
+        self.rows = start + len(values)
+        return grown
+
+    def lookup(self, value, limit: int) -> list:
+        """
+        Номера строк со значением value, меньшие limit (числа строк версии таблицы,
+        которую читает запрос). Возвращается новый список: extend дописывает
+        списки индекса, пока запрос ещё читает результат.
+        """
+        self.hits += 1
+        rows = self.mapping.get(value)
+        if rows is None:
+            return []
+        if isinstance(rows, int):
+            return [rows] if rows < limit else []
+        return rows[:bisect.bisect_left(rows, limit)]
+
+    def stats(self) -> dict:
+        return {
+            'table': self.table_name,
+            'column': self.column,
+            'rows': self.rows,
+            'keys': len(self.mapping),
+            'memory_bytes': self.memory,
+            'build_ms': round(self.build_time * 1000, 3),
+            'hits': self.hits
+        }
+
+
+class HashIndexManager:
+    """
+    Хэш-индексы в памяти для точечных запросов WHERE col = value и col IN (...).
+    Индекс строится лениво при первом обращении к колонке через '='
+    и выбрасывается при изменении таблицы или нехватке памяти.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._indexes = OrderedDict()
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, table: ColumnTable, condition: dict):
+        """
+        Возвращает номера строк для условия равенства или None, если индекс неприменим.
+        """
+        column = condition['column']
+        op = condition['operator']
+        values = condition['value'] if op == 'in' else [condition['value']]
+
+        if op not in ('=', 'in') or not all(_index_applicable(table, column, v) for v in values):
+            return None
+
+        values = [_index_value(table, column, v) for v in values]
+        index = self.get(table, column)
+        # индекс может быть уже дописан (или дописываться сейчас) для более новой версии таблицы
+        if op == '=':
+            return index.lookup(values[0], table.row_count)
+
+        rows = set()
+        for value in values:
+            rows.update(index.lookup(value, table.row_count))
+        return sorted(rows)
+
+    def get(self, table: ColumnTable, column: str) -> HashIndex:
+        """
+        Индекс по колонке, построенный для этой версии таблицы или более новой,
+        которая отличается от неё только дописанными строками.
+        """
+        key = (table.name, column)
+        index = self._indexes.get(key)
+        if index is not None and _covers(index.version, table.version):
+            self._touch(key)
+            return index
+
+        with self._key_lock(key):
+            index = self._indexes.get(key)
+            if index is not None and appended_version(index.version, table.version):
+                # в таблицу дописаны строки — добавляем только их
+                index.extend(table.column(column), table.version)
+                with self._lock:
+                    self._evict(keep=key)
+            elif index is None or not _covers(index.version, table.version):
+                index = HashIndex(table.name, column, table.version, table.column(column))
+                with self._lock:
+                    self._indexes[key] = index
+                    self._evict(keep=key)
+        return index
+
+    def stats(self) -> list:
+        with self._lock:
+            return [index.stats() for index in self._indexes.values()]
+
+    def _touch(self, key):
+        with self._lock:
+            if key in self._indexes:
+                self._indexes.move_to_end(key)
+
+    def _key_lock(self, key) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _evict(self, keep):
+        """
+        Удаляет давно не использованные индексы, пока не уложимся в лимит памяти.
+        """
+        total = sum(index.memory for index in self._indexes.values())
+        for key in list(self._indexes):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self._indexes.pop(key).memory
+
+
+class IndexManager:
+    """
+    Управляет вторичными индексами таблиц.
+    Индексы хранятся в <table>/indexes/<column>.idx рядом с table.csv
+    и пересобираются, если версия таблицы поменялась.
+    """
+
+    def __init__(self, database_path: str, column_store: ColumnStore):
+        self.db_path = database_path
+        self.column_store = column_store
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def index_dir(self, table_name: str) -> str:
+        return os.path.join(self.db_path, table_name, INDEX_DIR)
+
+    def index_file(self, table_name: str, column: str) -> str:
+        return os.path.join(self.index_dir(table_name), column + INDEX_EXT)
+
+    def create(self, table_name: str, column: str) -> SortedIndex:
+        """
+        CREATE INDEX ON table(column): строит индекс и сохраняет его на диск.
+        """
+        table = self.column_store.open(table_name)
+        if column not in table.types:
+            raise ValueError(f'Колонка {column} не найдена в таблице {table_name}.')
+
+        os.makedirs(self.index_dir(table_name), exist_ok=True)
+        with self._lock:
+            index = self._build(table, column)
+            self._indexes[(table_name, column)] = index
+        if self.column_store.catalog is not None:
+            self.column_store.catalog.record_index(table_name, column)
+        return index
+
+    def list_indexes(self) -> dict:
+        """
+        Список индексированных колонок по таблицам.
+        """
+        result = {}
+        if not os.path.isdir(self.db_path):
+            return result
+
+        for table_name in os.listdir(self.db_path):
+            index_dir = self.index_dir(table_name)
+            if not os.path.isdir(index_dir):
+                continue
+            columns = sorted(
+                name[:-len(INDEX_EXT)] for name in os.listdir(index_dir)
+                if name.endswith(INDEX_EXT)
+            )
+            if columns:
+                result[table_name] = columns
+        return result
+
+    def get(self, table: ColumnTable, column: str):
+        """
+        Возвращает актуальный индекс по колонке или None, если индекса нет.
+        Если в таблицу только дописаны строки, в индекс вставляются новые строки,
+        иначе устаревший индекс пересобирается.
+        """
+        key = (table.name, column)
+        index = self._indexes.get(key)
+        if index is not None and index.version == table.version:
+            return index
+
+        index_file = self.index_file(table.name, column)
+        if not os.path.isfile(index_file):
+            return None
+
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None and index.version == table.version:
+                return index
+            if index is None or not _covers(index.version, table.version, appended=True):
+                index = self._load(index_file, column, table.version)
+
+            if index is None:
+                index = self._build(table, column)
+            elif index.version != table.version:
+                if appended_version(table.version, index.version):
+                    # индекс уже дописан для более новой версии — этот запрос обойдётся без него
+                    return None
+                index = self._extend(table, index)
+            self._indexes[key] = index
+        return index
+
+    def lookup(self, table: ColumnTable, condition: dict):
+        """
+        Пытается ответить на условие WHERE через индекс.
+        Возвращает список номеров строк или None, если индекс неприменим.
+        """
+        column = condition['column']
+        op = condition['operator']
+        value = condition['value']
+
+        if op not in RANGE_OPERATORS:
+            return None
+        if not all(_index_applicable(table, column, v) for v in (value if op == 'between' else [value])):
+            return None
+
+        index = self.get(table, column)
+        if index is None:
+            return None
+        if op == 'between':
+            value = [_index_value(table, column, v) for v in value]
+        else:
+            value = _index_value(table, column, value)
+        return index.lookup(table.column(column), op, value)
+
+    def _build(self, table: ColumnTable, column: str) -> SortedIndex:
+        values = table.column(column)
+        positions = array('q', sorted(range(table.row_count), key=values.__getitem__))
+        return self._save(table, column, positions)
+
+    def _extend(self, table: ColumnTable, index: SortedIndex) -> SortedIndex:
+        """
+        Вставляет в индекс строки, дописанные после построения. Новые строки сортируются
+        отдельно, и места для них ищутся бинарным поиском; старые позиции копируются кусками.
+        Равные значения остаются в порядке номеров строк, как при полной сортировке.
+        """
+        values = table.column(index.column)
+        key = values.__getitem__
+        old = index.positions
+        merged = array('q')
+        prev = 0
+        for row in sorted(range(len(old), table.row_count), key=key):
+            i = bisect.bisect_right(old, values[row], lo=prev, key=key)
+            merged.extend(old[prev:i])
+            merged.append(row)
+            prev = i
+        merged.extend(old[prev:])
+        return self._save(table, index.column, merged)
+
+    def _save(self, table: ColumnTable, column: str, positions: array) -> SortedIndex:
+        index_file = self.index_file(table.name, column)
+        tmp_file = f'{index_file}.{threading.get_ident()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, *table.version, table.row_count))
+            positions.tofile(f)
+        os.replace(tmp_file, index_file)
+
+        return SortedIndex(column, table.version, positions)
+
+    def _load(self, index_file: str, column: str, version: list):
+        """
+        Загружает индекс с диска, если он построен для этой версии таблицы
+        или для версии, отличающейся от неё только дописанными строками.
+        """
+        with open(index_file, 'rb') as f:
+            header = f.read(INDEX_HEADER.size)
+            if len(header) != INDEX_HEADER.size:
+                return None
+            magic, mtime, size, segments, generation, rows = INDEX_HEADER.unpack(header)
+            index_version = [mtime, size, segments, generation]
+            if magic != INDEX_MAGIC or not _covers(index_version, version, appended=True):
+                return None
+
+            positions = array('q')
+            positions.fromfile(f, rows)
+        return SortedIndex(column, index_version, positions)
+
+
+def _covers(index_version: list, version: list, appended: bool = False) -> bool:
+    """
+    Индекс подходит версии таблицы: построен для неё или для более новой версии
+    с дописанными строками; appended — ещё и для более старой, его можно дописать.
+    """
+    return (
+        index_version == version or appended_version(version, index_version)
+        or appended and appended_version(index_version, version)
+    )
+
+
+def _index_applicable(table: ColumnTable, column: str, value) -> bool:
+    """
+    Индекс сравнивает значения как есть, поэтому типы колонки и константы должны совпадать.
+    """
+    if column not in table.types:
+        return False
+
+    col_type = table.types[column]
+    if col_type == 'str':
+        # с числом строки сравниваются как числа — такой случай оставляем полному скану
+        return isinstance(value, str) and not _is_number(value)
+    if col_type == 'date':
+        # даты хранятся строками ISO, константа должна быть такой же датой
+        return typed_constant(col_type, value) == value
+    if col_type == 'bool':
+        return typed_constant(col_type, value) is not None
+    return not isinstance(value, str)
+
+
+def _index_value(table: ColumnTable, column: str, value):
+    """
+    Константа в том виде, в каком значения колонки лежат в индексе: 'true' -> True.
+    """
+    if table.types[column] == 'bool':
+        return typed_constant('bool', value)
+    return value
+
+
+def _mapping_size(mapping: dict) -> int:
+    size = sys.getsizeof(mapping)
+    for key, rows in mapping.items():
+        size += sys.getsizeof(key) + sys.getsizeof(rows)
+    return size
+
+
+def _is_number(value: str) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
@@ -0,0 +1,205 @@
+import sys
+import pickle
+import tempfile
+from operator import itemgetter
+
+from schema import NUMERIC_TYPES
+from planner import compile_predicate
+
+
+# сколько первых строк стороны построения берём, чтобы оценить размер строки в памяти
+SAMPLE_ROWS = 256
+
+# на сколько файлов делятся обе стороны, если сторона построения не помещается в память
+SPILL_PARTITIONS = 16
+
+# сколько раз разделы, которые всё ещё не помещаются, делятся повторно
+MAX_SPILL_DEPTH = 2
+
+# строк в одной записи pickle во временном файле
+SPILL_CHUNK_ROWS = 4096
+
+
+class HashJoin:
+    """
+    Соединение по равенству ключей: строки стороны построения (меньшей)
+    складываются в хэш-таблицу ключ -> [строки], затем строки стороны проверки
+    читаются потоком и для каждой выдаются все пары с тем же ключом.
+    Строки с ключом None ни с чем не соединяются.
+
+    Если сторона построения не помещается в memory_bytes, обе стороны
+    раскладываются по SPILL_PARTITIONS временным файлам по хэшу ключа
+    (grace hash join) и соединяются раздел за разделом; слишком большие
+    разделы делятся ещё раз по следующим битам хэша.
+    """
+
+    def __init__(self, build_key, probe_key, memory_bytes: int = 64 * 1024 * 1024, spill_dir: str = None):
+        """
+        build_key и probe_key — функции строка -> ключ соединения (или None).
+        """
+        self.build_key = build_key
+        self.probe_key = probe_key
+        self.memory_bytes = memory_bytes
+        self.spill_dir = spill_dir
+        self.max_rows = None
+        self.spilled_partitions = 0
+
+    def join(self, build_rows, probe_rows):
+        """
+        Генератор пар (строка построения, строка проверки). Без сброса на диск
+        пары идут в порядке стороны проверки. Временные файлы удаляются,
+        когда генератор дочитан или закрыт.
+        """
+        return self._join(build_rows, probe_rows, 0)
+
+    def _join(self, build_rows, probe_rows, depth: int):
+        build_rows = iter(build_rows)
+        table, overflow = self._build(build_rows, depth)
+        if overflow is None:
+            yield from _probe(table, probe_rows, self.probe_key)
+            return
+
+        # хэш-таблица не поместилась: делим обе стороны по хэшу ключа и соединяем по разделам
+        build_files = self._partition(_chain_table(table, overflow, build_rows), self.build_key, depth)
+        del table
+        probe_files = self._partition(probe_rows, self.probe_key, depth)
+        try:
+            for build_file, probe_file in zip(build_files, probe_files):
+                yield from self._join(_read(build_file), _read(probe_file), depth + 1)
+        finally:
+            for f in build_files + probe_files:
+                f.close()
+
+    def _build(self, rows, depth: int):
+        """
+        Хэш-таблица из строк, пока она помещается в память. Возвращает её
+        и первую не поместившуюся строку (None, если прочитаны все строки).
+        """
+        table = {}
+        limit = sys.maxsize if self.memory_bytes is None or depth >= MAX_SPILL_DEPTH else self.max_rows
+        count = 0
+        build_key = self.build_key
+
+        for row in rows:
+            key = build_key(row)
+            if key is None:
+                continue
+            if limit is None:
+                # размер строки оцениваем по первым строкам, дальше считаем только их число
+                if count < SAMPLE_ROWS:
+                    table.setdefault(key, []).append(row)
+                    count += 1
+                    continue
+                self.max_rows = limit = self._estimate_max_rows(table)
+            if count >= limit:
+                return table, row
+            table.setdefault(key, []).append(row)
+            count += 1
+        return table, None
+
+    def _estimate_max_rows(self, table: dict) -> int:
+        sample = [row for rows in table.values() for row in rows][:SAMPLE_ROWS]
+        row_size = sum(map(_row_size, sample)) / len(sample)
+        return max(SAMPLE_ROWS, int(self.memory_bytes / row_size))
+
+    def _partition(self, rows, key_func, depth: int) -> list:
+        files = [tempfile.TemporaryFile(dir=self.spill_dir) for _ in range(SPILL_PARTITIONS)]
+        buffers = [[] for _ in range(SPILL_PARTITIONS)]
+        # на каждом уровне берём следующую «цифру» хэша, чтобы строки одного раздела
+        # при повторном делении разошлись по разным файлам
+        divisor = SPILL_PARTITIONS ** depth
+        for row in rows:
+            key = key_func(row)
+            if key is None:
+                continue
+            i = hash(key) // divisor % SPILL_PARTITIONS
+            buffer = buffers[i]
+            buffer.append(row)
+            if len(buffer) >= SPILL_CHUNK_ROWS:
+                pickle.dump(buffer, files[i], protocol=pickle.HIGHEST_PROTOCOL)
+                buffer.clear()
+
+        for f, buffer in zip(files, buffers):
+            if buffer:
+                pickle.dump(buffer, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.seek(0)
+        self.spilled_partitions += SPILL_PARTITIONS
+        return files
+
+
+def _probe(table: dict, probe_rows, probe_key):
+    get = table.get
+    for row in probe_rows:
+        matches = get(probe_key(row))
+        if matches is not None:
+            for build_row in matches:
+                yield build_row, row
+
+
+def _chain_table(table: dict, overflow, rows):
+    for matches in table.values():
+        yield from matches
+    yield overflow
+    yield from rows
+
+
+def _read(f):
+    while True:
+        try:
+            chunk = pickle.load(f)
+        except EOFError:
+            return
+        yield from chunk
+
+
+def _row_size(row) -> int:
+    """
+    Примерный размер строки в хэш-таблице, в байтах.
+    """
+    values = row.values() if isinstance(row, dict) else row
+    return sys.getsizeof(row) + sum(map(sys.getsizeof, values)) + 64
+
+
+def join_key(column: str, col_type: str, other_type: str):
+    """
+    Функция строка -> ключ соединения по колонке column. Пустая строка —
+    отсутствующее значение и ключом не считается. Если одна колонка числовая,
+    а другая строковая, строки приводятся к float, как при сравнении в WHERE;
+    даты хранятся строками ISO и сравниваются со строками как есть.
+    """
+    if col_type != 'str':
+        return itemgetter(column)
+
+    if other_type in NUMERIC_TYPES:
+        def key(row):
+            try: return float(row[column])
+            except ValueError: return None
+        return key
+
+    def key(row):
+        value = row[column]
+        return value if value != '' else None
+    return key
+
+
+def compile_pair_filter(condition: dict, types: tuple):
+    """
+    Условие WHERE над парой строк (левая, правая). Листья условия ссылаются
+    на колонку через 'side' (0 или 1) и 'column'; types — типы колонок
+    каждой стороны. Сравнение с отсутствующей колонкой ложно.
+    """
+    op = condition['operator']
+    if op in ('and', 'or', 'not'):
+        args = [compile_pair_filter(arg, types) for arg in condition['args']]
+        if op == 'and':
+            return lambda pair: all(arg(pair) for arg in args)
+        if op == 'or':
+            return lambda pair: any(arg(pair) for arg in args)
+        return lambda pair: not args[0](pair)
+
+    side, column = condition['side'], condition['column']
+    if column not in types[side]:
+        return lambda pair: False
+
+    predicate = compile_predicate(condition, types[side])
+    return lambda pair: predicate(pair[side][column])
@@ -1,11 +1,20 @@
+import argparse
 import threading
 import time
 from server import Server
+from async_server import AsyncServer
 from client import Client
 
 
-def run_server():
-    Server().start()
+# режимы сервера: поток на клиента или asyncio
+SERVER_MODES = {
+    'thread': Server,
+    'async': AsyncServer
+}
+
+
+def run_server(mode='thread'):
+    SERVER_MODES[mode]().start()
 
 
 def run_client():
@@ -13,7 +22,11 @@ def run_client():
 
 
 if __name__ == '__main__':
-    server_thread = threading.Thread(target=run_server, daemon=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--server', choices=SERVER_MODES, default='thread', help='режим работы сервера')
+    args = parser.parse_args()
+
+    server_thread = threading.Thread(target=run_server, args=(args.server,), daemon=True)
     server_thread.start()
 
     print("[MAIN] Сервер запускается...")
@@ -0,0 +1,144 @@
+import os
+import json
+import math
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from storage import ColumnTable, load_column_table
+from planner import CompiledQuery, PlanCache
+from aggregate import HashAggregator
+
+
+# таблицы, уже открытые в процессе-обработчике: путь к версии -> ColumnTable
+_worker_tables = {}
+_WORKER_TABLES_LIMIT = 16
+_worker_plans = PlanCache()
+
+
+class ParallelScanner:
+    """
+    Параллельный скан больших таблиц в пуле процессов.
+    Таблица делится на диапазоны строк (в файлах колонок это байтовые
+    диапазоны, выровненные по границам строк), каждый процесс фильтрует
+    и проецирует свой диапазон, а результаты склеиваются в исходном порядке.
+    Таблицы меньше threshold строк сканируются в одном процессе.
+    """
+
+    def __init__(self, processes: int = None, threshold: int = 500_000, partitions_per_process: int = 4):
+        self.processes = processes or os.cpu_count() or 1
+        self.threshold = threshold
+        self.partitions_per_process = partitions_per_process
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def enabled_for(self, table: ColumnTable) -> bool:
+        return self.processes > 1 and table.row_count >= self.threshold
+
+    def partitions(self, row_count: int) -> list:
+        """
+        Разбивает [0, row_count) на диапазоны примерно равного размера.
+        Диапазонов больше, чем процессов, чтобы выровнять нагрузку.
+        """
+        count = max(1, min(self.processes * self.partitions_per_process, row_count))
+        size = math.ceil(row_count / count) if row_count else 1
+        return [(start, min(start + size, row_count)) for start in range(0, row_count, size)]
+
+    def scan(self, table: ColumnTable, names: list, condition: dict, ranges: list = None):
+        """
+        Генератор строк результата в порядке строк таблицы.
+        ranges — диапазоны, где условие может выполниться (по зоновым картам).
+        """
+        for rows in self._map_partitions(table, ranges, _scan_partition, names, condition, ranges):
+            for values in rows:
+                yield dict(zip(names, values))
+
+    def aggregate(self, table: ColumnTable, names: list, condition: dict, group_size: int, aggregates: list,
+                  ranges: list = None):
+        """
+        Генератор частичных агрегатов {ключ: состояния} по диапазонам таблицы
+        (см. HashAggregator). Их остаётся сложить через HashAggregator.merge().
+        """
+        yield from self._map_partitions(table, ranges, _aggregate_partition, names, condition, ranges, group_size, aggregates)
+
+    def _map_partitions(self, table: ColumnTable, ranges: list, func, *args):
+        """
+        Выполняет func(table_name, path, *args, start, stop) для каждого диапазона
+        и отдаёт результаты в порядке диапазонов. Диапазоны, не пересекающиеся
+        с ranges, не отправляются в пул.
+        """
+        pool = self._get_pool()
+        parts = self.partitions(table.row_count)
+        if ranges is not None:
+            parts = [(start, stop) for start, stop in parts
+                     if any(lo < stop and hi > start for lo, hi in ranges)]
+        parts = iter(parts)
+        pending = deque()
+
+        def submit_next():
+            part = next(parts, None)
+            if part is not None:
+                pending.append(pool.submit(func, table.name, table.path, *args, *part))
+
+        # держим в работе ограниченное число диапазонов, чтобы не копить весь результат
+        for _ in range(self.processes * 2):
+            submit_next()
+
+        try:
+            while pending:
+                result = pending.popleft().result()
+                submit_next()
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: сервер многопоточный, fork в таком процессе небезопасен
+                context = multiprocessing.get_context('spawn')
+                self._pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=context)
+            return self._pool
+
+
+def _scan_partition(table_name: str, path: str, names: list, condition: dict, ranges: list,
+                    start: int, stop: int) -> list:
+    """
+    Выполняется в процессе пула: фильтрует строки [start, stop)
+    и возвращает выбранные колонки кортежами.
+    """
+    table, plan = _worker_plan(table_name, path, names, condition, stop)
+    return list(plan.scan_tuples(table, start, stop, ranges=ranges))
+
+
+def _aggregate_partition(table_name: str, path: str, names: list, condition: dict, ranges: list,
+                         group_size: int, aggregates: list, start: int, stop: int) -> dict:
+    """
+    Выполняется в процессе пула: агрегирует строки [start, stop)
+    и возвращает частичные состояния групп.
+    """
+    table, plan = _worker_plan(table_name, path, names, condition, stop)
+    # частичный результат всё равно передаётся целиком, сбрасывать его на диск незачем
+    aggregator = HashAggregator(group_size, aggregates, memory_bytes=None)
+    aggregator.add_rows(plan.scan_tuples(table, start, stop, ranges=ranges))
+    return aggregator.groups
+
+
+def _worker_plan(table_name: str, path: str, names: list, condition: dict, stop: int):
+    table = _worker_tables.get(path)
+    # в каталог версии дописаны строки новых сегментов — перечитываем meta.json
+    if table is None or table.row_count < stop:
+        if len(_worker_tables) >= _WORKER_TABLES_LIMIT:
+            _worker_tables.clear()
+        table = _worker_tables[path] = load_column_table(table_name, path)
+
+    key = (path, tuple(names), json.dumps(condition, sort_keys=True))
+    plan = _worker_plans.get(key, lambda: CompiledQuery(names, condition, table.types))
+    return table, plan
@@ -0,0 +1,452 @@
+import operator
+import threading
+from functools import partial
+from itertools import compress, islice
+from collections import OrderedDict
+
+from schema import SCHEMA_FILE, typed_constant
+
+
+# сколько строк обрабатывается за один шаг скана
+BLOCK_ROWS = 65536
+
+# операторы с переставленными аргументами: row op value == REVERSED[op](value, row),
+# так константу можно привязать через partial и звать предикат прямо из map()
+REVERSED_OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.gt,
+    '>': operator.lt,
+    '<=': operator.ge,
+    '>=': operator.le
+}
+
+OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge
+}
+
+# грубая оценка доли строк, проходящих условие, пока по таблице нет статистики
+SELECTIVITY = {
+    '=': 0.05,
+    '!=': 0.95,
+    '<': 0.33,
+    '>': 0.33,
+    '<=': 0.33,
+    '>=': 0.33,
+    'between': 0.25
+}
+
+
+class CompiledQuery:
+    """
+    Запрос, один раз скомпилированный под схему таблицы:
+    предикат с уже приведённой константой и список колонок проекции.
+    Строки обрабатываются блоками: маска считается через map(),
+    колонки выбираются через compress/itemgetter, без интерпретации на каждой строке.
+    Составное условие (AND/OR/NOT) превращается в дерево фильтров,
+    которые передают друг другу только ещё не отброшенные номера строк.
+    """
+
+    def __init__(self, names: list, condition: dict, types: dict):
+        self.names = names
+        self.condition = condition
+        self.filter = compile_filter(condition, types) if condition else None
+
+        # одно сравнение считается маской по всему блоку, как и раньше
+        simple = isinstance(self.filter, _Leaf)
+        self.filter_column = self.filter.column if simple else None
+        self.predicate = self.filter.predicate if simple else None
+        self._make_row = partial(zip, names)
+
+    def scan(self, table, start: int, stop: int, first_block: int = BLOCK_ROWS, ranges: list = None):
+        """
+        Строки результата (словари) из диапазона [start, stop).
+        first_block — размер первого блока; при LIMIT начинаем с маленького,
+        чтобы не фильтровать лишнее, если нужные строки найдутся сразу.
+        ranges — диапазоны, где условие может выполниться (по зоновым картам);
+        остальные строки не читаются.
+        """
+        return map(dict, map(self._make_row, self.scan_tuples(table, start, stop, first_block, ranges)))
+
+    def take(self, table, row_ids, refilter: bool = False):
+        """
+        Строки результата по готовому списку номеров (например, из индекса).
+        refilter — номера лишь кандидаты, условие нужно проверить целиком.
+        """
+        if refilter:
+            row_ids = self.filter_ids(table, row_ids)
+        return map(dict, map(self._make_row, self.take_tuples(table, row_ids)))
+
+    def filter_ids(self, table, row_ids):
+        """
+        Оставляет из возрастающего списка номеров те, что проходят условие.
+        Номера проверяются блоками по мере чтения.
+        """
+        if self.filter is None:
+            yield from row_ids
+            return
+
+        for block in _chunks(row_ids, BLOCK_ROWS):
+            yield from self.filter.select(table, None, None, block)
+
+    def scan_tuples(self, table, start: int, stop: int, first_block: int = BLOCK_ROWS, ranges: list = None):
+        columns = [table.column(name) for name in self.names]
+        values = table.column(self.filter_column) if self.predicate else None
+
+        if ranges is None:
+            ranges = [(start, stop)]
+        else:
+            ranges = [(max(lo, start), min(hi, stop)) for lo, hi in ranges if lo < stop and hi > start]
+
+        for lo, hi in _block_ranges(ranges, first_block):
+            if self.filter is None:
+                yield from self._block(columns, lo, hi)
+                continue
+
+            if values is None:
+                row_ids = self.filter.select(table, lo, hi, None)
+                if row_ids:
+                    yield from self.take_tuples(table, row_ids, columns)
+                continue
+
+            mask = list(map(self.predicate, values[lo:hi]))
+            matched = sum(mask)
+            if not matched:
+                continue
+
+            if matched * 8 < len(mask):
+                # мало совпадений — дешевле достать строки по номерам
+                yield from self.take_tuples(table, list(compress(range(lo, hi), mask)), columns)
+            else:
+                yield from self._block(columns, lo, hi, mask)
+
+    def take_tuples(self, table, row_ids, columns: list = None):
+        if columns is None:
+            columns = [table.column(name) for name in self.names]
+
+        for block in _chunks(row_ids, BLOCK_ROWS):
+            if not columns:
+                yield from (() for _ in block)
+                continue
+            yield from zip(*[_take(col, block) for col in columns])
+
+    def _block(self, columns: list, lo: int, hi: int, mask: list = None):
+        if not columns:
+            count = hi - lo if mask is None else sum(mask)
+            return (() for _ in range(count))
+        if mask is None:
+            return zip(*[col[lo:hi] for col in columns])
+        return zip(*[compress(col[lo:hi], mask) for col in columns])
+
+
+class PlanCache:
+    """
+    LRU-кэш скомпилированных запросов. Ключ — нормализованный запрос
+    и схема таблицы, поэтому план переживает изменения данных,
+    но не изменения колонок и их типов.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, compile_plan) -> CompiledQuery:
+        with self._lock:
+            plan = self.plans.get(key)
+            if plan is not None:
+                self.plans.move_to_end(key)
+                self.hits += 1
+                return plan
+            self.misses += 1
+
+        plan = compile_plan()
+        with self._lock:
+            self.plans[key] = plan
+            if len(self.plans) > self.max_size:
+                self.plans.popitem(last=False)
+        return plan
+
+
+def compile_filter(condition: dict, types: dict):
+    """
+    Превращает условие WHERE в дерево фильтров. Сравнение с колонкой,
+    которой нет в таблице, ничему не удовлетворяет.
+    """
+    op = condition['operator']
+
+    if op == 'and':
+        children = [compile_filter(arg, types) for arg in condition['args']]
+        if any(isinstance(child, _Never) for child in children):
+            return _Never()
+        return _And(children)
+
+    if op == 'or':
+        children = [child for child in (compile_filter(arg, types) for arg in condition['args'])
+                    if not isinstance(child, _Never)]
+        if not children:
+            return _Never()
+        return children[0] if len(children) == 1 else _Or(children)
+
+    if op == 'not':
+        return _Not(compile_filter(condition['args'][0], types))
+
+    if condition['column'] not in types:
+        return _Never()
+    return _Leaf(condition['column'], compile_predicate(condition, types), estimate_selectivity(condition))
+
+
+def estimate_selectivity(condition: dict, stats=None) -> float:
+    """
+    Оценка доли строк таблицы, удовлетворяющих условию (0..1).
+    stats — статистика таблицы (TableStats); без неё берутся грубые константы.
+    """
+    op = condition['operator']
+
+    if op == 'and':
+        result = 1.0
+        for arg in condition['args']:
+            result *= estimate_selectivity(arg, stats)
+        return result
+
+    if op == 'or':
+        missed = 1.0
+        for arg in condition['args']:
+            missed *= 1.0 - estimate_selectivity(arg, stats)
+        return 1.0 - missed
+
+    if op == 'not':
+        return 1.0 - estimate_selectivity(condition['args'][0], stats)
+
+    if stats is not None:
+        estimate = stats.selectivity(condition)
+        if estimate is not None:
+            return estimate
+
+    if op == 'in':
+        return min(1.0, SELECTIVITY['='] * len(condition['value']))
+    return SELECTIVITY[op]
+
+
+class _Leaf:
+    """
+    Одно сравнение колонки с константой.
+    """
+
+    def __init__(self, column: str, predicate, selectivity: float):
+        self.column = column
+        self.predicate = predicate
+        self.selectivity = selectivity
+
+    def select(self, table, lo, hi, candidates):
+        """
+        Номера строк блока [lo, hi) (или из списка candidates), прошедших фильтр.
+        """
+        values = table.column(self.column)
+        if candidates is None:
+            return list(compress(range(lo, hi), map(self.predicate, values[lo:hi])))
+        if not candidates:
+            return []
+        return list(compress(candidates, map(self.predicate, _take(values, candidates))))
+
+
+class _And:
+    """
+    Конъюнкция: сначала самые избирательные условия,
+    следующие проверяются только на оставшихся строках.
+    """
+
+    def __init__(self, children: list):
+        self.children = sorted(children, key=lambda child: child.selectivity)
+        self.selectivity = 1.0
+        for child in children:
+            self.selectivity *= child.selectivity
+
+    def select(self, table, lo, hi, candidates):
+        for child in self.children:
+            candidates = child.select(table, lo, hi, candidates)
+            if not candidates:
+                return []
+        return candidates
+
+
+class _Or:
+    """
+    Дизъюнкция: сначала условия, которые чаще выполняются,
+    следующие проверяются только на строках, ещё не попавших в результат.
+    """
+
+    def __init__(self, children: list):
+        self.children = sorted(children, key=lambda child: child.selectivity, reverse=True)
+        missed = 1.0
+        for child in children:
+            missed *= 1.0 - child.selectivity
+        self.selectivity = 1.0 - missed
+
+    def select(self, table, lo, hi, candidates):
+        matched = self.children[0].select(table, lo, hi, candidates)
+        remaining = range(lo, hi) if candidates is None else candidates
+
+        for child in self.children[1:]:
+            if matched:
+                found = set(matched)
+                remaining = [i for i in remaining if i not in found]
+                if not remaining:
+                    break
+            matched = matched + child.select(table, lo, hi, remaining)
+
+        matched.sort()
+        return matched
+
+
+class _Not:
+    def __init__(self, child):
+        self.child = child
+        self.selectivity = 1.0 - child.selectivity
+
+    def select(self, table, lo, hi, candidates):
+        matched = set(self.child.select(table, lo, hi, candidates))
+        base = range(lo, hi) if candidates is None else candidates
+        return [i for i in base if i not in matched]
+
+
+class _Never:
+    selectivity = 0.0
+
+    def select(self, table, lo, hi, candidates):
+        return []
+
+
+def compile_predicate(condition: dict, types: dict):
+    """
+    Строит функцию одного аргумента (значение колонки) -> bool.
+    Правило сравнения выбирается один раз по типу колонки и константы:
+    значения типизированных колонок (int, float, bool, date) сравниваются
+    с константой, приведённой к типу колонки; в строковых колонках строковая
+    константа сравнивается как текст, а с числом допустимо только равенство
+    (строки, похожие на числа, сравниваются как числа, остальные числу не равны).
+    """
+    op = condition['operator']
+    value = condition['value']
+    column = condition['column']
+
+    if op == 'in':
+        return _compile_in(condition, types)
+    if op == 'between':
+        return _compile_between(condition, types)
+
+    reversed_op = REVERSED_OPERATORS[op]
+
+    # у типизированных колонок тип известен заранее, приводим только константу
+    col_type = types[column]
+    if col_type != 'str':
+        constant = typed_constant(col_type, value)
+        if constant is not None:
+            return partial(reversed_op, constant)
+        # константа не того типа: равенство всегда ложно, неравенство всегда истинно
+        if op in ('=', '!='):
+            return partial(reversed_op, value)
+        raise ValueError(f"Значение {value!r} нельзя сравнить с колонкой {column} типа {col_type}.")
+
+    if not isinstance(value, (int, float)):
+        return partial(reversed_op, value)
+
+    if op not in ('=', '!='):
+        raise ValueError(
+            f"Строковую колонку {column} нельзя сравнить с числом {value!r} оператором {op}; "
+            f"задайте колонке числовой тип в {SCHEMA_FILE}."
+        )
+
+    equal = op == '='
+
+    def predicate(row_val):
+        try: return (float(row_val) == value) == equal
+        except ValueError: return not equal
+
+    return predicate
+
+
+def _compile_in(condition: dict, types: dict):
+    """
+    IN (v1, v2, ...) — то же, что цепочка '=' через OR, но одной проверкой по множеству.
+    """
+    # в типизированной колонке константа не того типа ничему не равна
+    col_type = types[condition['column']]
+    if col_type != 'str':
+        constants = (typed_constant(col_type, value) for value in condition['value'])
+        return {constant for constant in constants if constant is not None}.__contains__
+
+    strings = set()
+    numbers = set()
+    for value in condition['value']:
+        try: numbers.add(float(value))
+        except ValueError: strings.add(value)
+
+    if not numbers:
+        return strings.__contains__
+
+    def predicate(row_val):
+        # строки, похожие на числа, сравниваются как числа
+        try: return float(row_val) in numbers
+        except ValueError: return row_val in strings
+
+    return predicate
+
+
+def _compile_between(condition: dict, types: dict):
+    """
+    BETWEEN low AND high — то же, что col >= low AND col <= high;
+    в строковой колонке границы сравниваются как текст и числами быть не могут.
+    """
+    column = condition['column']
+    low, high = condition['value']
+
+    col_type = types[column]
+    if col_type != 'str':
+        low, high = typed_constant(col_type, low), typed_constant(col_type, high)
+        if low is None or high is None:
+            raise ValueError(f"Границы BETWEEN нельзя сравнить с колонкой {column} типа {col_type}.")
+        return lambda row_val: low <= row_val <= high
+
+    above = compile_predicate({'column': column, 'operator': '>=', 'value': low}, types)
+    below = compile_predicate({'column': column, 'operator': '<=', 'value': high}, types)
+    return lambda row_val: above(row_val) and below(row_val)
+
+
+def _block_ranges(ranges: list, first_block: int):
+    """
+    Делит диапазоны строк на блоки [lo, hi): первый размером first_block,
+    дальше вдвое больше, пока не дойдём до BLOCK_ROWS.
+    """
+    size = max(1, min(first_block, BLOCK_ROWS))
+    for lo, stop in ranges:
+        while lo < stop:
+            hi = min(lo + size, stop)
+            yield lo, hi
+            lo = hi
+            size = min(size * 2, BLOCK_ROWS)
+
+
+def _chunks(items, size: int):
+    """
+    Делит последовательность или итератор на списки длиной до size.
+    """
+    items = iter(items)
+    while True:
+        block = list(islice(items, size))
+        if not block:
+            return
+        yield block
+
+
+def _take(column, row_ids: list) -> tuple:
+    if len(row_ids) == 1:
+        return (column[row_ids[0]],)
+    return operator.itemgetter(*row_ids)(column)
@@ -0,0 +1,269 @@
+import time
+import queue
+import threading
+from itertools import islice
+from concurrent.futures import Future
+
+
+class ServerBusyError(Exception):
+    """
+    Очередь запросов заполнена. retry_after — через сколько секунд стоит повторить.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__('Сервер перегружен, повторите запрос позже.')
+        self.retry_after = retry_after
+
+
+class QueryFuture(Future):
+    """
+    Future запроса; queue_wait — сколько секунд запрос ждал в очереди.
+    """
+
+    queue_wait = None
+
+
+class QueryStream:
+    """
+    Итератор по строкам, которые рабочий поток передаёт пачками
+    через ограниченную очередь. Если клиент читает медленно и очередь
+    заполнена, продолжение запроса откладывается (reserve), а рабочий поток
+    возвращается в пул: медленный читатель не держит поток и результат
+    не копится в памяти. Когда читатель забирает пачку, продолжение
+    снова ставится в очередь планировщика.
+    """
+
+    _END = object()
+
+    def __init__(self, max_batches: int = 4):
+        self.queue_wait = None
+        self.cancelled = False
+        # то, что вернул запрос (до iter): по нему читатель узнаёт свойства результата
+        self.source = None
+        self._queue = queue.Queue(maxsize=max_batches)
+        self._started = threading.Event()
+        self._error = None
+        self._lock = threading.Lock()
+        self._parked = None
+
+    def wait_started(self):
+        """
+        Ждёт, пока рабочий поток откроет таблицу. Ошибки запроса
+        (например, отсутствующая таблица) поднимаются здесь.
+        """
+        self._started.wait()
+        if self._error is not None:
+            raise self._error
+
+    def start(self, error: Exception = None):
+        self._error = error
+        self._started.set()
+
+    def reserve(self, resume) -> bool:
+        """
+        Есть ли место для следующей пачки. Если очередь заполнена, запоминает
+        resume — его вызовет читатель, когда заберёт пачку, — и возвращает False;
+        False и если читатель ушёл. Пишет в поток один рабочий поток за раз,
+        поэтому после True следующий put не ждёт.
+        """
+        with self._lock:
+            if self.cancelled:
+                return False
+            if self._queue.full():
+                self._parked = resume
+                return False
+            return True
+
+    def put(self, item):
+        """
+        Передаёт читателю пачку строк, исключение или конец потока; место заранее проверено reserve.
+        """
+        self._queue.put_nowait(item)
+
+    def finish(self):
+        self.put(self._END)
+
+    def __iter__(self):
+        try:
+            while True:
+                item = self._queue.get()
+                with self._lock:
+                    resume, self._parked = self._parked, None
+                if resume is not None:
+                    resume()
+                if item is self._END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield from item
+        finally:
+            with self._lock:
+                self.cancelled = True
+                # отложенное продолжение больше никто не запустит
+                self._parked = None
+
+
+class _Task:
+    """
+    Вызов в очереди планировщика; future None — продолжение уже принятого запроса.
+    """
+
+    __slots__ = ('func', 'args', 'future', 'enqueued')
+
+    def __init__(self, func, args, future):
+        self.func = func
+        self.args = args
+        self.future = future
+        self.enqueued = time.perf_counter()
+
+
+class QueryScheduler:
+    """
+    Планировщик запросов между ClientHandler и QueryExecutor:
+    фиксированный пул рабочих потоков и ограниченная очередь.
+    Если очередь заполнена, запрос сразу отклоняется с ServerBusyError,
+    чтобы задержка остальных клиентов оставалась предсказуемой.
+    Потоковые запросы выполняются частями (см. QueryStream): продолжения
+    встают в ту же очередь без проверки мест, запрос уже принят.
+    """
+
+    def __init__(self, workers: int = 4, queue_size: int = 32, logger=None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.logger = logger
+        # новые запросы ограничивает счётчик _queued, очередь общая с продолжениями
+        self._queue = queue.Queue()
+        self._queued = 0
+        self._lock = threading.Lock()
+
+        # статистика
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.avg_run = 0.0
+
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f'query-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, func, *args) -> QueryFuture:
+        """
+        Ставит вызов func(*args) в очередь. Поднимает ServerBusyError, если мест нет.
+        """
+        future = QueryFuture()
+        with self._lock:
+            full = self._queued >= self.queue_size
+            if full:
+                self.rejected += 1
+            else:
+                self._queued += 1
+                self.submitted += 1
+        if full:
+            raise ServerBusyError(self.retry_after())
+
+        self._queue.put(_Task(func, args, future))
+        return future
+
+    def stream(self, func, *args, batch_size: int = 1000) -> QueryStream:
+        """
+        Выполняет func(*args), возвращающую итератор строк, в рабочем потоке
+        и отдаёт строки через QueryStream по мере готовности. Рабочий поток
+        занят, только пока у читателя есть место для пачек.
+        """
+        stream = QueryStream()
+        future = self.submit(self._pump, stream, func, args, batch_size)
+        stream.wait_started()
+        stream.queue_wait = future.queue_wait
+        return stream
+
+    def retry_after(self) -> float:
+        """
+        Оценка времени до освобождения места в очереди, в секундах:
+        очередь плюс запросы, которые выполняются сейчас.
+        """
+        with self._lock:
+            estimate = self.avg_run * (self._queued + self.workers) / self.workers
+        return round(max(estimate, 0.1), 3)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'queued': self._queued,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_wait_ms': round(self.total_wait / self.completed * 1000, 3) if self.completed else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 3),
+                'avg_run_ms': round(self.avg_run * 1000, 3)
+            }
+
+    def _worker(self):
+        while True:
+            task = self._queue.get()
+            if task.future is None:
+                # продолжение потокового запроса: ошибки обрабатывает само
+                task.func(*task.args)
+                continue
+
+            with self._lock:
+                self._queued -= 1
+            started = time.perf_counter()
+            task.future.queue_wait = started - task.enqueued
+
+            if not task.future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                result = task.func(*task.args)
+            except BaseException as e:
+                task.future.set_exception(e)
+            else:
+                task.future.set_result(result)
+
+            self._record(task.future.queue_wait, time.perf_counter() - started)
+
+    def _pump(self, stream: QueryStream, func, args, batch_size: int):
+        try:
+            stream.source = func(*args)
+            rows = iter(stream.source)
+        except Exception as e:
+            stream.start(e)
+            return
+        stream.start()
+        self._produce(stream, rows, batch_size)
+
+    def _produce(self, stream: QueryStream, rows, batch_size: int):
+        """
+        Передаёт пачки, пока у читателя есть место, затем отпускает рабочий поток:
+        продолжение вернётся в очередь, когда читатель заберёт пачку.
+        """
+        def resume():
+            self._queue.put(_Task(self._produce, (stream, rows, batch_size), None))
+
+        try:
+            # reserve ложен и когда клиент отключился — тогда просто бросаем запрос
+            while stream.reserve(resume):
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    stream.finish()
+                    return
+                stream.put(batch)
+        except Exception as e:
+            stream.put(e)
+
+    def _record(self, wait: float, run: float):
+        with self._lock:
+            self.completed += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            # скользящее среднее времени выполнения
+            self.avg_run = run if self.completed == 1 else 0.9 * self.avg_run + 0.1 * run
+
+        if self.logger is not None:
+            self.logger.log("DEBUG", f"Запрос ждал в очереди {wait * 1000:.3f} мс, выполнялся {run * 1000:.3f} мс")
@@ -0,0 +1,162 @@
+import os
+import re
+import json
+import datetime
+from decimal import Decimal
+
+
+# файл с явными типами колонок рядом с table.csv: {"колонка": "тип", ...}
+SCHEMA_FILE = 'schema.json'
+
+TYPES = ('int', 'float', 'bool', 'date', 'str')
+NUMERIC_TYPES = ('int', 'float')
+
+# сколько первых строк table.csv смотрим, чтобы определить типы колонок
+SAMPLE_ROWS = 10000
+
+INT_PATTERN = re.compile(r'[+-]?\d+')
+FLOAT_PATTERN = re.compile(r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?')
+# число, которое при выводе не теряет ничего, кроме незначащих нулей дробной части
+EXACT_FLOAT_PATTERN = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?')
+DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+# значения bool в csv и в запросах; 1 и 0 определяются как int и читаются как bool только по schema.json
+BOOL_VALUES = {'true': True, 'false': False, '1': True, '0': False}
+
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+
+def value_type(value: str):
+    """
+    Самый узкий тип, к которому значение приводится без потерь: клиент должен
+    получить то же значение, что записано в csv. Поэтому '01234', '+5' и '1e3'
+    остаются строками — иначе вернулись бы 1234, 5 и 1000.0; '1.50' — float 1.5.
+    """
+    for col_type in ('int', 'float', 'bool', 'date'):
+        try:
+            convert(col_type, value, exact=True)
+            return col_type
+        except ValueError:
+            pass
+    return 'str'
+
+
+def infer_type(values_type, value: str) -> str:
+    """
+    Уточняет тип колонки по очередному значению.
+    Тип может только расширяться: int и float вместе дают float (если целое
+    представимо в float без потерь), остальные сочетания — str; None — значений ещё не было.
+    Пустое значение, как и раньше, делает колонку строковой.
+    """
+    if values_type == 'str':
+        return 'str'
+    current = value_type(value)
+    if values_type is None or values_type == current:
+        return current
+    if {values_type, current} == set(NUMERIC_TYPES):
+        try:
+            convert('float', value, exact=True)
+            return 'float'
+        except ValueError:
+            pass
+    return 'str'
+
+
+def infer_types(header: list, records, overrides: dict = None) -> list:
+    """
+    Типы колонок по строкам выборки; явные типы из overrides важнее.
+    Колонки без единой строки в выборке считаются строковыми.
+    """
+    types = [None] * len(header)
+    for record in records:
+        for i in range(len(header)):
+            value = record[i] if i < len(record) else ''
+            types[i] = infer_type(types[i], value)
+
+    overrides = overrides or {}
+    return [overrides.get(name) or col_type or 'str' for name, col_type in zip(header, types)]
+
+
+def convert(col_type: str, value: str, exact: bool = False):
+    """
+    Значение из csv в типе колонки. Поднимает ValueError, если значение к типу не приводится.
+    exact — значение не должно терять текст при выводе (типы, определённые по данным):
+    без ведущих нулей, '+' и экспоненты, а float ещё и без потери точности;
+    для типов из schema.json достаточно, чтобы значение приводилось.
+    """
+    if col_type == 'int':
+        if not INT_PATTERN.fullmatch(value):
+            raise ValueError(value)
+        number = int(value)
+        if not INT64_MIN <= number <= INT64_MAX or exact and str(number) != value:
+            raise ValueError(value)
+        return number
+    if col_type == 'float':
+        if not FLOAT_PATTERN.fullmatch(value):
+            raise ValueError(value)
+        number = float(value)
+        if exact and not (EXACT_FLOAT_PATTERN.fullmatch(value) and Decimal(value) == Decimal(repr(number))):
+            raise ValueError(value)
+        return number
+    if col_type == 'bool':
+        flag = BOOL_VALUES.get(value if exact else value.lower())
+        if flag is None or exact and value not in ('true', 'false'):
+            raise ValueError(value)
+        return flag
+    if col_type == 'date':
+        if not DATE_PATTERN.fullmatch(value) or not _is_date(value):
+            raise ValueError(value)
+        return value
+    return value
+
+
+def typed_constant(col_type: str, value):
+    """
+    Константа из запроса в типе колонки или None, если её нельзя сравнить
+    со значениями колонки. Для строковых колонок константа не меняется.
+    """
+    if col_type in NUMERIC_TYPES:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    if col_type == 'bool':
+        if isinstance(value, str):
+            return BOOL_VALUES.get(value.lower())
+        return bool(value) if value in (0, 1) else None
+    if col_type == 'date':
+        if isinstance(value, str) and DATE_PATTERN.fullmatch(value) and _is_date(value):
+            return value
+        return None
+    return value
+
+
+def load_overrides(table_dir: str) -> dict:
+    """
+    Явные типы колонок из schema.json таблицы; {} — файла нет.
+    """
+    try:
+        with open(os.path.join(table_dir, SCHEMA_FILE), 'r', encoding='utf-8') as f:
+            overrides = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        raise ValueError(f'Не удалось прочитать {SCHEMA_FILE} таблицы {os.path.basename(table_dir)}: {e}')
+
+    if not isinstance(overrides, dict):
+        raise ValueError(f'{SCHEMA_FILE}: ожидается объект {{"колонка": "тип"}}.')
+    for column, col_type in overrides.items():
+        if col_type not in TYPES:
+            raise ValueError(f"{SCHEMA_FILE}: неизвестный тип {col_type} у колонки {column}, допустимы: {', '.join(TYPES)}.")
+    return overrides
+
+
+def _is_date(value: str) -> bool:
+    try:
+        datetime.date.fromisoformat(value)
+        return True
+    except ValueError:
+        return False
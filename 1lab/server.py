@@ -1,5 +1,4 @@
 import socket
-import struct
 import threading
 import logging
 import os
@@ -8,8 +7,29 @@ import sys
 import json
 import hashlib
 import re
-import operator
-from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count, islice
+from functools import partial
+
+from cache import DISK_CACHE_DIR, CacheManager, DiskCache
+from storage import ColumnStore, appended_version
+from catalog import Catalog
+from indexes import IndexManager, HashIndexManager
+from scheduler import QueryScheduler, ServerBusyError
+from parallel import ParallelScanner
+from planner import CompiledQuery, PlanCache, estimate_selectivity
+from sorting import ExternalSorter, sort_key, top_k
+from aggregate import HashAggregator, AGGREGATE_FUNCTIONS, NUMERIC_FUNCTIONS
+from schema import NUMERIC_TYPES
+from stats import StatsManager
+from sharedscan import SharedScanner
+from vectorized import VectorEngine, VECTOR_MIN_ROWS
+from writer import TableWriter, CopySession
+from join import HashJoin, join_key, compile_pair_filter
+from wire import (
+    encode_rows, negotiate_compression, pack_frame, unpack_frame_header, frame_body, tag_request, untag_request,
+    MAX_DECOMPRESSED_BYTES
+)
 
 
 class Server:
@@ -18,31 +38,76 @@ class Server:
     запускает обработку в ClientHandler.
     """
 
-    def __init__(self, database_path='./data', host='localhost', port=7777):
+    def __init__(
+            self,
+            database_path='./data',
+            host='localhost',
+            port=7777,
+            chunk_size=1000,
+            backlog=5,
+            query_workers=4,
+            query_queue_size=32,
+            scan_processes=None,
+            parallel_threshold=500_000,
+            cache_bytes=64 * 1024 * 1024,
+            disk_cache_bytes=1024 * 1024 * 1024,
+            sort_memory_bytes=64 * 1024 * 1024,
+            aggregate_memory_bytes=64 * 1024 * 1024,
+            join_memory_bytes=64 * 1024 * 1024,
+            max_in_flight=8,
+            max_decompressed_bytes=MAX_DECOMPRESSED_BYTES,
+            catalog_poll_interval=2.0,
+            vector_threshold=VECTOR_MIN_ROWS
+        ):
         self.host = host
         self.port = port
         self.db_path = database_path
+        self.chunk_size = chunk_size
+        self.backlog = backlog
+        self.max_in_flight = max_in_flight
+        self.max_decompressed_bytes = max_decompressed_bytes
 
         # создаём папку data, если её нет
         if not os.path.exists(self.db_path):
             os.makedirs(self.db_path)
         
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket = self.create_socket()
 
         # менеджеры
         self.logger = Logger()
         self.auth_manager = AuthenticationManager(r'D:\code_files\Programming_Workshop_4_Semester\1lab\data\users.json', self.logger)
-        self.cache_manager = CacheManager(max_size=50)
-        self.query_executor = QueryExecutor(database_path=self.db_path)
-        self.db_structure_builder = DatabaseStructureBuilder(database_path=self.db_path)
+        # disk_cache_bytes=0 отключает второй уровень кэша на диске
+        disk_cache = None
+        if disk_cache_bytes:
+            disk_cache = DiskCache(os.path.join(self.db_path, DISK_CACHE_DIR), max_bytes=disk_cache_bytes, logger=self.logger)
+        self.cache_manager = CacheManager(max_bytes=cache_bytes, disk=disk_cache)
+        self.catalog = Catalog(self.db_path, poll_interval=catalog_poll_interval, logger=self.logger)
+        self.column_store = ColumnStore(database_path=self.db_path, catalog=self.catalog)
+        self.index_manager = IndexManager(database_path=self.db_path, column_store=self.column_store)
+        self.hash_index_manager = HashIndexManager()
+        self.query_executor = QueryExecutor(
+            database_path=self.db_path,
+            column_store=self.column_store,
+            index_manager=self.index_manager,
+            hash_index_manager=self.hash_index_manager,
+            parallel_scanner=ParallelScanner(processes=scan_processes, threshold=parallel_threshold),
+            stats_manager=StatsManager(self.column_store, self.logger),
+            vector_engine=VectorEngine(threshold=vector_threshold),
+            sort_memory_bytes=sort_memory_bytes,
+            aggregate_memory_bytes=aggregate_memory_bytes,
+            join_memory_bytes=join_memory_bytes
+        )
+        self.db_structure_builder = DatabaseStructureBuilder(database_path=self.db_path, catalog=self.catalog)
+        self.scheduler = QueryScheduler(workers=query_workers, queue_size=query_queue_size, logger=self.logger)
 
         self.running = True
 
     def start(self):
+        self.catalog.start()
+        self.start_cache_warmup()
         try:
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
+            self.server_socket.listen(self.backlog)
             self.logger.log("INFO", f"Сервер запущен на {self.host}:{self.port}")
             self.accept_connections()
         except Exception as e:
@@ -50,22 +115,55 @@ class Server:
         finally:
             self.shutdown()
 
+    def start_cache_warmup(self):
+        """
+        Фоном поднимает в память самые востребованные результаты из кэша на диске,
+        чтобы первые запросы после перезапуска не читали таблицы заново.
+        """
+        thread = threading.Thread(target=self.warm_cache, daemon=True)
+        thread.start()
+
+    def warm_cache(self):
+        try:
+            loaded = self.cache_manager.warm(
+                lambda table, query_key: self.query_executor.version(json.loads(query_key))
+            )
+            if loaded:
+                self.logger.log("INFO", f"Кэш прогрет с диска: результатов {loaded}")
+        except Exception as e:
+            self.logger.log("ERROR", f"Ошибка прогрева кэша: {e}")
+
+    def create_socket(self):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        return server_socket
+
+    def handler_kwargs(self) -> dict:
+        """
+        Общие зависимости обработчиков клиентов.
+        """
+        return dict(
+            database_manager=self.db_structure_builder,
+            auth_manager=self.auth_manager,
+            logger=self.logger,
+            cache_manager=self.cache_manager,
+            query_executor=self.query_executor,
+            scheduler=self.scheduler,
+            chunk_size=self.chunk_size,
+            max_in_flight=self.max_in_flight,
+            max_decompressed_bytes=self.max_decompressed_bytes
+        )
+
     def accept_connections(self):
         while self.running:
             try:
                 conn, addr = self.server_socket.accept()
+                # ответ — несколько кадров подряд; без TCP_NODELAY второй ждёт подтверждения первого
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 self.logger.log("INFO", f"Подключение клиента: {addr}")
 
                 # создаём отдельный поток под клиента
-                handler = ClientHandler(
-                    conn=conn,
-                    addr=addr,
-                    database_manager=self.db_structure_builder,
-                    auth_manager=self.auth_manager,
-                    logger=self.logger,
-                    cache_manager=self.cache_manager,
-                    query_executor=self.query_executor
-                )
+                handler = ClientHandler(conn=conn, addr=addr, **self.handler_kwargs())
                 thread = threading.Thread(target=handler.handle, daemon=True)
                 thread.start()
 
@@ -74,6 +172,9 @@ class Server:
 
     def shutdown(self):
         self.logger.log("INFO", "Завершение работы сервера...")
+        self.catalog.stop()
+        self.query_executor.close()
+        self.cache_manager.close()
         self.server_socket.close()
 
 
@@ -93,7 +194,11 @@ class ClientHandler:
             auth_manager,
             logger,
             cache_manager,
-            query_executor
+            query_executor,
+            scheduler: QueryScheduler = None,
+            chunk_size: int = 1000,
+            max_in_flight: int = 8,
+            max_decompressed_bytes: int = MAX_DECOMPRESSED_BYTES
         ):
         self.conn = conn
         self.addr = addr
@@ -102,31 +207,212 @@ class ClientHandler:
         self.logger = logger
         self.cache_manager = cache_manager
         self.query_executor = query_executor
+        self.scheduler = scheduler or QueryScheduler()
+        self.chunk_size = chunk_size
+        self.capabilities = {}
+        # параметры сжатия кадров; включаются после ответа на вход
+        self.compression = None
+        # во сколько байт можно распаковать сжатый кадр запроса
+        self.max_decompressed_bytes = max_decompressed_bytes
+
+        # конвейер: команды с номерами выполняются параллельно, не больше max_in_flight сразу
+        self.pipelining = False
+        self.max_in_flight = max_in_flight
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._pipeline_pool = None
+        # номер запроса, который обрабатывает текущий поток
+        self._request = threading.local()
+        self._send_lock = threading.Lock()
+
+        # открытые COPY ... FROM STDIN: номер -> CopySession
+        self._copies = {}
+        self._copy_ids = count(1)
+        self._copy_lock = threading.Lock()
 
 
     def recv_message(self) -> str:
         """
         Принимает сообщение от клиента с префиксом длины (4 байта).
+        Старший бит префикса — тело сжато zlib.
         """
-        raw_length = self.conn.recv(4)
-        if not raw_length:
-            return None
-        length = struct.unpack('!I', raw_length)[0]
-        data = b''
-        while len(data) < length:
-            packet = self.conn.recv(length - len(data))
+        return self.recv_request()[1]
+
+    def recv_request(self) -> tuple:
+        """
+        (номер запроса, сообщение); номер None, если конвейер не согласован.
+        Сообщение None — соединение закрыто.
+        """
+        header = self._recv_exact(4)
+        if len(header) < 4:
+            return None, None
+        length, compressed = unpack_frame_header(header)
+        data = self._recv_exact(length)
+        if len(data) < length:
+            return None, None
+        return self._parse_request(data, compressed)
+
+    def _parse_request(self, data: bytes, compressed: bool) -> tuple:
+        """
+        (номер запроса, сообщение) из тела кадра. Сжатый кадр принимается только
+        после того, как сжатие согласовано при входе; иначе, как и при кадре,
+        который распаковывается больше чем в max_decompressed_bytes, соединение закрывается.
+        """
+        if compressed:
+            if self.compression is None:
+                self.logger.log("WARNING", f"Сжатый кадр без согласованного сжатия от {self.addr}")
+                return None, None
+            try:
+                data = frame_body(data, compressed, self.max_decompressed_bytes)
+            except ValueError as e:
+                self.logger.log("WARNING", f"Отклонён кадр от {self.addr}: {e}")
+                return None, None
+
+        request_id = None
+        if self.pipelining:
+            request_id, data = untag_request(data)
+        return request_id, data.decode('utf-8')
+
+    def _recv_exact(self, size: int) -> bytes:
+        chunks = []
+        received = 0
+        while received < size:
+            packet = self.conn.recv(size - received)
             if not packet:
                 break
-            data += packet
-        return data.decode('utf-8')
+            chunks.append(packet)
+            received += len(packet)
+        return b''.join(chunks)
 
     def send_message(self, message: str):
         """
         Отправляет сообщение клиенту с заголовком какой-то длины.
         """
-        encoded = message.encode('utf-8')
-        length = struct.pack('!I', len(encoded))
-        self.conn.sendall(length + encoded)
+        self.send_frame(message.encode('utf-8'))
+
+    def send_frame(self, data: bytes):
+        """
+        Отправляет кадр — текст JSON или двоичные строки результата — с префиксом длины,
+        сжимая его, если сжатие согласовано.
+        """
+        frame = self._pack(data)
+        # в конвейере кадры разных запросов отправляют разные потоки
+        with self._send_lock:
+            self.conn.sendall(frame)
+
+    def _pack(self, data: bytes) -> bytes:
+        request_id = getattr(self._request, 'id', None)
+        if request_id is not None:
+            data = tag_request(request_id, data)
+        return pack_frame(data, self.compression)
+
+    def negotiate(self, requested: dict) -> dict:
+        """
+        Согласует возможности протокола, которые запросил клиент.
+        """
+        capabilities = {}
+        if requested.get('stream'):
+            capabilities['stream'] = True
+            capabilities['chunk_size'] = self.chunk_size
+        if requested.get('format') == 'binary':
+            # строки результата идут двоичными кадрами (wire.py), остальное — JSON
+            capabilities['format'] = 'binary'
+        compression = negotiate_compression(requested.get('compression'))
+        if compression is not None:
+            capabilities['compression'] = dict(compression, algorithm='zlib')
+        if requested.get('pipeline'):
+            capabilities['pipeline'] = True
+            capabilities['max_in_flight'] = self.max_in_flight
+        return capabilities
+
+    def send_stream(self, rows, cached: bool, cache_entry: tuple = None, queue_wait: float = None):
+        """
+        Отправляет результат сериями кадров по chunk_size строк.
+        Первый кадр — заголовок, последний — признак конца результата.
+        cache_entry — (таблица, ключ запроса, версия), под которыми результат
+        сохраняется в кэш, если он не слишком большой. rows может быть QueryStream:
+        результат общего скана, прочитанный по кругу, кэшируется под rotated_key.
+        """
+        for frame in self.stream_frames(rows, cached, cache_entry, queue_wait):
+            self.send_frame(frame)
+
+    def stream_frames(self, rows, cached: bool, cache_entry: tuple = None, queue_wait: float = None):
+        """
+        Кадры потокового ответа по одному (для send_stream и AsyncClientHandler).
+        """
+        source = getattr(rows, 'source', None)
+        rows = iter(rows)
+        try:
+            yield json.dumps({"status": "ok", "stream": True, "cached": cached}).encode('utf-8')
+
+            to_cache = [] if cache_entry is not None else None
+            cache_size = 0
+            chunk = []
+            count = 0
+
+            try:
+                for row in rows:
+                    chunk.append(row)
+                    count += 1
+
+                    if to_cache is not None:
+                        to_cache.append(row)
+
+                    if len(chunk) >= self.chunk_size:
+                        frame = self._chunk_frame(chunk)
+                        cache_size += len(frame)
+                        chunk = []
+                        if to_cache is not None and cache_size > self.cache_manager.max_entry_bytes:
+                            # результат всё равно не поместится в кэш
+                            to_cache = None
+                        yield frame
+
+            except Exception as e:
+                self.logger.log("ERROR", f"Ошибка при выполнении запроса: {e}")
+                yield json.dumps({"status": "error", "message": str(e)}).encode('utf-8')
+                return
+
+            if chunk:
+                frame = self._chunk_frame(chunk)
+                cache_size += len(frame)
+                yield frame
+
+            if to_cache is not None:
+                table_name, query_key, version = cache_entry
+                if getattr(source, 'rotated', False):
+                    query_key = SQLParser.rotated_key(query_key)
+                self.cache_manager.set(table_name, query_key, version, to_cache, size=cache_size)
+
+            end = {"status": "ok", "end": True, "count": count}
+            if queue_wait is not None:
+                end["queue_ms"] = round(queue_wait * 1000, 3)
+            yield json.dumps(end).encode('utf-8')
+        finally:
+            # закрываем генератор, чтобы рабочий поток не ждал ушедшего клиента
+            if hasattr(rows, 'close'):
+                rows.close()
+
+    def _chunk_frame(self, chunk: list) -> bytes:
+        if self.capabilities.get('format') == 'binary':
+            return encode_rows(chunk)
+        return json.dumps({"rows": chunk}).encode('utf-8')
+
+    def send_result(self, result: list, cached: bool, queue_wait: float = None):
+        """
+        Отправляет результат одним ответом. В двоичном формате ответ — заголовок JSON
+        с признаком binary, за ним один кадр со строками.
+        """
+        response = {"status": "ok", "cached": cached}
+        binary = self.capabilities.get('format') == 'binary'
+        if binary:
+            response["binary"] = True
+        else:
+            response["result"] = result
+        if queue_wait is not None:
+            response["queue_ms"] = round(queue_wait * 1000, 3)
+
+        self.send_message(json.dumps(response))
+        if binary:
+            self.send_frame(encode_rows(result))
 
     def handle(self):
         try:
@@ -136,257 +422,1356 @@ class ClientHandler:
             auth_data = self.recv_message()
             if not auth_data:
                 self.logger.log("ERROR", f"Не удалось получить аутентификационные данные")
-                self.conn.close()
                 return
 
-            credentials = json.loads(auth_data)
-            username = credentials.get('username')
-            password = credentials.get('password')
-
-            if not self.auth_manager.authenticate(username, password):
-                self.logger.log("WARNING", f"Аутентификация не удалась для {username}")
-                self.send_message(json.dumps({"status": "error", "message": "Authentication failed"}))
-                self.conn.close()
+            if not self.authenticate_client(auth_data):
                 return
 
-            self.send_message(json.dumps({"status": "ok", "message": "Authenticated"}))
-
             # основной цикл обработки команд
             while True:
-                msg = self.recv_message()
+                request_id, msg = self.recv_request()
                 if not msg:
                     break
-                
-                # попытка обработать как JSON-команду
-                try:
-                    data = json.loads(msg)
-                    if data.get('command') == 'ADD_USER':
-                        new_username = data.get('username')
-                        new_password = data.get('password')
-                        success = self.auth_manager.add_user(new_username, new_password)
-                        if success:
-                            self.send_message(json.dumps({"status": "ok", "message": "Пользователь добавлен!"}))
-                        else:
-                            self.send_message(json.dumps({"status": "error", "message": "Ошибка регистрации."}))
-                        continue
-
-                except json.JSONDecodeError:
-                    pass  # не JSON, продолжаем как SQL-запрос
-
-                query = msg.strip()
-                if msg.strip().upper() == "EXIT":
+                if request_id is None:
+                    if not self.process_command(msg):
+                        break
+                elif not self.submit_request(request_id, msg):
                     break
 
-                if msg.strip().upper() == "GET_STRUCTURE":
-                    structure = self.db_manager.build()
-                    self.send_message(json.dumps({"status": "ok", "structure": structure}))
-                    continue
-                
-                if msg.strip().upper().startswith("ADD_USER"):
-                    try:
-                        parts = msg.strip().split()
-                        if len(parts) != 3:
-                            raise ValueError("Формат: ADD_USER username password")
-
-                        new_username = parts[1]
-                        new_password = parts[2]
-
-                        success = self.auth_manager.add_user(new_username, new_password)
-                        if success:
-                            self.send_message(json.dumps({"status": "ok", "message": f"Пользователь {new_username} добавлен."}))
-                        else:
-                            self.send_message(json.dumps({"status": "error", "message": f"Пользователь {new_username} уже существует."}))
-
-                    except Exception as e:
-                        self.logger.log("ERROR", f"Ошибка при добавлении пользователя: {e}")
-                        self.send_message(json.dumps({"status": "error", "message": str(e)}))
-                    continue
-
-                # SELECT обработка
-                try:
-                    parsed = SQLParser().parse(msg)
-                    query_hash = hashlib.md5(msg.encode()).hexdigest()
-
-                    cached = self.cache_manager.get(query_hash)
-                    if cached is not None:
-                        self.logger.log("INFO", f"Запрос из кэша для {self.addr}")
-                        self.send_message(json.dumps({"status": "ok", "cached": True, "result": cached}))
-                        continue
-
-                    result = self.query_executor.execute(parsed)
-                    self.cache_manager.set(query_hash, result)
-
-                    self.send_message(json.dumps({"status": "ok", "cached": False, "result": result}))
-
-                except Exception as e:
-                    self.logger.log("ERROR", f"Ошибка при выполнении запроса: {e}")
-                    self.send_message(json.dumps({"status": "error", "message": str(e)}))
-
         finally:
+            if self._pipeline_pool is not None:
+                # дожидаемся ответов на уже принятые команды
+                self._pipeline_pool.shutdown(wait=True)
             self.logger.log("INFO", f"Клиент отключен: {self.addr}")
-            self.conn.close()
+            self.close()
 
+    def submit_request(self, request_id: int, msg: str) -> bool:
+        """
+        Конвейер: команда выполняется в отдельном потоке, ответы на неё помечаются
+        её номером и могут прийти раньше ответов на более ранние команды.
+        Если выполняется уже max_in_flight команд, чтение следующих ждёт.
+        Возвращает False, если клиент завершает сеанс.
+        """
+        if msg.strip().upper() == "EXIT":
+            return False
+
+        if self._pipeline_pool is None:
+            self._pipeline_pool = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='pipeline')
+        self._in_flight.acquire()
+        future = self._pipeline_pool.submit(self.process_request, request_id, msg)
+        future.add_done_callback(lambda _: self._in_flight.release())
+        return True
+
+    def process_request(self, request_id: int, msg: str):
+        """
+        Выполняет команду из конвейера; все кадры ответа получают её номер.
+        """
+        self._request.id = request_id
+        try:
+            self.process_command(msg)
+        except Exception as e:
+            self.logger.log("ERROR", f"Ошибка при обработке запроса {request_id} от {self.addr}: {e}")
+        finally:
+            self._request.id = None
+
+    def close(self):
+        self.close_copies()
+        self.conn.close()
+
+    def close_copies(self):
+        """
+        Незавершённые COPY при отключении клиента отменяются.
+        """
+        with self._copy_lock:
+            sessions, self._copies = list(self._copies.values()), {}
+        for session in sessions:
+            session.close()
+
+    def authenticate_client(self, auth_data: str) -> bool:
+        """
+        Проверяет учётные данные из первого сообщения и согласует возможности протокола.
+        """
+        credentials = json.loads(auth_data)
+        username = credentials.get('username')
+        password = credentials.get('password')
+
+        if not self.auth_manager.authenticate(username, password):
+            self.logger.log("WARNING", f"Аутентификация не удалась для {username}")
+            self.send_message(json.dumps({"status": "error", "message": "Authentication failed"}))
+            return False
+
+        self.capabilities = self.negotiate(credentials.get('capabilities') or {})
+        self.send_message(json.dumps({"status": "ok", "message": "Authenticated", "capabilities": self.capabilities}))
+        # ответ на вход клиент читает без сжатия и номера, дальше кадры могут быть сжаты
+        self.compression = self.capabilities.get('compression')
+        self.pipelining = bool(self.capabilities.get('pipeline'))
+        return True
+
+    def run_query(self, parsed: dict) -> tuple:
+        """
+        (строки результата, прочитаны ли они общим сканом по кругу) — для ответа без потока.
+        """
+        rows = self.query_executor.execute_iter(parsed)
+        return list(rows), getattr(rows, 'rotated', False)
+
+    def lookup_cache(self, parsed: dict, table_name: str, query_key: str, version):
+        """
+        Ищет результат запроса в кэше. Если его нет, пробует более общие запросы
+        с тем же условием: из SELECT * результат получается проекцией,
+        из запроса без LIMIT/OFFSET — срезом. Результаты с LIMIT хранятся
+        под своим ключом и не подменяют полный результат. Результат, прочитанный
+        общим сканом по кругу (rotated_key), отдаётся только тому же запросу:
+        срез из него не совпал бы со срезом, посчитанным в порядке таблицы.
+        """
+        cached = self.cache_manager.get(table_name, query_key, version)
+        if cached is None:
+            cached = self.cache_manager.get(table_name, SQLParser.rotated_key(query_key), version)
+        if cached is not None:
+            return cached
+
+        # у агрегатов из SELECT * ничего не получить, только срезом из полного результата;
+        # в JOIN имена колонок SELECT * зависят от пересечения схем, поэтому тоже только срезом
+        project = parsed['columns'] != ['*'] and not (parsed.get('aggregates') or parsed.get('group_by') or parsed.get('join'))
+        limit = parsed.get('limit')
+        offset = parsed.get('offset') or 0
+        limited = limit is not None or offset > 0
+
+        unlimited = dict(parsed, limit=None, offset=0)
+        candidates = []
+        if project:
+            candidates.append((SQLParser.cache_key(parsed, columns=['*']), True, False))
+        if limited:
+            candidates.append((SQLParser.cache_key(unlimited), False, True))
+        if project and limited:
+            candidates.append((SQLParser.cache_key(unlimited, columns=['*']), True, True))
+
+        for key, need_projection, need_slice in candidates:
+            wide = self.cache_manager.get(table_name, key, version)
+            if wide is None:
+                continue
+            if need_slice:
+                wide = wide[offset:None if limit is None else offset + limit]
+            if need_projection:
+                columns = list(dict.fromkeys(parsed['columns']))
+                wide = [{col: row[col] for col in columns if col in row} for row in wide]
+            return wide
+        return None
+
+
+    def append_rows(self, table_name: str, rows, columns: list = None):
+        """
+        Дописывает строки INSERT или COPY и обновляет кэш результатов по этой таблице.
+        """
+        old_table, table, added = self.scheduler.submit(self.query_executor.insert, table_name, rows, columns).result()
+        if added:
+            self.refresh_cache(old_table, table)
+        self.logger.log("INFO", f"В таблицу {table_name} добавлено строк: {added}")
+        self.send_message(json.dumps({"status": "ok", "message": f"Добавлено строк: {added}.", "rows": added}))
+
+    def refresh_cache(self, old_table, table):
+        """
+        Дополняет закэшированные результаты простых SELECT дописанными строками
+        вместо того, чтобы выбрасывать их. Если новые значения расширили тип колонки,
+        у таблицы новая версия, а не дописанная, и старые записи просто устаревают.
+        """
+        if not appended_version(old_table.version, table.version):
+            return
+
+        def extend(query_key: str, result: list):
+            return self.query_executor.appended_rows(json.loads(query_key), table, old_table.row_count, len(result))
+
+        refreshed = self.cache_manager.refresh(table.name, old_table.version, table.version, extend)
+        if refreshed:
+            self.logger.log("INFO", f"Обновлено записей кэша по таблице {table.name}: {refreshed}")
+
+    def process_copy(self, data: dict):
+        """
+        Данные COPY ... FROM STDIN: COPY_DATA — очередной кусок csv с номером seq,
+        COPY_END — записать всё полученное одним сегментом, COPY_CANCEL — отменить.
+        """
+        command = data.get('command')
+        try:
+            with self._copy_lock:
+                session = self._copies.get(data.get('copy_id'))
+                if session is not None and command != 'COPY_DATA':
+                    del self._copies[data['copy_id']]
+            if session is None:
+                raise ValueError(f"COPY номер {data.get('copy_id')} не начат или уже завершён.")
+
+            if command == 'COPY_DATA':
+                session.feed(int(data.get('seq', 0)), data.get('data') or '')
+                self.send_message(json.dumps({"status": "ok", "received": session.received}))
+                return
+
+            try:
+                if command == 'COPY_CANCEL':
+                    self.send_message(json.dumps({"status": "ok", "message": "COPY отменён."}))
+                    return
+                columns, rows = session.rows()
+                self.append_rows(session.table_name, rows, columns)
+            finally:
+                session.close()
+
+        except Exception as e:
+            self.logger.log("ERROR", f"Ошибка COPY от {self.addr}: {e}")
+            self.send_message(json.dumps({"status": "error", "message": str(e)}))
+
+    def process_command(self, msg: str) -> bool:
+        """
+        Выполняет одну команду клиента и отправляет ответ.
+        Возвращает False, если клиент завершает сеанс.
+        """
+        # попытка обработать как JSON-команду
+        try:
+            data = json.loads(msg)
+            if data.get('command') in ('COPY_DATA', 'COPY_END', 'COPY_CANCEL'):
+                self.process_copy(data)
+                return True
+
+            if data.get('command') == 'ADD_USER':
+                new_username = data.get('username')
+                new_password = data.get('password')
+                success = self.auth_manager.add_user(new_username, new_password)
+                if success:
+                    self.send_message(json.dumps({"status": "ok", "message": "Пользователь добавлен!"}))
+                else:
+                    self.send_message(json.dumps({"status": "error", "message": "Ошибка регистрации."}))
+                return True
+
+        except json.JSONDecodeError:
+            pass  # не JSON, продолжаем как SQL-запрос
+
+        query = msg.strip()
+        if msg.strip().upper() == "EXIT":
+            return False
+
+        if msg.strip().upper() == "GET_STRUCTURE":
+            structure = self.db_manager.build()
+            catalog = self.db_manager.catalog
+            if catalog is not None:
+                # индексы и статистика из каталога в памяти, без обращений к диску
+                indexes = catalog.indexes()
+                stats = catalog.table_stats()
+            else:
+                indexes = self.query_executor.index_manager.list_indexes()
+                stats = self.query_executor.table_stats(structure)
+            self.send_message(json.dumps({
+                "status": "ok",
+                "structure": structure,
+                "indexes": indexes,
+                "stats": stats,
+                "tables": self.db_manager.describe()
+            }))
+            return True
+
+        if msg.strip().upper() == "SCHEDULER_STATS":
+            self.send_message(json.dumps({
+                "status": "ok",
+                "scheduler_stats": self.scheduler.stats(),
+                "shared_scan_stats": self.query_executor.shared_scanner.stats(),
+                "vector_stats": self.query_executor.vector_engine.stats()
+            }))
+            return True
+
+        if msg.strip().upper() == "CACHE_STATS":
+            self.send_message(json.dumps({"status": "ok", "cache_stats": self.cache_manager.stats()}))
+            return True
+
+        if msg.strip().upper() == "INDEX_STATS":
+            stats = self.query_executor.hash_index_manager.stats()
+            self.send_message(json.dumps({"status": "ok", "index_stats": stats}))
+            return True
+
+        if msg.strip().upper().startswith("ADD_USER"):
+            try:
+                parts = msg.strip().split()
+                if len(parts) != 3:
+                    raise ValueError("Формат: ADD_USER username password")
+
+                new_username = parts[1]
+                new_password = parts[2]
+
+                success = self.auth_manager.add_user(new_username, new_password)
+                if success:
+                    self.send_message(json.dumps({"status": "ok", "message": f"Пользователь {new_username} добавлен."}))
+                else:
+                    self.send_message(json.dumps({"status": "error", "message": f"Пользователь {new_username} уже существует."}))
+
+            except Exception as e:
+                self.logger.log("ERROR", f"Ошибка при добавлении пользователя: {e}")
+                self.send_message(json.dumps({"status": "error", "message": str(e)}))
+            return True
+
+        # SELECT обработка
+        try:
+            parsed = SQLParser().parse(msg)
+
+            if parsed['type'] == 'create_index':
+                self.scheduler.submit(self.query_executor.create_index, parsed['table'], parsed['column']).result()
+                self.logger.log("INFO", f"Создан индекс {parsed['table']}({parsed['column']})")
+                self.send_message(json.dumps({"status": "ok", "message": f"Индекс {parsed['table']}({parsed['column']}) создан."}))
+                return True
+
+            if parsed['type'] == 'insert':
+                self.append_rows(parsed['table'], parsed['rows'], parsed['columns'])
+                return True
+
+            if parsed['type'] == 'copy':
+                # проверяем таблицу сразу, чтобы не принимать данные впустую
+                columns = self.query_executor.column_store.open(parsed['table']).columns
+                with self._copy_lock:
+                    copy_id = next(self._copy_ids)
+                    self._copies[copy_id] = CopySession(parsed['table'], header=parsed['header'])
+                self.send_message(json.dumps({"status": "ok", "copy_id": copy_id, "columns": columns}))
+                return True
+
+            query_key = SQLParser.cache_key(parsed)
+            table_name = parsed['table']
+            version = self.query_executor.version(parsed)
+
+            cached = self.lookup_cache(parsed, table_name, query_key, version)
+            if cached is not None:
+                self.logger.log("INFO", f"Запрос из кэша для {self.addr}")
+                if self.capabilities.get('stream'):
+                    self.send_stream(iter(cached), cached=True)
+                else:
+                    self.send_result(cached, cached=True)
+                return True
+
+            if self.capabilities.get('stream'):
+                stream = self.scheduler.stream(self.query_executor.execute_iter, parsed, batch_size=self.chunk_size)
+                self.send_stream(
+                    stream,
+                    cached=False,
+                    cache_entry=(table_name, query_key, version),
+                    queue_wait=stream.queue_wait
+                )
+                return True
+
+            future = self.scheduler.submit(self.run_query, parsed)
+            result, rotated = future.result()
+            if rotated:
+                query_key = SQLParser.rotated_key(query_key)
+            self.cache_manager.set(table_name, query_key, version, result)
+
+            self.send_result(result, cached=False, queue_wait=future.queue_wait)
+
+        except ServerBusyError as e:
+            self.logger.log("WARNING", f"Очередь запросов заполнена, запрос от {self.addr} отклонён")
+            self.send_message(json.dumps({"status": "busy", "message": str(e), "retry_after": e.retry_after}))
+
+        except Exception as e:
+            self.logger.log("ERROR", f"Ошибка при выполнении запроса: {e}")
+            self.send_message(json.dumps({"status": "error", "message": str(e)}))
+
+        return True
+
+
+
+# агрегатная функция в списке SELECT: count(*), sum(col), ...
+AGGREGATE_PATTERN = re.compile(rf"(?P<function>{'|'.join(AGGREGATE_FUNCTIONS)})\s*\(\s*(?P<column>\*|\w+)\s*\)")
 
 
 class SQLParser:
     """
     Парсит SQL-подобные запросы вида:
     SELECT col1, col2 FROM table WHERE col3 >= 10
+    SELECT * FROM table WHERE (a = 1 OR b IN (2, 3)) AND NOT c BETWEEN 4 AND 5
+    SELECT * FROM table WHERE col3 >= 10 LIMIT 10 OFFSET 20
+    SELECT * FROM table ORDER BY col1 DESC, col2 LIMIT 10
+    SELECT col1, COUNT(*), AVG(col2) FROM table WHERE col3 > 0 GROUP BY col1
+    SELECT a.col1, b.col2 FROM a JOIN b ON a.id = b.a_id WHERE b.col3 > 0
+    CREATE INDEX ON table(col)
+    INSERT INTO table [(col1, col2)] VALUES ('text', 10), ('it''s', NULL)
+    COPY table FROM STDIN [HEADER]
     """
 
     SUPPORTED_OPERATORS = ['>=', '<=', '!=', '=', '<', '>']
 
+    INSERT_PATTERN = re.compile(
+        r'^insert\s+into\s+(?P<table>\w+)\s*(?:\((?P<columns>[\w\s,]+)\)\s*)?values\s*(?P<values>.+)$',
+        re.IGNORECASE | re.DOTALL
+    )
+    # в строках значений кавычка экранируется удвоением: 'it''s'
+    VALUE_TOKEN_PATTERN = re.compile(r"\s*(?:(?P<string>'(?:[^']|'')*')|(?P<punct>[(),])|(?P<word>[^\s(),']+))")
+
     def parse(self, raw_query: str) -> dict:
+        # значения INSERT разбираются с учётом регистра, остальной запрос приводится к нижнему
+        insert_match = self.INSERT_PATTERN.match(raw_query.strip())
+        if insert_match:
+            return self._parse_insert(insert_match)
+
         query = raw_query.strip().lower()
-        pattern = r'^select\s+(?P<columns>[\*\w,\s]+)\s+from\s+(?P<table>\w+)(?:\s+where\s+(?P<condition>.+))?$'
+
+        copy_match = re.match(r'^copy\s+(?P<table>\w+)\s+from\s+stdin(?:\s+(?:with\s+)?(?P<header>header))?$', query)
+        if copy_match:
+            return {'type': 'copy', 'table': copy_match.group('table'), 'header': bool(copy_match.group('header'))}
+
+        index_match = re.match(r'^create\s+index\s+on\s+(?P<table>\w+)\s*\(\s*(?P<column>\w+)\s*\)$', query)
+        if index_match:
+            return {
+                'type': 'create_index',
+                'table': index_match.group('table'),
+                'column': index_match.group('column')
+            }
+
+        pattern = (
+            r'^select\s+(?P<columns>[\*\w,\s().]+)\s+from\s+(?P<table>\w+)'
+            r'(?:\s+(?:inner\s+)?join\s+(?P<join>\w+)\s+on\s+(?P<left>[\w.]+)\s*=\s*(?P<right>[\w.]+))?'
+            r'(?:\s+where\s+(?P<condition>.+?))?'
+            r'(?:\s+group\s+by\s+(?P<group>[\w\s,]+?))?'
+            r'(?:\s+order\s+by\s+(?P<order>.+?))?'
+            r'(?:\s+limit\s+(?P<limit>\d+)(?:\s+offset\s+(?P<offset>\d+))?)?$'
+        )
         match = re.match(pattern, query)
 
         if not match: raise ValueError('Неверный формат запроса.')
 
-        columns = [col.strip() for col in match.group('columns').split(',')]
+        columns, aggregates = self._parse_select_list(match.group('columns'))
+        group_by = [col.strip() for col in match.group('group').split(',')] if match.group('group') else None
         table = match.group('table')
         raw_condition = match.group('condition')
 
+        join = None
+        if match.group('join'):
+            if aggregates or group_by:
+                raise ValueError('Агрегаты и GROUP BY в запросах с JOIN не поддерживаются.')
+            join = {'table': match.group('join'), 'left': match.group('left'), 'right': match.group('right')}
+
+        if aggregates or group_by:
+            for col in columns:
+                if col == '*' or (col not in (group_by or []) and not AGGREGATE_PATTERN.fullmatch(col)):
+                    raise ValueError(f'Колонка {col} должна быть в GROUP BY или внутри агрегатной функции.')
+
         condition = None
         if raw_condition:
             condition = self._parse_condition(raw_condition)
         
         return {
+            'type': 'select',
             'table': table,
+            'join': join,
             'columns': columns,
-            'condition': condition
+            'condition': condition,
+            'group_by': group_by,
+            'aggregates': aggregates,
+            'order_by': self._parse_order(match.group('order')) if match.group('order') else None,
+            'limit': int(match.group('limit')) if match.group('limit') else None,
+            'offset': int(match.group('offset') or 0)
         }
     
 
-    def _parse_condition(self, condition_str: str) -> dict:
-        for op in self.SUPPORTED_OPERATORS:
-            if op in condition_str:
-                parts = condition_str.split(op)
-                if len(parts) != 2:
-                    raise ValueError('Неверное условие WHERE.')
-                
-                column = parts[0].strip()
-                value = parts[1].strip().strip("'\'")
-
-                if value.isdigit():
-                    value = int(value)
+    def _parse_insert(self, match) -> dict:
+        columns = None
+        if match.group('columns'):
+            columns = [col.strip().lower() for col in match.group('columns').split(',')]
+            if '' in columns:
+                raise ValueError('Неверный список колонок INSERT.')
+        return {
+            'type': 'insert',
+            'table': match.group('table').lower(),
+            'columns': columns,
+            'rows': self._parse_insert_values(match.group('values'))
+        }
+
+    def _parse_insert_values(self, values_str: str) -> list:
+        """
+        (v1, v2), (v3, v4) -> [['v1', 'v2'], ['v3', 'v4']]. Значения остаются текстом,
+        как в csv: числа без кавычек, строки в кавычках, NULL — пустое значение.
+        """
+        tokens = []
+        pos = 0
+        values_str = values_str.strip()
+        while pos < len(values_str):
+            match = self.VALUE_TOKEN_PATTERN.match(values_str, pos)
+            if not match or match.end() == pos:
+                raise ValueError('Неверный список значений INSERT.')
+            tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            pos = match.end()
+
+        rows = []
+        i = 0
+        while True:
+            if tokens[i:i + 1] != [('punct', '(')]:
+                raise ValueError('Неверный список значений INSERT.')
+            i += 1
+            row = []
+            while True:
+                if i >= len(tokens):
+                    raise ValueError('Неверный список значений INSERT.')
+                row.append(self._insert_value(*tokens[i]))
+                i += 1
+                if tokens[i:i + 1] == [('punct', ',')]:
+                    i += 1
+                elif tokens[i:i + 1] == [('punct', ')')]:
+                    i += 1
+                    break
                 else:
-                    try: value = float(value)
-                    except ValueError: pass
-
-                return {
-                    'column': column,
-                    'operator': op,
-                    'value': value
-                }
-        raise ValueError('Неизвестный оператор в WHERE-условии.')
+                    raise ValueError('Неверный список значений INSERT.')
+            rows.append(row)
+
+            if i == len(tokens):
+                return rows
+            if tokens[i] != ('punct', ','):
+                raise ValueError('Неверный список значений INSERT.')
+            i += 1
+
+    @staticmethod
+    def _insert_value(kind: str, text: str) -> str:
+        if kind == 'string':
+            return text[1:-1].replace("''", "'")
+        if kind == 'word' and text.lower() == 'null':
+            return ''
+        if kind == 'word' and (_is_number_literal(text) or text.lower() in ('true', 'false')):
+            return text
+        if kind == 'word':
+            raise ValueError(f'Значение {text} в INSERT должно быть в кавычках.')
+        raise ValueError('Неверный список значений INSERT.')
+
+    @classmethod
+    def cache_key(cls, parsed: dict, columns: list = None) -> str:
+        """
+        Канонический вид разобранного запроса для ключа кэша.
+        Регистр и пробелы убраны ещё при разборе; здесь приводятся
+        типы констант (30, 30.0 и '30' дают один ключ) и убираются
+        повторы колонок. columns позволяет подставить другой список колонок.
+        """
+        canonical = dict(parsed)
+        canonical['columns'] = list(dict.fromkeys(columns or parsed['columns']))
+        if parsed.get('condition'):
+            canonical['condition'] = cls._canonical_condition(parsed['condition'])
+        return json.dumps(canonical, sort_keys=True, ensure_ascii=False)
+
+    @staticmethod
+    def rotated_key(query_key: str) -> str:
+        """
+        Ключ кэша для результата того же запроса, строки которого идут не в порядке таблицы.
+        """
+        canonical = json.loads(query_key)
+        canonical['rotated'] = True
+        return json.dumps(canonical, sort_keys=True, ensure_ascii=False)
+
+    @classmethod
+    def _canonical_condition(cls, condition: dict) -> dict:
+        """
+        AND/OR не зависят от порядка аргументов, IN — от порядка и повторов значений.
+        """
+        condition = dict(condition)
+        if 'column' not in condition:
+            args = [cls._canonical_condition(arg) for arg in condition['args']]
+            if condition['operator'] in ('and', 'or'):
+                args.sort(key=lambda arg: json.dumps(arg, sort_keys=True))
+            condition['args'] = args
+        elif condition['operator'] == 'in':
+            values = {json.dumps(cls._canonical_value(v)): cls._canonical_value(v) for v in condition['value']}
+            condition['value'] = [values[key] for key in sorted(values)]
+        elif condition['operator'] == 'between':
+            condition['value'] = [cls._canonical_value(v) for v in condition['value']]
+        else:
+            condition['value'] = cls._canonical_value(condition['value'])
+        return condition
+
+    @staticmethod
+    def _canonical_value(value):
+        if isinstance(value, str):
+            try: value = float(value)
+            except ValueError: return value
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        return value
+
+    def _parse_select_list(self, columns_str: str) -> tuple:
+        """
+        Разбирает список после SELECT. Возвращает имена колонок результата
+        и список агрегатов [{'function', 'column', 'name'}] (или None, если их нет).
+        Имя агрегата в результате — 'count(*)', 'avg(salary)' и т. п.
+        """
+        columns = []
+        aggregates = []
+        for item in columns_str.split(','):
+            item = item.strip()
+            if '(' not in item and ')' not in item:
+                columns.append(item)
+                continue
+
+            item_match = AGGREGATE_PATTERN.fullmatch(item)
+            if not item_match:
+                raise ValueError(f'Неизвестная функция: {item}')
+            function, column = item_match.group('function'), item_match.group('column')
+            if column == '*' and function != 'count':
+                raise ValueError(f'Функция {function.upper()} не применима к *.')
+
+            name = f'{function}({column})'
+            columns.append(name)
+            aggregates.append({'function': function, 'column': column, 'name': name})
+        return columns, aggregates or None
+
+    def _parse_order(self, order_str: str) -> list:
+        """
+        'col1 desc, col2' -> [{'column': 'col1', 'desc': True}, {'column': 'col2', 'desc': False}]
+        """
+        order_by = []
+        for item in order_str.split(','):
+            item_match = re.fullmatch(r'\s*(?P<column>\w+(?:\.\w+|\s*\(\s*(?:\*|\w+)\s*\))?)(?:\s+(?P<direction>asc|desc))?\s*', item)
+            if not item_match:
+                raise ValueError('Неверный формат ORDER BY.')
+            column = re.sub(r'\s+', '', item_match.group('column'))
+            order_by.append({'column': column, 'desc': item_match.group('direction') == 'desc'})
+        return order_by
+
+    def _parse_condition(self, condition_str: str) -> dict:
+        return _ConditionParser(condition_str, self.SUPPORTED_OPERATORS).parse()
+
+
+class _ConditionParser:
+    """
+    Разбор условия WHERE рекурсивным спуском:
+        expr       := and_expr (OR and_expr)*
+        and_expr   := not_expr (AND not_expr)*
+        not_expr   := NOT not_expr | '(' expr ')' | predicate
+        predicate  := column op value | value op column
+                    | column [NOT] IN (value, ...) | column [NOT] BETWEEN value AND value
+    Простое сравнение даёт прежний словарь {'column', 'operator', 'value'}.
+    """
+
+    TOKEN_PATTERN = re.compile(r"""\s*(?:(?P<string>'[^']*'|"[^"]*")|(?P<op>>=|<=|!=|<>|=|<|>)|(?P<punct>[(),])|(?P<word>[^\s(),'"=<>!]+))""")
+    KEYWORDS = {'and', 'or', 'not', 'in', 'between'}
+    FLIPPED = {'=': '=', '!=': '!=', '<': '>', '>': '<', '<=': '>=', '>=': '<='}
+
+    def __init__(self, condition_str: str, operators: list):
+        self.operators = operators
+        self.tokens = self._tokenize(condition_str)
+        self.pos = 0
+
+    def parse(self) -> dict:
+        condition = self._parse_or()
+        if self.pos != len(self.tokens):
+            raise ValueError('Неверное условие WHERE.')
+        return condition
+
+    def _tokenize(self, condition_str: str) -> list:
+        tokens = []
+        pos = 0
+        condition_str = condition_str.strip()
+        while pos < len(condition_str):
+            match = self.TOKEN_PATTERN.match(condition_str, pos)
+            if not match or match.end() == pos:
+                raise ValueError('Неизвестный оператор в WHERE-условии.')
+            kind = match.lastgroup
+            text = match.group(kind)
+            if kind == 'op' and text == '<>':
+                text = '!='
+            if kind == 'word' and text in self.KEYWORDS:
+                kind = 'keyword'
+            tokens.append((kind, text))
+            pos = match.end()
+        return tokens
+
+    def _peek(self, kind: str = None, text: str = None) -> bool:
+        if self.pos >= len(self.tokens):
+            return False
+        token_kind, token_text = self.tokens[self.pos]
+        return (kind is None or token_kind == kind) and (text is None or token_text == text)
+
+    def _next(self, kind: str = None, text: str = None) -> str:
+        if not self._peek(kind, text):
+            raise ValueError('Неверное условие WHERE.')
+        self.pos += 1
+        return self.tokens[self.pos - 1][1]
+
+    def _parse_or(self) -> dict:
+        args = [self._parse_and()]
+        while self._peek('keyword', 'or'):
+            self.pos += 1
+            args.append(self._parse_and())
+        return self._combine('or', args)
+
+    def _parse_and(self) -> dict:
+        args = [self._parse_not()]
+        while self._peek('keyword', 'and'):
+            self.pos += 1
+            args.append(self._parse_not())
+        return self._combine('and', args)
+
+    def _parse_not(self) -> dict:
+        if self._peek('keyword', 'not'):
+            self.pos += 1
+            return {'operator': 'not', 'args': [self._parse_not()]}
+
+        if self._peek('punct', '('):
+            self.pos += 1
+            condition = self._parse_or()
+            self._next('punct', ')')
+            return condition
+
+        return self._parse_predicate()
+
+    def _parse_predicate(self) -> dict:
+        # константа слева: 10 < age -> age > 10
+        if self._peek('string') or (self._peek('word') and _is_number_literal(self.tokens[self.pos][1])):
+            value = self._parse_value()
+            op = self._next('op')
+            column = self._next('word')
+            return {'column': column, 'operator': self.FLIPPED[op], 'value': value}
+
+        column = self._next('word')
+
+        negated = False
+        if self._peek('keyword', 'not'):
+            self.pos += 1
+            negated = True
+
+        if self._peek('keyword', 'in'):
+            self.pos += 1
+            self._next('punct', '(')
+            values = [self._parse_value()]
+            while self._peek('punct', ','):
+                self.pos += 1
+                values.append(self._parse_value())
+            self._next('punct', ')')
+            condition = {'column': column, 'operator': 'in', 'value': values}
+
+        elif self._peek('keyword', 'between'):
+            self.pos += 1
+            low = self._parse_value()
+            self._next('keyword', 'and')
+            high = self._parse_value()
+            condition = {'column': column, 'operator': 'between', 'value': [low, high]}
+
+        elif not negated and self._peek('op'):
+            op = self._next('op')
+            if op not in self.operators:
+                raise ValueError('Неизвестный оператор в WHERE-условии.')
+            condition = {'column': column, 'operator': op, 'value': self._parse_value(bare_words=True)}
+
+        else:
+            raise ValueError('Неизвестный оператор в WHERE-условии.')
+
+        if negated:
+            return {'operator': 'not', 'args': [condition]}
+        return condition
+
+    def _parse_value(self, bare_words: bool = False):
+        if self._peek('string'):
+            value = self._next()[1:-1]
+        elif self._peek('word'):
+            words = [self._next()]
+            # значение без кавычек может состоять из нескольких слов, как раньше
+            while bare_words and self._peek('word'):
+                words.append(self._next())
+            value = ' '.join(words)
+        else:
+            raise ValueError('Неверное условие WHERE.')
+
+        if value.isdigit():
+            return int(value)
+        try: return float(value)
+        except ValueError: return value
+
+    @staticmethod
+    def _combine(operator_name: str, args: list) -> dict:
+        if len(args) == 1:
+            return args[0]
+        flat = []
+        for arg in args:
+            # (a AND b) AND c -> AND(a, b, c)
+            if arg.get('operator') == operator_name and 'column' not in arg:
+                flat.extend(arg['args'])
+            else:
+                flat.append(arg)
+        return {'operator': operator_name, 'args': flat}
+
+
+def _is_number_literal(text: str) -> bool:
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
     
 
 class QueryExecutor:
     """ВЫполняет SELECT-запросы по csv таблицам."""
 
-    OPERATORS = {
-        '=': operator.eq,
-        '!=': operator.ne,
-        '<': operator.lt,
-        '>': operator.gt,
-        '<=': operator.le,
-        '>=': operator.ge
-    }
-
-    def __init__(self, database_path: str):
+    def __init__(
+            self,
+            database_path: str,
+            column_store: ColumnStore = None,
+            index_manager: IndexManager = None,
+            hash_index_manager: HashIndexManager = None,
+            parallel_scanner: ParallelScanner = None,
+            stats_manager: StatsManager = None,
+            shared_scanner: SharedScanner = None,
+            vector_engine: VectorEngine = None,
+            table_writer: TableWriter = None,
+            sort_memory_bytes: int = 64 * 1024 * 1024,
+            aggregate_memory_bytes: int = 64 * 1024 * 1024,
+            join_memory_bytes: int = 64 * 1024 * 1024,
+            spill_dir: str = None
+        ):
         self.db_path = database_path
+        # ORDER BY без LIMIT сортирует в памяти до этого объёма, дальше — через временные файлы
+        self.sort_memory_bytes = sort_memory_bytes
+        # то же для групп GROUP BY
+        self.aggregate_memory_bytes = aggregate_memory_bytes
+        # и для хэш-таблицы JOIN
+        self.join_memory_bytes = join_memory_bytes
+        self.spill_dir = spill_dir
+        self.column_store = column_store or ColumnStore(database_path)
+        self.index_manager = index_manager or IndexManager(database_path, self.column_store)
+        self.hash_index_manager = hash_index_manager or HashIndexManager()
+        self.parallel_scanner = parallel_scanner or ParallelScanner()
+        self.stats_manager = stats_manager or StatsManager(self.column_store)
+        # одновременные сканы одной таблицы читают её один раз
+        self.shared_scanner = shared_scanner or SharedScanner()
+        # условия и агрегаты по большим таблицам считаются на numpy, если он установлен
+        self.vector_engine = vector_engine or VectorEngine()
+        # INSERT и COPY дописывают строки сегментами, индексы и статистика потом только дополняются
+        self.table_writer = table_writer or TableWriter(self.column_store)
+        self.plan_cache = PlanCache()
+
+
+    def close(self):
+        self.parallel_scanner.close()
+
+
+    def create_index(self, table_name: str, column: str):
+        self.index_manager.create(table_name, column)
+
+
+    def insert(self, table_name: str, rows: list, columns: list = None) -> tuple:
+        """
+        INSERT и COPY: дописывает строки в таблицу.
+        Возвращает (таблица до записи, таблица после записи, число строк).
+        """
+        return self.table_writer.append(table_name, rows, columns)
+
+
+    def appended_rows(self, query_dict: dict, table, start: int, have: int):
+        """
+        Строки, которые дописанные строки [start, table.row_count) добавляют к результату
+        простого SELECT, уже содержащему have строк. None — результат так не дополнить
+        (JOIN, агрегаты, сортировка, OFFSET), его надо считать заново.
+        """
+        if query_dict.get('type') != 'select' or query_dict.get('join') or query_dict.get('aggregates') \
+                or query_dict.get('group_by') or query_dict.get('order_by') or query_dict.get('offset'):
+            return None
+
+        limit = query_dict.get('limit')
+        if limit is not None and have >= limit:
+            # LIMIT уже набран первыми строками таблицы
+            return []
+
+        columns = query_dict['columns']
+        if columns == ['*']: names = table.columns
+        else: names = [col for col in columns if col in table.types]
+
+        plan = self.compile(query_dict, table, names)
+        rows = plan.scan(table, start, table.row_count)
+        return list(rows if limit is None else islice(rows, limit - have))
+
+
+    def table_stats(self, table_names) -> dict:
+        """
+        Уже посчитанная статистика таблиц {таблица: сводка}; таблицы без неё пропускаются.
+        """
+        result = {}
+        for table_name in table_names:
+            try:
+                stats = self.stats_manager.peek(table_name)
+            except (OSError, ValueError):
+                continue
+            if stats is not None:
+                result[table_name] = stats.summary()
+        return result
 
 
     def execute(self, query_dict: dict) -> list[dict]:
+        return list(self.execute_iter(query_dict))
+
+
+    def version(self, query_dict: dict):
+        """
+        Версия данных, на которых выполняется запрос: версия таблицы,
+        для JOIN — версии обеих таблиц.
+        """
+        version = self.column_store.version(query_dict['table'])
+        if query_dict.get('join'):
+            return [version, self.column_store.version(query_dict['join']['table'])]
+        return version
+
+
+    def execute_iter(self, query_dict: dict):
+        """
+        Потоковый вариант execute: возвращает генератор строк результата.
+        Таблица открывается сразу, поэтому ошибки вроде отсутствующей
+        таблицы возникают до начала отправки.
+        """
         table_name = query_dict['table']
         columns = query_dict['columns']
-        condition = query_dict['condition']
+        limit = query_dict.get('limit')
+        offset = query_dict.get('offset') or 0
 
-        table_dir = os.path.join(self.db_path, table_name)
-        csv_file = os.path.join(table_dir, 'table.csv')
+        if query_dict.get('join'):
+            return self._execute_join(query_dict)
 
-        if not os.path.isfile(csv_file):
-            raise FileNotFoundError(f'Файл таблицы не найден: {csv_file}')
+        # таблица читается из колоночного хранилища, csv разбирается только при изменении
+        table = self.column_store.open(table_name)
 
-        result = []
+        if columns == ['*']: names = table.columns
+        else: names = [col for col in columns if col in table.types]
 
-        with open(csv_file, mode='r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                # применяем условие where
-                if condition:
-                    col = condition['column']
-                    op_str = condition['operator']
-                    value = condition['value']
+        if query_dict.get('aggregates') or query_dict.get('group_by'):
+            return self._execute_aggregate(query_dict, table)
 
-                    if col not in row:
-                        continue
+        if query_dict.get('order_by'):
+            return self._execute_sorted(query_dict, table, names)
 
-                    # преобразуем значения к флоату, если можно
-                    row_val = row[col]
+        if limit == 0:
+            return iter([])
 
-                    try: 
-                        row_val = float(row_val)
-                        value = float(value)
+        return self._select(query_dict, table, names, offset, limit)
 
-                    except ValueError: pass
 
-                    op_func = self.OPERATORS.get(op_str)
-                    if not op_func or not op_func(row_val, value): continue
+    def _select(self, query_dict: dict, table, names: list, offset: int, limit):
+        """
+        Строки, удовлетворяющие условию, в порядке таблицы: через индекс,
+        параллельный или обычный скан.
+        """
+        condition = query_dict['condition']
+        stats, ranges = self._zone_ranges(table, condition)
+
+        # запрос компилируется один раз и берётся из кэша планов
+        plan = self.compile(query_dict, table, names)
+
+        # точечный запрос — через хэш-индекс, диапазон — бинарным поиском по индексу
+        indexed = self._lookup_index(table, condition, stats)
+        if indexed is not None:
+            row_ids, exact = indexed
+            if exact:
+                # номера строк известны заранее — читаем только нужный отрезок
+                return plan.take(table, row_ids[offset:None if limit is None else offset + limit])
+            return _apply_limit(plan.take(table, row_ids, refilter=True), offset, limit)
+
+        if condition and self.vector_engine.enabled_for(table):
+            # маска считается по всей таблице сразу; LIMIT отрезает уже найденные номера
+            row_ids = self.vector_engine.select(table, condition, ranges)
+            if row_ids is not None:
+                return self.vector_engine.take(table, names, row_ids[offset:None if limit is None else offset + limit])
+
+        if limit is None:
+            # большую таблицу без подходящего индекса сканируем в нескольких процессах
+            if self.parallel_scanner.enabled_for(table):
+                return self.parallel_scanner.scan(table, names, condition, ranges)
+            if not offset:
+                # без ORDER BY порядок строк не гарантирован, поэтому запрос может присоединиться
+                # к общему скану; такой результат помечен rotated и в кэше не режется и не проецируется
+                return self.shared_scanner.scan_tuples(table, plan, ranges).dicts(names)
+            return _apply_limit(plan.scan(table, 0, table.row_count, ranges=ranges), offset, limit)
+
+        # с LIMIT скан останавливается, как только набралось нужное число строк;
+        # сколько строк придётся просмотреть, оцениваем по избирательности условия
+        selectivity = estimate_selectivity(condition, stats) if condition else 1.0
+        expected_scan = (offset + limit) / max(selectivity, 1e-6)
+
+        if self.parallel_scanner.enabled_for(table) and expected_scan >= self.parallel_scanner.threshold:
+            return _apply_limit(self.parallel_scanner.scan(table, names, condition, ranges), offset, limit)
+
+        first_block = min(int(expected_scan) + 1, table.row_count)
+        return _apply_limit(plan.scan(table, 0, table.row_count, first_block=first_block, ranges=ranges), offset, limit)
+
+
+    def _zone_ranges(self, table, condition):
+        """
+        Статистика таблицы и диапазоны строк, где условие может выполниться
+        (None — читать всё). Пока статистика считается в фоне, оба значения None.
+        """
+        if not condition:
+            return None, None
 
-                # выбираем только нужные колонки
-                if columns == ['*']: filtered = row
-                else: filtered = {col: row[col] for col in columns if col in row}
+        stats = self.stats_manager.get_ready(table)
+        if stats is None:
+            return None, None
+        return stats, stats.live_ranges(condition)
 
-                result.append(filtered)
 
-        return result
+    def _execute_sorted(self, query_dict: dict, table, names: list):
+        """
+        ORDER BY: с LIMIT — куча из offset + limit строк, без LIMIT — внешняя сортировка.
+        """
+        order_by = query_dict['order_by']
+        limit = query_dict.get('limit')
+        offset = query_dict.get('offset') or 0
+
+        sort_columns = [item['column'] for item in order_by]
+        for column in sort_columns:
+            if column not in table.types:
+                raise ValueError(f'Колонка {column} не найдена в таблице {table.name}.')
+
+        if limit == 0:
+            return iter([])
+
+        # без условия и по возрастанию одной колонки порядок уже есть в сортированном индексе
+        if not query_dict['condition'] and len(order_by) == 1 and not order_by[0]['desc']:
+            index = self.index_manager.get(table, sort_columns[0])
+            if index is not None:
+                plan = self.compile(query_dict, table, names)
+                return plan.take(table, index.positions[offset:None if limit is None else offset + limit])
+
+        # колонки сортировки, которых нет в проекции, выбираются и потом отбрасываются
+        wide = names + [col for col in dict.fromkeys(sort_columns) if col not in names]
+        rows = self._sort(self._select(query_dict, table, wide, 0, None), order_by, offset, limit)
+
+        if len(wide) > len(names):
+            rows = map(partial(_project, names), rows)
+        return rows
 
-class CacheManager:
-    """
-    Кэширует результаты запросов по их хэшам.
-    При переполнении удаляет самый старый элемент (FIFO).
-    """
 
-    def __init__(self, max_size: int = 100):
-        self.max_size = max_size
-        self.cache = OrderedDict()
+    def _sort(self, rows, order_by: list, offset: int, limit):
+        """
+        Сортирует строки и применяет LIMIT/OFFSET: с LIMIT — куча из offset + limit строк,
+        без LIMIT — внешняя сортировка.
+        """
+        key, reverse = sort_key(order_by)
+        if limit is not None:
+            rows = iter(top_k(rows, offset + limit, key, reverse))
+        else:
+            rows = ExternalSorter(key, reverse, self.sort_memory_bytes, self.spill_dir).sort(rows)
+        return _apply_limit(rows, offset, limit)
+
+
+    def _execute_join(self, query_dict: dict):
+        """
+        SELECT ... FROM a JOIN b ON a.x = b.y. Условия WHERE на одну таблицу
+        проверяются при её чтении (с индексами и зоновыми картами), остальные —
+        на парах строк. Хэш-таблица строится по стороне, где по статистике
+        меньше строк, вторая сторона читается потоком.
+        """
+        join = query_dict['join']
+        order_by = query_dict.get('order_by') or []
+        limit = query_dict.get('limit')
+        offset = query_dict.get('offset') or 0
+
+        tables = (self.column_store.open(query_dict['table']), self.column_store.open(join['table']))
+        if tables[0].name == tables[1].name:
+            raise ValueError('Соединение таблицы с самой собой не поддерживается.')
+        resolve = partial(_resolve_column, tables)
+
+        keys = sorted([resolve(join['left']), resolve(join['right'])])
+        if keys[0][0] == keys[1][0]:
+            raise ValueError('Условие ON должно связывать колонки двух разных таблиц.')
+
+        # (имя в результате, сторона, колонка); в SELECT * совпадающие имена уточняются таблицей
+        if query_dict['columns'] == ['*']:
+            all_columns = tables[0].columns + tables[1].columns
+            output = [
+                (col if all_columns.count(col) == 1 else f'{table.name}.{col}', side, col)
+                for side, table in enumerate(tables) for col in table.columns
+            ]
+        else:
+            output = [(ref, *resolve(ref)) for ref in query_dict['columns']]
+        names = [name for name, _, _ in output]
+
+        # колонки сортировки, которых нет в проекции, выбираются и потом отбрасываются
+        wide = output + [
+            (column, *resolve(column))
+            for column in dict.fromkeys(item['column'] for item in order_by) if column not in names
+        ]
+
+        pushed, residual = _split_join_condition(query_dict['condition'], resolve)
+
+        needed = ([], [])
+        for side, column in keys + [(side, column) for _, side, column in wide] + _condition_columns(residual):
+            if column in tables[side].types and column not in needed[side]:
+                needed[side].append(column)
+
+        if limit == 0:
+            return iter([])
+
+        sides = []
+        for side, table in enumerate(tables):
+            side_query = {
+                'type': 'select', 'table': table.name, 'join': None, 'columns': needed[side],
+                'condition': pushed[side], 'group_by': None, 'aggregates': None,
+                'order_by': None, 'limit': None, 'offset': 0
+            }
+            column = keys[side][1]
+            sides.append((side_query, table, join_key(column, table.types[column], tables[1 - side].types[keys[1 - side][1]])))
+
+        # хэш-таблицу строим по меньшей стороне с учётом условий WHERE
+        build = 0 if self._estimate_rows(tables[0], pushed[0]) <= self._estimate_rows(tables[1], pushed[1]) else 1
+        build_query, build_table, build_key = sides[build]
+        probe_query, probe_table, probe_key = sides[1 - build]
+
+        hash_join = HashJoin(build_key, probe_key, self.join_memory_bytes, self.spill_dir)
+        pairs = hash_join.join(
+            self._select(build_query, build_table, build_query['columns'], 0, None),
+            self._select(probe_query, probe_table, probe_query['columns'], 0, None)
+        )
+        if build == 1:
+            pairs = ((left, right) for right, left in pairs)
+        if residual is not None:
+            pairs = filter(compile_pair_filter(residual, (tables[0].types, tables[1].types)), pairs)
+
+        rows = ({name: pair[side][column] for name, side, column in wide} for pair in pairs)
+        if not order_by:
+            return _apply_limit(rows, offset, limit)
+
+        rows = self._sort(rows, order_by, offset, limit)
+        if len(wide) > len(output):
+            rows = map(partial(_project, names), rows)
+        return rows
+
+
+    def _estimate_rows(self, table, condition) -> float:
+        """
+        Оценка числа строк таблицы, проходящих условие, по статистике (если она уже есть).
+        """
+        stats = self.stats_manager.get_ready(table)
+        rows = stats.rows if stats is not None else table.row_count
+        return rows * estimate_selectivity(condition, stats) if condition else rows
 
 
-    def get(self, query_hash: str):
+    def _execute_aggregate(self, query_dict: dict, table):
+        """
+        Агрегаты и GROUP BY: один проход хэш-агрегации по строкам, прошедшим WHERE.
+        Большая таблица агрегируется по диапазонам в пуле процессов,
+        частичные результаты складываются здесь.
+        """
+        group_by = query_dict.get('group_by') or []
+        aggregates = query_dict.get('aggregates') or []
+        condition = query_dict['condition']
+        limit = query_dict.get('limit')
+        offset = query_dict.get('offset') or 0
+
+        for column in group_by + [agg['column'] for agg in aggregates if agg['column'] != '*']:
+            if column not in table.types:
+                raise ValueError(f'Колонка {column} не найдена в таблице {table.name}.')
+        for agg in aggregates:
+            if agg['function'] in NUMERIC_FUNCTIONS and table.types[agg['column']] not in NUMERIC_TYPES:
+                raise ValueError(f"Функция {agg['function'].upper()} применима только к числовым колонкам: {agg['column']}.")
+
+        # строка для агрегации: значения ключа группы, затем входы агрегатов
+        names = list(group_by)
+        specs = []
+        for agg in aggregates:
+            if agg['column'] == '*':
+                specs.append((agg['function'], None))
+            else:
+                specs.append((agg['function'], len(names)))
+                names.append(agg['column'])
+
+        aggregator = HashAggregator(len(group_by), specs, self.aggregate_memory_bytes, self.spill_dir)
+        if not group_by:
+            # без GROUP BY результат — одна строка, даже если ни одна строка не подошла
+            aggregator.merge({(): aggregator.new_states()})
+
+        plan = self.compile(query_dict, table, names)
+        stats, ranges = self._zone_ranges(table, condition)
+        indexed = self._lookup_index(table, condition, stats)
+        if indexed is not None:
+            row_ids, exact = indexed
+            aggregator.add_rows(plan.take_tuples(table, row_ids if exact else plan.filter_ids(table, row_ids)))
+        else:
+            vector_groups = None
+            if self.vector_engine.enabled_for(table):
+                vector_groups = self.vector_engine.aggregate(table, names, condition, len(group_by), specs, ranges)
+            if vector_groups is not None:
+                aggregator.merge(vector_groups)
+            elif self.parallel_scanner.enabled_for(table):
+                for partial_groups in self.parallel_scanner.aggregate(table, names, condition, len(group_by), specs, ranges):
+                    aggregator.merge(partial_groups)
+            else:
+                aggregator.add_rows(self.shared_scanner.scan_tuples(table, plan, ranges))
+
+        # колонки результата в порядке SELECT
+        sources = []
+        for name in query_dict['columns']:
+            if name in group_by:
+                sources.append((name, True, group_by.index(name)))
+            else:
+                sources.append((name, False, [agg['name'] for agg in aggregates].index(name)))
+
+        rows = (
+            {name: key[i] if from_key else values[i] for name, from_key, i in sources}
+            for key, values in aggregator.results()
+        )
+
+        order_by = query_dict.get('order_by')
+        if not order_by:
+            return _apply_limit(rows, offset, limit)
+
+        result_columns = [name for name, _, _ in sources]
+        for item in order_by:
+            if item['column'] not in result_columns:
+                raise ValueError(f"Колонка {item['column']} не найдена в результате запроса.")
+        return self._sort(rows, order_by, offset, limit)
+
+
+    def compile(self, query_dict: dict, table, names: list) -> CompiledQuery:
         """
-        Возвращает результат по хэшу запроса или None.
+        Возвращает скомпилированный план запроса под текущую схему таблицы.
         """
-        return self.cache.get(query_hash)
+        schema = tuple((name, table.types[name]) for name in table.columns)
+        # LIMIT/OFFSET и ORDER BY применяются поверх плана, план от них не зависит
+        key = (SQLParser.cache_key(dict(query_dict, columns=names, order_by=None, limit=None, offset=0)), schema)
+        return self.plan_cache.get(key, lambda: CompiledQuery(names, query_dict['condition'], table.types))
 
 
-    def set(self, query_hash, result):
+    def _lookup_index(self, table, condition, stats=None):
         """
-        Сохраянет результат запроса в кэш.
-        Удаляет старейший элемент при переполнении.
+        Номера строк по индексу и признак exact (номера точно удовлетворяют условию)
+        или None, если подходящего индекса нет. Если exact ложен, номера — кандидаты,
+        которые нужно проверить полным условием.
         """
-        if query_hash in self.cache:
-            # обновляем порядок
-            self.cache.move_to_end(query_hash)
-        self.cache[query_hash] = result
+        if not condition:
+            return None
+
+        op = condition['operator']
+
+        if op == 'and':
+            # хватает одного индекса — берём самое избирательное условие, у которого он есть
+            for arg in sorted(condition['args'], key=lambda arg: estimate_selectivity(arg, stats)):
+                indexed = self._lookup_index(table, arg, stats)
+                if indexed is not None:
+                    return indexed[0], False
+            return None
+
+        if op == 'or':
+            # объединение имеет смысл, только если индекс есть у каждого условия
+            rows = set()
+            exact = True
+            for arg in condition['args']:
+                indexed = self._lookup_index(table, arg, stats)
+                if indexed is None:
+                    return None
+                rows.update(indexed[0])
+                exact = exact and indexed[1]
+            return sorted(rows), exact
+
+        if op == 'not':
+            return None
+
+        indexed = self.hash_index_manager.lookup(table, condition)
+        if indexed is None:
+            indexed = self.index_manager.lookup(table, condition)
+        if indexed is None:
+            return None
+        return indexed, True
+
+
+def _resolve_column(tables: tuple, ref: str, strict: bool = True) -> tuple:
+    """
+    'a.x' или 'x' -> (номер таблицы в JOIN, колонка). Неуточнённое имя должно быть
+    ровно в одной из таблиц. strict=False — для WHERE: неизвестная колонка
+    не ошибка, сравнение с ней просто ложно.
+    """
+    if '.' in ref:
+        table_name, column = ref.split('.', 1)
+        for side, table in enumerate(tables):
+            if table.name == table_name:
+                if strict and column not in table.types:
+                    raise ValueError(f'Колонка {column} не найдена в таблице {table_name}.')
+                return side, column
+        raise ValueError(f'Таблица {table_name} не участвует в запросе.')
+
+    sides = [side for side, table in enumerate(tables) if ref in table.types]
+    if len(sides) > 1:
+        raise ValueError(f'Колонка {ref} есть в обеих таблицах, укажите таблицу: {tables[0].name}.{ref} или {tables[1].name}.{ref}.')
+    if not sides:
+        if strict:
+            raise ValueError(f'Колонка {ref} не найдена ни в {tables[0].name}, ни в {tables[1].name}.')
+        return 0, ref
+    return sides[0], ref
+
+
+def _split_join_condition(condition: dict, resolve) -> tuple:
+    """
+    Делит условие WHERE запроса с JOIN на части AND: условия на одну таблицу
+    (для каждой стороны, с голыми именами колонок) и остаток на пары строк,
+    листья которого помечены стороной ('side').
+    """
+    pushed = ([], [])
+    residual = []
+    if condition:
+        conjuncts = condition['args'] if condition['operator'] == 'and' else [condition]
+        for conjunct in conjuncts:
+            bound = _bind_condition(conjunct, resolve)
+            sides = {side for side, _ in _condition_columns(bound)}
+            if len(sides) == 1:
+                pushed[sides.pop()].append(_unbind_condition(bound))
+            else:
+                residual.append(bound)
+
+    def combine(args):
+        if not args:
+            return None
+        return args[0] if len(args) == 1 else {'operator': 'and', 'args': args}
+
+    return (combine(pushed[0]), combine(pushed[1])), combine(residual)
+
+
+def _bind_condition(condition: dict, resolve) -> dict:
+    if 'column' not in condition:
+        return dict(condition, args=[_bind_condition(arg, resolve) for arg in condition['args']])
+    side, column = resolve(condition['column'], strict=False)
+    return dict(condition, side=side, column=column)
 
-        if len(self.cache) > self.max_size:
-            # удаляем первый (самый старый)
-            self.cache.popitem(last=False) 
+
+def _unbind_condition(condition: dict) -> dict:
+    if 'column' not in condition:
+        return dict(condition, args=[_unbind_condition(arg) for arg in condition['args']])
+    condition = dict(condition)
+    del condition['side']
+    return condition
+
+
+def _condition_columns(condition: dict) -> list:
+    """
+    Пары (сторона, колонка) из листьев условия с разрешёнными колонками.
+    """
+    if not condition:
+        return []
+    if 'column' in condition:
+        return [(condition['side'], condition['column'])]
+    return [pair for arg in condition['args'] for pair in _condition_columns(arg)]
+
+
+def _project(names: list, row: dict) -> dict:
+    return {name: row[name] for name in names}
+
+
+def _apply_limit(rows, offset: int, limit):
+    """
+    Пропускает offset строк и отдаёт не больше limit. Дальше источник не читается.
+    """
+    if limit is None and not offset:
+        return rows
+    return islice(rows, offset, None if limit is None else offset + limit)
 
 
 class DatabaseStructureBuilder:
     """
     Строит описание структуры базы данных:
-    таблицы и их колонки.
+    таблицы и их колонки. С каталогом — из него, без обхода папки.
     """
     
-    def __init__(self, database_path: str):
+    def __init__(self, database_path: str, catalog: Catalog = None):
         self.db_path = database_path
+        self.catalog = catalog
+
+
+    def describe(self) -> dict:
+        """
+        Типы колонок и число строк таблиц, если они уже есть в каталоге.
+        """
+        return self.catalog.describe() if self.catalog is not None else {}
 
 
     def build(self) -> dict:
+        if self.catalog is not None:
+            return self.catalog.structure()
+
         structure = {}
         if not os.path.isdir(self.db_path):
             raise FileNotFoundError(f"Путь к базе данных не найден: {self.db_path}")
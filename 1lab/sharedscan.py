@@ -0,0 +1,284 @@
+import threading
+from functools import partial
+from collections import OrderedDict
+from itertools import chain
+
+from storage import StringColumn
+
+
+# строк в одном общем блоке; меньше BLOCK_ROWS планировщика, потому что каждый
+# отставший запрос держит свой разобранный блок
+SHARED_BLOCK_ROWS = 16384
+
+# сколько прочитанных блоков таблицы держим для запросов, которые до них ещё не дошли;
+# блок, который больше никому не нужен, освобождается сразу
+SHARED_BLOCKS = 32
+
+# блок читается общим, только если запросу нужна хотя бы такая доля его строк;
+# иначе (зоновые карты отсекли почти весь блок) дешевле прочитать свои строки отдельно
+MIN_SHARED_FRACTION = 0.5
+
+
+class SharedBlock:
+    """
+    Блок строк [lo, hi) одной версии таблицы, общий для запросов, которые его читают.
+    Строки внутри нумеруются с нуля, поэтому блок подставляется
+    в CompiledQuery.scan_tuples вместо таблицы.
+    Числовые колонки — срезы mmap, их чтение и так дёшево; строковые (и даты)
+    при чтении целиком декодируются из utf-8 один раз на всех.
+    """
+
+    def __init__(self, table, lo: int, hi: int):
+        self.table = table
+        self.lo = lo
+        self.hi = hi
+        self.row_count = hi - lo
+        self.types = table.types
+        self._columns = {}
+        self._lock = threading.Lock()
+
+    def column(self, name: str):
+        col = self._columns.get(name)
+        if col is None:
+            source = self.table.column(name)[self.lo:self.hi]
+            col = _SharedStrings(source) if isinstance(source, StringColumn) else source
+            # при гонке два потока создадут одинаковые обёртки, останется одна
+            col = self._columns.setdefault(name, col)
+        return col
+
+
+class _SharedStrings:
+    """
+    Строковая колонка блока. Срез (скан) декодирует всю колонку один раз
+    и дальше отдаётся из списка; отдельные строки по номерам (после фильтра)
+    до этого читаются прямо из файла, чтобы избирательный запрос не декодировал лишнего.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.values = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.source)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.decoded()[i]
+        values = self.values
+        return values[i] if values is not None else self.source[i]
+
+    def decoded(self) -> list:
+        if self.values is None:
+            with self._lock:
+                if self.values is None:
+                    self.values = list(self.source)
+        return self.values
+
+
+class _SharedScan:
+    """
+    Скан одной версии таблицы, к которому присоединяются запросы.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.blocks = OrderedDict()
+        # сколько присоединённых запросов ещё прочитают каждый блок
+        self.wanted = {}
+        # блок, который сейчас читают; новый запрос начинает с него
+        self.position = 0
+        self.readers = 0
+
+
+class SharedScanner:
+    """
+    Общий скан таблицы для одновременных запросов. Запрос, пришедший,
+    пока таблицу уже читают, присоединяется к скану с текущего блока:
+    каждый блок разбирается из файлов колонок один раз, а условие
+    и проекция каждого запроса применяются к нему отдельно.
+    Дойдя до конца таблицы, присоединившийся запрос дочитывает
+    пропущенное начало (хвост по кругу).
+
+    Строки такого запроса идут не в порядке таблицы (ScanRows.rotated):
+    без ORDER BY порядок не гарантирован, а держать хвост в памяти,
+    чтобы отдать его после начала таблицы, значило бы копить почти всю таблицу.
+    max_blocks=0 выключает общий скан.
+    """
+
+    def __init__(self, max_blocks: int = SHARED_BLOCKS):
+        self.max_blocks = max_blocks
+        self._scans = {}
+        self._lock = threading.Lock()
+
+        # статистика
+        self.scans = 0
+        self.attached = 0
+        self.blocks_read = 0
+        self.blocks_shared = 0
+
+    def scan_tuples(self, table, plan, ranges: list = None) -> 'ScanRows':
+        """
+        Строки-кортежи запроса plan по всей таблице, как plan.scan_tuples(table, 0, row_count, ranges=ranges),
+        но через общий скан.
+        """
+        rows = ScanRows()
+        if not self.max_blocks:
+            rows.source = plan.scan_tuples(table, 0, table.row_count, ranges=ranges)
+        else:
+            rows.source = self._scan(table, plan, ranges, rows)
+        return rows
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'scans': self.scans,
+                'attached': self.attached,
+                'active': sum(scan.readers for scan in self._scans.values()),
+                'blocks_read': self.blocks_read,
+                'blocks_shared': self.blocks_shared
+            }
+
+    def _scan(self, table, plan, ranges, rows: 'ScanRows'):
+        blocks = _block_pieces(table.row_count, ranges)
+        # блоки, из которых запросу нужна лишь малая часть (зоновые карты отсекли остальное),
+        # читаются отдельно
+        shared = [
+            index for index, pieces in blocks.items()
+            if sum(hi - lo for lo, hi in pieces) >= MIN_SHARED_FRACTION * min(
+                SHARED_BLOCK_ROWS, table.row_count - index * SHARED_BLOCK_ROWS
+            )
+        ]
+        scan, start = self._attach(table, shared)
+        rows.rotated = start > 0
+        remaining = set(shared)
+        try:
+            for index, pieces in _blocks_from(blocks, start):
+                if index not in remaining:
+                    yield from chain.from_iterable(plan.scan_tuples(table, lo, hi) for lo, hi in pieces)
+                    continue
+                block = self._block(scan, index)
+                yield from chain.from_iterable(
+                    plan.scan_tuples(block, lo - block.lo, hi - block.lo) for lo, hi in pieces
+                )
+                remaining.discard(index)
+                self._release(scan, [index])
+        finally:
+            self._release(scan, remaining)
+            self._detach(scan)
+
+    def _attach(self, table, indexes: list) -> tuple:
+        """
+        Скан текущей версии таблицы и блок, с которого начинать чтение.
+        """
+        with self._lock:
+            scan = self._scans.get(table.name)
+            if scan is None or scan.table.version != table.version:
+                # таблица изменилась — старый скан дочитывают те, кто его начал
+                scan = _SharedScan(table)
+                self._scans[table.name] = scan
+
+            if scan.readers:
+                start = scan.position
+                self.attached += 1
+            else:
+                start = 0
+                self.scans += 1
+            scan.readers += 1
+            for index in indexes:
+                scan.wanted[index] = scan.wanted.get(index, 0) + 1
+        return scan, start
+
+    def _release(self, scan: _SharedScan, indexes):
+        """
+        Запрос больше не прочитает эти блоки; блоки, которые не нужны никому, освобождаются.
+        """
+        with self._lock:
+            for index in indexes:
+                wanted = scan.wanted.pop(index) - 1
+                if wanted:
+                    scan.wanted[index] = wanted
+                else:
+                    scan.blocks.pop(index, None)
+
+    def _detach(self, scan: _SharedScan):
+        with self._lock:
+            scan.readers -= 1
+            if not scan.readers:
+                # последний читатель ушёл — разобранные блоки больше не нужны
+                scan.blocks.clear()
+                scan.wanted.clear()
+                if self._scans.get(scan.table.name) is scan:
+                    del self._scans[scan.table.name]
+
+    def _block(self, scan: _SharedScan, index: int) -> SharedBlock:
+        with self._lock:
+            scan.position = index
+            block = scan.blocks.get(index)
+            if block is not None:
+                scan.blocks.move_to_end(index)
+                self.blocks_shared += 1
+                return block
+
+            lo = index * SHARED_BLOCK_ROWS
+            block = SharedBlock(scan.table, lo, min(lo + SHARED_BLOCK_ROWS, scan.table.row_count))
+            scan.blocks[index] = block
+            if len(scan.blocks) > self.max_blocks:
+                scan.blocks.popitem(last=False)
+            self.blocks_read += 1
+        # колонки блока разбираются при первом обращении, вне общей блокировки
+        return block
+
+
+class ScanRows:
+    """
+    Строки общего скана. rotated — запрос присоединился к уже идущему скану,
+    и строки идут по кругу с его текущего блока, а не в порядке таблицы;
+    известно, как только начато чтение. Итерация идёт прямо по source,
+    без лишнего вызова на каждую строку.
+    """
+
+    def __init__(self):
+        self.rotated = False
+        self.source = iter(())
+        self._rows = None
+
+    def dicts(self, names: list) -> 'ScanRows':
+        """
+        Строки-словари с колонками names вместо кортежей.
+        """
+        self._rows = map(dict, map(partial(zip, names), self.source))
+        return self
+
+    def __iter__(self):
+        return iter(self._rows if self._rows is not None else self.source)
+
+    def close(self):
+        if hasattr(self.source, 'close'):
+            self.source.close()
+
+
+def _block_pieces(row_count: int, ranges: list) -> dict:
+    """
+    Диапазоны строк, разрезанные по границам блоков: {номер блока: [(lo, hi), ...]}.
+    """
+    if ranges is None:
+        ranges = [(0, row_count)]
+
+    blocks = {}
+    for lo, hi in ranges:
+        while lo < hi:
+            index = lo // SHARED_BLOCK_ROWS
+            end = min(hi, (index + 1) * SHARED_BLOCK_ROWS)
+            blocks.setdefault(index, []).append((lo, end))
+            lo = end
+    return blocks
+
+
+def _blocks_from(blocks: dict, start: int) -> list:
+    """
+    (номер блока, [(lo, hi), ...]) сначала от блока start до конца таблицы, затем с начала до start.
+    """
+    tail = [(index, rows) for index, rows in blocks.items() if index >= start]
+    head = [(index, rows) for index, rows in blocks.items() if index < start]
+    return tail + head
@@ -0,0 +1,137 @@
+import sys
+import heapq
+import pickle
+import tempfile
+from operator import itemgetter
+from itertools import islice
+
+
+# сколько первых строк берём, чтобы оценить размер строки в памяти
+SAMPLE_ROWS = 256
+
+# строк в одной записи pickle во временном файле
+SPILL_CHUNK_ROWS = 4096
+
+
+def sort_key(order_by: list):
+    """
+    Функция ключа и признак reverse для списка [{'column', 'desc'}, ...].
+    Если направления у колонок разные, убывающие значения оборачиваются в _Descending.
+    """
+    columns = [item['column'] for item in order_by]
+    directions = {item['desc'] for item in order_by}
+
+    if len(directions) == 1:
+        return itemgetter(*columns), directions.pop()
+
+    descending = [item['desc'] for item in order_by]
+
+    def key(row):
+        return tuple(_Descending(row[col]) if desc else row[col] for col, desc in zip(columns, descending))
+
+    return key, False
+
+
+def top_k(rows, k: int, key, reverse: bool = False) -> list:
+    """
+    Первые k строк в порядке сортировки. В памяти держится куча из k строк,
+    результат совпадает с sorted(rows, key=key, reverse=reverse)[:k].
+    """
+    if reverse:
+        return heapq.nlargest(k, rows, key=key)
+    return heapq.nsmallest(k, rows, key=key)
+
+
+class ExternalSorter:
+    """
+    Внешняя сортировка слиянием. Строки копятся в памяти, пока их оценочный
+    размер не превысит memory_bytes, затем отсортированная порция сбрасывается
+    во временный файл. В конце порции сливаются heapq.merge, поэтому сортируется
+    и результат больше памяти. Сортировка устойчивая, как у sorted().
+    """
+
+    def __init__(self, key, reverse: bool = False, memory_bytes: int = 64 * 1024 * 1024, spill_dir: str = None):
+        self.key = key
+        self.reverse = reverse
+        self.memory_bytes = memory_bytes
+        self.spill_dir = spill_dir
+        self.spilled_runs = 0
+
+    def sort(self, rows):
+        """
+        Генератор отсортированных строк. Временные файлы удаляются,
+        когда генератор дочитан или закрыт.
+        """
+        rows = iter(rows)
+        runs = []
+        try:
+            # размер строки оцениваем по первым строкам, дальше считаем только их число
+            buffer = list(islice(rows, SAMPLE_ROWS))
+            row_size = sum(map(_row_size, buffer)) / len(buffer) if buffer else 1
+            max_rows = max(SAMPLE_ROWS, int(self.memory_bytes / row_size))
+
+            while True:
+                buffer.extend(islice(rows, max_rows - len(buffer)))
+                if len(buffer) < max_rows:
+                    break
+                runs.append(self._spill(buffer))
+                buffer = []
+
+            buffer.sort(key=self.key, reverse=self.reverse)
+            if not runs:
+                yield from buffer
+                return
+
+            # порция из памяти идёт последней, чтобы слияние осталось устойчивым
+            sources = [self._read(f) for f in runs] + [buffer]
+            yield from heapq.merge(*sources, key=self.key, reverse=self.reverse)
+        finally:
+            for f in runs:
+                f.close()
+
+    def _spill(self, buffer: list):
+        buffer.sort(key=self.key, reverse=self.reverse)
+        f = tempfile.TemporaryFile(dir=self.spill_dir)
+        rows = iter(buffer)
+        while True:
+            chunk = list(islice(rows, SPILL_CHUNK_ROWS))
+            if not chunk:
+                break
+            pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.seek(0)
+        self.spilled_runs += 1
+        return f
+
+    @staticmethod
+    def _read(f):
+        while True:
+            try:
+                chunk = pickle.load(f)
+            except EOFError:
+                return
+            yield from chunk
+
+
+class _Descending:
+    """
+    Значение с обратным порядком сравнения — для DESC в смешанном ORDER BY.
+    """
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def _row_size(row) -> int:
+    """
+    Примерный размер строки в памяти, в байтах.
+    """
+    values = row.values() if isinstance(row, dict) else row
+    return sys.getsizeof(row) + sum(map(sys.getsizeof, values))
@@ -0,0 +1,416 @@
+import os
+import json
+import math
+import zlib
+import base64
+import threading
+
+from schema import NUMERIC_TYPES, typed_constant
+from storage import ColumnStore, ColumnTable, appended_version, version_dir
+
+
+STATS_FILE = 'stats.json'
+
+# строк в одной зоне: для каждой зоны хранятся min/max/число пустых значений
+ZONE_ROWS = 8192
+
+# точность HyperLogLog: 2 ** HLL_PRECISION регистров, ошибка около 1.6%
+HLL_PRECISION = 12
+
+
+class HyperLogLog:
+    """
+    Оценка числа различных значений по 2 ** precision однобайтовым регистрам.
+    Хэш (crc32 текста значения, перемешанный умножением) стабилен между процессами,
+    поэтому регистры можно сохранять и складывать.
+    """
+
+    def __init__(self, precision: int = HLL_PRECISION, registers: bytearray = None):
+        self.precision = precision
+        self.registers = registers if registers is not None else bytearray(1 << precision)
+
+    def update(self, values):
+        registers = self.registers
+        width = 32 - self.precision
+        mask = (1 << width) - 1
+        for h in map(zlib.crc32, map(str.encode, map(str, values))):
+            h = (h * 0x9E3779B1) & 0xFFFFFFFF
+            index = h >> width
+            rank = width - (h & mask).bit_length() + 1
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # мало значений — точнее линейный подсчёт по пустым регистрам
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def dump(self) -> str:
+        return base64.b64encode(bytes(self.registers)).decode('ascii')
+
+    @classmethod
+    def load(cls, data: str, precision: int = HLL_PRECISION) -> 'HyperLogLog':
+        return cls(precision, bytearray(base64.b64decode(data)))
+
+
+class TableStats:
+    """
+    Статистика одной версии таблицы: число строк, для каждой колонки
+    min/max, число пустых значений, оценка числа различных значений
+    и зоновые карты — те же min/max/пустые по блокам из ZONE_ROWS строк.
+    """
+
+    def __init__(self, data: dict):
+        self.version = data['version']
+        self.rows = data['rows']
+        self.zone_rows = data['zone_rows']
+        self.columns = data['columns']
+        self.types = {name: col['type'] for name, col in self.columns.items()}
+
+    def summary(self) -> dict:
+        """
+        Краткая статистика для GET_STRUCTURE, без зон и регистров.
+        """
+        return {
+            'rows': self.rows,
+            'columns': {
+                name: {key: col[key] for key in ('type', 'min', 'max', 'nulls', 'distinct')}
+                for name, col in self.columns.items()
+            }
+        }
+
+    def live_ranges(self, condition: dict, start: int = 0, stop: int = None) -> list:
+        """
+        Диапазоны строк [lo, hi) внутри [start, stop), где условие может выполниться.
+        Зоны, которые по min/max заведомо не подходят, пропускаются; соседние зоны склеиваются.
+        """
+        stop = self.rows if stop is None else stop
+        ranges = []
+        first_zone = start // self.zone_rows
+        last_zone = (stop - 1) // self.zone_rows
+
+        for zone in range(first_zone, last_zone + 1):
+            if not self._zone_may_match(condition, zone):
+                continue
+            lo = max(zone * self.zone_rows, start)
+            hi = min((zone + 1) * self.zone_rows, stop)
+            if ranges and ranges[-1][1] == lo:
+                ranges[-1] = (ranges[-1][0], hi)
+            else:
+                ranges.append((lo, hi))
+        return ranges
+
+    def selectivity(self, condition: dict):
+        """
+        Доля строк, подходящих под одно сравнение, по min/max и числу различных значений.
+        None — статистика здесь не помогает.
+        """
+        column = condition['column']
+        col = self.columns.get(column)
+        if col is None or not self.rows:
+            return None
+
+        op = condition['operator']
+        distinct = max(col['distinct'], 1)
+        values = condition['value'] if op in ('in', 'between') else [condition['value']]
+        bounds = _comparable_values(col['type'], values, op)
+        if bounds is None:
+            return None
+
+        low, high = col['min'], col['max']
+        if low is None:
+            return 0.0
+
+        if op == '=':
+            return 1 / distinct if low <= bounds[0] <= high else 0.0
+        if op == '!=':
+            return 1 - 1 / distinct if low <= bounds[0] <= high else 1.0
+        if op == 'in':
+            return min(1.0, sum(1 / distinct for v in set(bounds) if low <= v <= high))
+        if col['type'] not in NUMERIC_TYPES:
+            return None
+
+        width = high - low
+        if op == 'between':
+            lo, hi = max(bounds[0], low), min(bounds[1], high)
+            if lo > hi:
+                return 0.0
+            return (hi - lo) / width if width else 1.0
+
+        value = bounds[0]
+        if not width:
+            return 1.0 if _compare(op, low, value) else 0.0
+        below = min(max((value - low) / width, 0.0), 1.0)
+        return below if op in ('<', '<=') else 1 - below
+
+    def _zone_may_match(self, condition: dict, zone: int) -> bool:
+        op = condition['operator']
+        if op == 'and':
+            return all(self._zone_may_match(arg, zone) for arg in condition['args'])
+        if op == 'or':
+            return any(self._zone_may_match(arg, zone) for arg in condition['args'])
+        if op == 'not':
+            # отрицание по min/max зоны не отсечь
+            return True
+
+        col = self.columns.get(condition['column'])
+        if col is None:
+            # колонки нет — сравнение ложно во всех строках
+            return False
+
+        values = condition['value'] if op in ('in', 'between') else [condition['value']]
+        bounds = _comparable_values(col['type'], values, op)
+        if bounds is None:
+            return True
+
+        low, high = col['zones']['min'][zone], col['zones']['max'][zone]
+        if col['zones']['nulls'][zone] and (op == '!=' or '' in bounds):
+            # пустые строки не входят в min/max зоны
+            return True
+        if low is None:
+            # в зоне только пустые строки
+            return op == '!='
+
+        if op == '=':
+            return low <= bounds[0] <= high
+        if op == '!=':
+            return not (low == high == bounds[0])
+        if op == 'in':
+            return any(low <= v <= high for v in bounds)
+        if op == 'between':
+            return high >= bounds[0] and low <= bounds[1]
+        if op in ('<', '<='):
+            return _compare(op, low, bounds[0])
+        return _compare(op, high, bounds[0])
+
+
+def _comparable_values(col_type: str, values: list, op: str):
+    """
+    Константы, которые можно сравнивать с min/max колонки так же, как это делает предикат,
+    или None, если по статистике судить нельзя.
+    """
+    if col_type != 'str':
+        bounds = [typed_constant(col_type, v) for v in values]
+        # константа не того типа в типизированной колонке: '=' и IN ничего не найдут
+        return None if None in bounds else bounds
+
+    # в строковой колонке похожие на числа строки сравниваются как числа,
+    # поэтому отсекаем только равенство с обычной строкой
+    if op not in ('=', '!=', 'in'):
+        return None
+    for v in values:
+        if not isinstance(v, str) or _is_number(v):
+            return None
+    return list(values)
+
+
+def _compare(op: str, left, right) -> bool:
+    if op == '<': return left < right
+    if op == '<=': return left <= right
+    if op == '>': return left > right
+    return left >= right
+
+
+def _is_number(value: str) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+class StatsManager:
+    """
+    Считает и хранит статистику таблиц. Статистика лежит в stats.json
+    рядом с файлами колонок своей версии (<table>/.store/<версия>/),
+    поэтому при изменении table.csv она пересчитывается вместе с колонками.
+    Когда в таблицу дописаны строки, пересчитываются только последняя
+    неполная зона и новые зоны.
+    """
+
+    def __init__(self, column_store: ColumnStore, logger=None):
+        self.column_store = column_store
+        self.logger = logger
+        self._stats = {}
+        self._locks = {}
+        self._building = set()
+        self._lock = threading.Lock()
+
+    def get(self, table: ColumnTable) -> TableStats:
+        """
+        Статистика открытой версии таблицы; считается при первом обращении.
+        """
+        stats = self._stats.get(table.name)
+        if stats is not None and stats.version == table.version:
+            return stats
+
+        with self._table_lock(table.name):
+            stats = self._stats.get(table.name)
+            if stats is None or stats.version != table.version:
+                if stats is None or not appended_version(stats.version, table.version):
+                    stats = self._load(os.path.join(table.path, STATS_FILE), table.version)
+                stats = self._build(table) if stats is None else self._extend(table, stats)
+                self._stats[table.name] = stats
+        return stats
+
+    def get_ready(self, table: ColumnTable):
+        """
+        Статистика, если она уже есть в памяти или на диске. Иначе запускает
+        подсчёт в фоне и возвращает None — запрос выполняется без неё.
+        """
+        stats = self._stats.get(table.name)
+        if stats is not None and stats.version == table.version:
+            return stats
+        if stats is not None and appended_version(table.version, stats.version):
+            # статистика уже дописана для более новой версии — этот запрос обойдётся без неё
+            return None
+
+        if stats is None or not appended_version(stats.version, table.version):
+            stats = self._load(os.path.join(table.path, STATS_FILE), table.version)
+        if stats is not None:
+            # дописанных строк обычно немного, досчитываем их сразу
+            return self.get(table)
+
+        key = (table.name, tuple(table.version))
+        with self._lock:
+            if key in self._building:
+                return None
+            self._building.add(key)
+        threading.Thread(target=self._build_in_background, args=(table, key), daemon=True).start()
+        return None
+
+    def peek(self, table_name: str):
+        """
+        Статистика текущей версии, если она уже посчитана, иначе None.
+        Таблицу не открывает и не конвертирует — подходит для GET_STRUCTURE.
+        """
+        version = self.column_store.version(table_name)
+        stats = self._stats.get(table_name)
+        if stats is not None and stats.version == version:
+            return stats
+
+        csv_file = self.column_store.csv_path(table_name)
+        stats = self._load(os.path.join(version_dir(csv_file, version), STATS_FILE), version)
+        if stats is None or stats.version != version:
+            # статистика без дописанных строк досчитается при следующем запросе
+            return None
+        self._stats[table_name] = stats
+        return stats
+
+    def _build_in_background(self, table: ColumnTable, key: tuple):
+        try:
+            self.get(table)
+        except Exception as e:
+            if self.logger is not None:
+                self.logger.log("ERROR", f"Не удалось посчитать статистику {table.name}: {e}")
+        finally:
+            with self._lock:
+                self._building.discard(key)
+
+    def _table_lock(self, table_name: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(table_name, threading.Lock())
+
+    def _load(self, stats_file: str, version: list):
+        """
+        Статистика с диска для этой версии или для версии, к которой дописаны строки.
+        """
+        try:
+            with open(stats_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != version and not appended_version(data.get('version'), version):
+            return None
+        return TableStats(data)
+
+    def _build(self, table: ColumnTable) -> TableStats:
+        columns = {}
+        for name in table.columns:
+            columns[name] = _column_stats(table.column(name), table.types[name], table.row_count)
+        return self._save(table, columns)
+
+    def _extend(self, table: ColumnTable, stats: TableStats) -> TableStats:
+        """
+        Статистика версии с дописанными строками из статистики предыдущей версии.
+        """
+        if stats.version == table.version:
+            return stats
+        columns = {}
+        for name in table.columns:
+            columns[name] = _column_stats(
+                table.column(name), table.types[name], table.row_count, stats.columns[name], stats.rows
+            )
+        return self._save(table, columns)
+
+    def _save(self, table: ColumnTable, columns: dict) -> TableStats:
+        data = {
+            'version': table.version,
+            'rows': table.row_count,
+            'zone_rows': ZONE_ROWS,
+            'columns': columns
+        }
+
+        stats_file = os.path.join(table.path, STATS_FILE)
+        tmp_file = f'{stats_file}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_file, stats_file)
+        except OSError:
+            # версию уже удалили (таблица поменялась) — статистика остаётся только в памяти
+            pass
+        stats = TableStats(data)
+        if self.column_store.catalog is not None:
+            self.column_store.catalog.record_stats(table.name, table.version, stats.summary())
+        return stats
+
+
+def _column_stats(values, col_type: str, row_count: int, previous: dict = None, previous_rows: int = 0) -> dict:
+    """
+    Статистика колонки. previous — статистика первых previous_rows строк:
+    её полные зоны и регистры HyperLogLog берутся как есть, считаются только
+    последняя неполная зона и новые строки.
+    """
+    if previous is None:
+        zone_min, zone_max, zone_nulls = [], [], []
+        hll = HyperLogLog()
+        start = 0
+    else:
+        full = previous_rows // ZONE_ROWS
+        zones = previous['zones']
+        zone_min, zone_max, zone_nulls = zones['min'][:full], zones['max'][:full], zones['nulls'][:full]
+        hll = HyperLogLog.load(previous['hll'])
+        start = full * ZONE_ROWS
+
+    for lo in range(start, row_count, ZONE_ROWS):
+        zone = values[lo:lo + ZONE_ROWS]
+        if col_type == 'str':
+            zone = [v for v in zone if v != '']
+            nulls = min(ZONE_ROWS, row_count - lo) - len(zone)
+        else:
+            nulls = 0
+        zone_min.append(min(zone) if len(zone) else None)
+        zone_max.append(max(zone) if len(zone) else None)
+        zone_nulls.append(nulls)
+        hll.update(set(zone))
+
+    present_min = [v for v in zone_min if v is not None]
+    present_max = [v for v in zone_max if v is not None]
+    return {
+        'type': col_type,
+        'min': min(present_min) if present_min else None,
+        'max': max(present_max) if present_max else None,
+        'nulls': sum(zone_nulls),
+        'distinct': hll.count(),
+        'hll': hll.dump(),
+        'zones': {'min': zone_min, 'max': zone_max, 'nulls': zone_nulls}
+    }
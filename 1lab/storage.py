@@ -0,0 +1,609 @@
+import os
+import csv
+import json
+import mmap
+import uuid
+import shutil
+import threading
+from array import array
+from itertools import chain, islice
+
+from schema import SCHEMA_FILE, SAMPLE_ROWS, convert, infer_type, infer_types, load_overrides
+
+
+STORE_DIR = '.store'
+META_FILE = 'meta.json'
+# версия формата каталога колонок; каталог другой версии собирается заново
+STORE_FORMAT = 3
+# <table>/.store/generation: сколько раз типы колонок расширялись при дописывании сегментов
+GENERATION_FILE = 'generation'
+
+# дописанные строки (INSERT, COPY): <table>/segments/00000001.csv, без заголовка, колонки в порядке таблицы.
+# Сегмент публикуется целиком и больше не меняется
+SEGMENTS_DIR = 'segments'
+SEGMENT_EXT = '.csv'
+
+# типы колонок и их формат в array/memoryview; остальные типы (str, date) хранятся строками utf-8
+COLUMN_FORMATS = {
+    'int': 'q',
+    'float': 'd',
+    'bool': '?'
+}
+
+# сколько строк копим в памяти перед сбросом на диск
+FLUSH_ROWS = 65536
+
+
+def table_version(csv_file: str) -> list:
+    """
+    Версия таблицы: время изменения и размер table.csv, число опубликованных сегментов
+    и поколение типов колонок (см. _widen_generation).
+    Если рядом лежит schema.json с явными типами колонок, он входит в версию
+    (позднее из двух времён и сумма размеров), поэтому смена типов пересобирает таблицу
+    так же, как смена данных. Новый сегмент меняет только третий элемент —
+    такую версию можно получить из предыдущей дозаписью строк.
+    """
+    table_dir = os.path.dirname(csv_file)
+    st = os.stat(csv_file)
+    segments = len(segment_files(table_dir))
+    generation = _read_generation(table_dir)
+    try:
+        schema = os.stat(os.path.join(table_dir, SCHEMA_FILE))
+    except FileNotFoundError:
+        return [st.st_mtime_ns, st.st_size, segments, generation]
+    return [max(st.st_mtime_ns, schema.st_mtime_ns), st.st_size + schema.st_size, segments, generation]
+
+
+def appended_version(old: list, new: list) -> bool:
+    """
+    Версия new отличается от old только дописанными сегментами:
+    строки old — начало строк new, их можно не перечитывать.
+    """
+    return (
+        old is not None and len(old) == 4 and len(new) == 4
+        and old[:2] == new[:2] and old[3] == new[3] and old[2] <= new[2]
+    )
+
+
+def segment_files(table_dir: str) -> list:
+    """
+    Опубликованные сегменты таблицы по порядку.
+    """
+    try:
+        names = os.listdir(os.path.join(table_dir, SEGMENTS_DIR))
+    except FileNotFoundError:
+        return []
+    return sorted(
+        os.path.join(table_dir, SEGMENTS_DIR, name) for name in names
+        if name.endswith(SEGMENT_EXT) and name[:-len(SEGMENT_EXT)].isdigit()
+    )
+
+
+def iter_segment_records(files: list):
+    """
+    Строки сегментов парами (-1, список значений): в table.csv у них смещения нет.
+    """
+    for file_path in files:
+        with open(file_path, 'r', encoding='utf-8', newline='') as f:
+            for record in csv.reader(f):
+                yield -1, record
+
+
+def version_dir(csv_file: str, version: list) -> str:
+    """
+    Каталог, в котором лежат файлы колонок этой версии таблицы.
+    """
+    return os.path.join(os.path.dirname(csv_file), STORE_DIR, f'{version[0]}-{version[1]}-{version[3]}')
+
+
+def iter_csv_records(csv_file: str):
+    """
+    Читает csv построчно и отдаёт пары (смещение записи в байтах, список значений).
+    Первой парой идёт заголовок.
+    """
+    with open(csv_file, mode='rb') as f:
+        lines = _LineReader(f)
+        reader = csv.reader(lines)
+        while True:
+            offset = lines.pos
+            try:
+                record = next(reader)
+            except StopIteration:
+                return
+            yield offset, record
+
+
+class _LineReader:
+    """
+    Итератор строк файла, который помнит позицию следующей строки.
+    csv.reader забирает строки лениво, поэтому позиция перед next(reader)
+    совпадает с началом очередной записи.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.pos = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        line = self.f.readline()
+        if not line:
+            raise StopIteration
+        self.pos += len(line)
+        return line.decode('utf-8')
+
+
+class StringColumn:
+    """
+    Строковая колонка: массив смещений и блок utf-8 данных.
+    """
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            # срез — это колонка над теми же данными, без копирования
+            start, stop, _ = i.indices(len(self))
+            return StringColumn(self.offsets[start:max(start, stop) + 1], self.data)
+        return str(self.data[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+    def __iter__(self):
+        offsets = self.offsets
+        data = self.data
+        start = offsets[0] if len(offsets) else 0
+        for i in range(1, len(offsets)):
+            end = offsets[i]
+            yield str(data[start:end], 'utf-8')
+            start = end
+
+
+class ColumnTable:
+    """
+    Одна версия таблицы в колоночном виде.
+    Колонки открываются через mmap и читаются без разбора текста.
+    """
+
+    def __init__(self, name: str, path: str, meta: dict):
+        self.name = name
+        self.path = path
+        self.version = meta['version']
+        self.row_count = meta['rows']
+        self.columns = [col['name'] for col in meta['columns']]
+        self.types = {col['name']: col['type'] for col in meta['columns']}
+        self._files = {col['name']: col['file'] for col in meta['columns']}
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def column(self, name: str):
+        """
+        Возвращает колонку как последовательность значений.
+        """
+        col = self._cache.get(name)
+        if col is not None:
+            return col
+
+        with self._lock:
+            col = self._cache.get(name)
+            if col is None:
+                col = self._open_column(name)
+                self._cache[name] = col
+        return col
+
+    @property
+    def offsets(self):
+        """
+        Смещения записей в table.csv (в байтах).
+        """
+        return self.column('_offsets')
+
+    def row(self, i: int, names: list) -> dict:
+        return {name: self.column(name)[i] for name in names}
+
+    def _open_column(self, name: str):
+        # файлы колонок могут быть длиннее этой версии: в них уже дописаны строки новых сегментов
+        rows = self.row_count
+        if name == '_offsets':
+            return _map_array(os.path.join(self.path, '_offsets.col'), 'q')[:rows]
+
+        file_name = self._files[name]
+        col_type = self.types[name]
+        if col_type in COLUMN_FORMATS:
+            return _map_array(os.path.join(self.path, file_name + '.col'), COLUMN_FORMATS[col_type])[:rows]
+
+        offsets = _map_array(os.path.join(self.path, file_name + '.off'), 'q')[:rows + 1]
+        data = _map_bytes(os.path.join(self.path, file_name + '.dat'))
+        return StringColumn(offsets, data)
+
+
+def load_column_table(name: str, path: str) -> ColumnTable:
+    """
+    Открывает уже собранную версию таблицы по пути к её каталогу.
+    """
+    return ColumnTable(name, path, _read_meta(path))
+
+
+def _read_meta(path: str) -> dict:
+    with open(os.path.join(path, META_FILE), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _map_bytes(file_path: str):
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _map_array(file_path: str, fmt: str):
+    return _map_bytes(file_path).cast(fmt)
+
+
+class ColumnStore:
+    """
+    Хранилище таблиц в колоночном бинарном формате.
+    Каждая таблица один раз конвертируется из table.csv в отдельные
+    файлы колонок в <table>/.store/<версия>/ и пересобирается,
+    когда table.csv меняется. Строки новых сегментов (INSERT, COPY)
+    дописываются в файлы колонок той же версии без пересборки.
+    """
+
+    def __init__(self, database_path: str, catalog=None):
+        self.db_path = database_path
+        # каталог таблиц (catalog.Catalog): если задан, таблицы ищутся в нём, а не на диске
+        self.catalog = catalog
+        self._tables = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def csv_path(self, table_name: str) -> str:
+        return os.path.join(self.db_path, table_name, 'table.csv')
+
+    def open(self, table_name: str) -> ColumnTable:
+        """
+        Возвращает актуальную версию таблицы, при необходимости конвертируя csv.
+        """
+        csv_file = self._resolve(table_name)
+        version = self._version(table_name, csv_file)
+        table = self._tables.get(table_name)
+        if table is not None and table.version == version:
+            return table
+
+        with self._table_lock(table_name):
+            table = self._tables.get(table_name)
+            if table is None or table.version != version:
+                table = self._load_or_build(table_name, csv_file)
+                self._tables[table_name] = table
+                if self.catalog is not None:
+                    self.catalog.record(table)
+        return table
+
+    def version(self, table_name: str) -> list:
+        """
+        Текущая версия table.csv без открытия таблицы.
+        """
+        return self._version(table_name, self._resolve(table_name))
+
+    def _resolve(self, table_name: str) -> str:
+        if self.catalog is not None:
+            return self.catalog.resolve(table_name)
+        csv_file = self.csv_path(table_name)
+        if not os.path.isfile(csv_file):
+            raise FileNotFoundError(f'Файл таблицы не найден: {csv_file}')
+        return csv_file
+
+    def _version(self, table_name: str, csv_file: str) -> list:
+        try:
+            return table_version(csv_file)
+        except FileNotFoundError:
+            # таблицу удалили после последней сверки каталога
+            if self.catalog is not None:
+                self.catalog.refresh_table(table_name)
+            raise FileNotFoundError(f'Файл таблицы не найден: {csv_file}')
+
+    def _table_lock(self, table_name: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(table_name, threading.Lock())
+
+    def _load_or_build(self, table_name: str, csv_file: str) -> ColumnTable:
+        store_dir = os.path.join(os.path.dirname(csv_file), STORE_DIR)
+
+        while True:
+            version = table_version(csv_file)
+            target_dir = version_dir(csv_file, version)
+            meta_file = os.path.join(target_dir, META_FILE)
+
+            if os.path.isfile(meta_file):
+                meta = _read_meta(target_dir)
+                current = meta.get('format') == STORE_FORMAT
+                if current and meta['version'] == version:
+                    return ColumnTable(table_name, target_dir, meta)
+                if current and appended_version(meta['version'], version):
+                    # появились новые сегменты — дописываем только их строки
+                    meta = self._append(csv_file, target_dir, meta, version)
+                    if meta is not None:
+                        return ColumnTable(table_name, target_dir, meta)
+                    # значение сегмента не подходит к определённому по данным типу колонки
+                    shutil.rmtree(target_dir, ignore_errors=True)
+                    _widen_generation(store_dir, version)
+                    continue
+                # сегменты удалили или поменяли вручную, или каталог собран старой версией
+                # (движка или таблицы) — собираем заново
+                shutil.rmtree(target_dir, ignore_errors=True)
+
+            tmp_dir = os.path.join(store_dir, f'tmp-{uuid.uuid4().hex}')
+            os.makedirs(tmp_dir)
+            try:
+                meta = self._build(csv_file, tmp_dir, version)
+                # файл поменялся во время конвертации — начинаем заново;
+                # сегменты, опубликованные за это время, допишутся при следующем открытии
+                if not appended_version(version, table_version(csv_file)):
+                    continue
+                try:
+                    os.rename(tmp_dir, target_dir)
+                except OSError:
+                    # эту версию уже собрал кто-то другой
+                    if not os.path.isfile(meta_file):
+                        raise
+                    meta = _read_meta(target_dir)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+            self._cleanup(store_dir, keep=os.path.basename(target_dir))
+            return ColumnTable(table_name, target_dir, meta)
+
+    def _build(self, csv_file: str, target_dir: str, version: list) -> dict:
+        """
+        Конвертирует csv и его сегменты в файлы колонок за один проход. Типы колонок
+        определяются по первым SAMPLE_ROWS строкам, явные типы берутся из schema.json.
+        Если дальше встретится значение, которое к типу не приводится
+        (или не выводится обратно тем же текстом), тип колонки расширяется
+        и запись начинается заново (редкий случай).
+        """
+        table_dir = os.path.dirname(csv_file)
+        overrides = load_overrides(table_dir)
+        segments = segment_files(table_dir)[:version[2]]
+        records = chain(iter_csv_records(csv_file), iter_segment_records(segments))
+        header = next(records, (0, []))[1]
+        for name in overrides:
+            if name not in header:
+                raise ValueError(f'{SCHEMA_FILE}: в таблице нет колонки {name}.')
+
+        sample = (record for _, record in islice(records, SAMPLE_ROWS))
+        types = infer_types(header, sample, overrides)
+
+        def all_records():
+            records = iter_csv_records(csv_file)
+            next(records, None)
+            return chain(records, iter_segment_records(segments))
+
+        exact = [name not in overrides for name in header]
+        while True:
+            try:
+                rows = self._write_columns(target_dir, types, all_records(), exact=exact)
+                break
+            except _TypeMismatch as e:
+                name = header[e.column]
+                if name in overrides:
+                    raise ValueError(
+                        f"Значение '{e.value}' в строке {e.row} колонки {name} "
+                        f"не приводится к типу {overrides[name]} из {SCHEMA_FILE}."
+                    )
+                types[e.column] = infer_type(types[e.column], e.value)
+
+        meta = {
+            'format': STORE_FORMAT,
+            'version': version,
+            'rows': rows,
+            'columns': [
+                {'name': name, 'type': col_type, 'file': str(i)}
+                for i, (name, col_type) in enumerate(zip(header, types))
+            ]
+        }
+        with open(os.path.join(target_dir, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        return meta
+
+    def _append(self, csv_file: str, target_dir: str, meta: dict, version: list):
+        """
+        Дописывает в файлы колонок строки сегментов, которых ещё нет в meta.json.
+        Уже записанные строки не трогаются, поэтому открытые версии продолжают читать
+        свои файлы; новая версия становится видна после атомарной замены meta.json.
+        Возвращает новый meta или None, если значение сегмента не подходит к типу колонки
+        (сегменты проверяются при записи, так бывает только с файлом, изменённым вручную);
+        тогда тип расширяется так же, как при конвертации table.csv.
+        """
+        table_dir = os.path.dirname(csv_file)
+        segments = segment_files(table_dir)[meta['version'][2]:version[2]]
+        types = [col['type'] for col in meta['columns']]
+        overrides = load_overrides(table_dir)
+        exact = [col['name'] not in overrides for col in meta['columns']]
+        try:
+            rows = self._write_columns(
+                target_dir, types, iter_segment_records(segments), keep_rows=meta['rows'], exact=exact
+            )
+        except _TypeMismatch:
+            return None
+
+        meta = dict(meta, version=version, rows=rows)
+        meta_file = os.path.join(target_dir, META_FILE)
+        tmp_file = f'{meta_file}.{threading.get_ident()}.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, meta_file)
+        return meta
+
+    def _write_columns(self, target_dir: str, types: list, records, keep_rows: int = None, exact: list = None) -> int:
+        """
+        Пишет значения колонок в файлы и возвращает число строк.
+        keep_rows — дописать к первым keep_rows строкам уже существующих файлов.
+        exact — для каких колонок значение должно выводиться обратно тем же текстом
+        (тип определён по данным, а не задан в schema.json).
+        Поднимает _TypeMismatch на первом значении, которое не приводится к типу колонки.
+        """
+        exact = exact or [False] * len(types)
+        writers = []
+        for i, col_type in enumerate(types):
+            if col_type in COLUMN_FORMATS:
+                writers.append(_NumberColumnWriter(os.path.join(target_dir, f'{i}.col'), col_type, keep_rows, exact[i]))
+            else:
+                writers.append(_StringColumnWriter(os.path.join(target_dir, str(i)), col_type, keep_rows, exact[i]))
+        offsets_writer = _NumberColumnWriter(os.path.join(target_dir, '_offsets.col'), 'int', keep_rows)
+
+        rows = keep_rows or 0
+        try:
+            for offset, record in records:
+                for i, writer in enumerate(writers):
+                    value = record[i] if i < len(record) else ''
+                    try:
+                        writer.append(value)
+                    except (ValueError, OverflowError):
+                        raise _TypeMismatch(i, value, rows + 1)
+                offsets_writer.append(offset)
+                rows += 1
+        finally:
+            for writer in writers:
+                writer.close()
+            offsets_writer.close()
+        return rows
+
+    def _cleanup(self, store_dir: str, keep: str):
+        """
+        Удаляет устаревшие версии. Открытые через mmap файлы
+        могут не удалиться (Windows) — тогда попробуем в следующий раз.
+        """
+        for entry in os.listdir(store_dir):
+            if entry not in (keep, GENERATION_FILE) and not entry.startswith('tmp-'):
+                shutil.rmtree(os.path.join(store_dir, entry), ignore_errors=True)
+
+
+def _read_generation(table_dir: str) -> int:
+    try:
+        with open(os.path.join(table_dir, STORE_DIR, GENERATION_FILE), 'r', encoding='utf-8') as f:
+            return int(f.read())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _widen_generation(store_dir: str, version: list):
+    """
+    Увеличивает поколение типов, чтобы таблица с расширенными типами колонок
+    получила новую версию, а не версию «с дописанными строками»: индексы, статистика
+    и кэши прежней версии посчитаны для старых типов, дописывать их нельзя.
+    table.csv при этом не трогается.
+    """
+    file_path = os.path.join(store_dir, GENERATION_FILE)
+    tmp_file = f'{file_path}.{threading.get_ident()}.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(str(version[3] + 1))
+    os.replace(tmp_file, file_path)
+
+
+class _TypeMismatch(Exception):
+    """
+    Значение value в строке row не приводится к типу колонки с номером column.
+    """
+
+    def __init__(self, column: int, value: str, row: int):
+        super().__init__(column, value, row)
+        self.column = column
+        self.value = value
+        self.row = row
+
+
+class _NumberColumnWriter:
+    def __init__(self, file_path: str, col_type: str, keep_rows: int = None, exact: bool = False):
+        # array не знает '?', bool пишется байтом 0/1 и читается через memoryview.cast('?')
+        self.fmt = COLUMN_FORMATS[col_type].replace('?', 'B')
+        self.col_type = col_type
+        self.exact = exact
+        self.buffer = array(self.fmt)
+        self.sync = keep_rows is not None
+        if keep_rows is None:
+            self.f = open(file_path, 'wb')
+        else:
+            # хвост после keep_rows строк остался от прерванной дозаписи
+            self.f = open(file_path, 'r+b')
+            _truncate(self.f, keep_rows * self.buffer.itemsize)
+
+    def append(self, value):
+        if isinstance(value, str):
+            value = convert(self.col_type, value, self.exact)
+        self.buffer.append(value)
+        if len(self.buffer) >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        self.f.write(self.buffer.tobytes())
+        self.buffer = array(self.fmt)
+
+    def close(self):
+        self.flush()
+        if self.sync:
+            self.f.flush()
+            os.fsync(self.f.fileno())
+        self.f.close()
+
+
+class _StringColumnWriter:
+    def __init__(self, base_path: str, col_type: str = 'str', keep_rows: int = None, exact: bool = False):
+        self.col_type = col_type
+        self.exact = exact
+        self.chunks = []
+        self.sync = keep_rows is not None
+        if keep_rows is None:
+            self.data = open(base_path + '.dat', 'wb')
+            self.offsets = open(base_path + '.off', 'wb')
+            self.pos = 0
+            self.buffer = array('q', [0])
+            return
+
+        self.offsets = open(base_path + '.off', 'r+b')
+        self.offsets.seek(keep_rows * 8)
+        self.pos = array('q', self.offsets.read(8))[0]
+        _truncate(self.offsets, (keep_rows + 1) * 8)
+        self.data = open(base_path + '.dat', 'r+b')
+        _truncate(self.data, self.pos)
+        self.buffer = array('q')
+
+    def append(self, value: str):
+        if self.col_type != 'str':
+            convert(self.col_type, value, self.exact)
+        encoded = value.encode('utf-8')
+        self.chunks.append(encoded)
+        self.pos += len(encoded)
+        self.buffer.append(self.pos)
+        if len(self.buffer) >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        self.data.write(b''.join(self.chunks))
+        self.offsets.write(self.buffer.tobytes())
+        self.chunks = []
+        self.buffer = array('q')
+
+    def close(self):
+        self.flush()
+        for f in (self.data, self.offsets):
+            if self.sync:
+                f.flush()
+                os.fsync(f.fileno())
+            f.close()
+
+
+def _truncate(f, size: int):
+    """
+    Обрезает файл до size байт и встаёт в конец. Файл, открытый читателями через mmap,
+    обрезается только если он длиннее (Windows не меняет размер отображённого файла).
+    """
+    if os.fstat(f.fileno()).st_size > size:
+        f.truncate(size)
+    f.seek(size)
@@ -0,0 +1,54 @@
+import pytest
+
+from planner import compile_predicate
+from server import QueryExecutor, SQLParser
+
+
+TYPES = {'code': 'str', 'age': 'int'}
+
+
+def matches(condition: dict, values: list) -> list:
+    predicate = compile_predicate(condition, TYPES)
+    return [value for value in values if predicate(value)]
+
+
+def test_str_column_compares_text_constant_as_text():
+    values = ['9', '10', 'abc', 'B-1']
+    assert matches({'column': 'code', 'operator': '>', 'value': 'a'}, values) == ['abc']
+    assert matches({'column': 'code', 'operator': '<', 'value': 'B'}, values) == ['9', '10']
+    assert matches({'column': 'code', 'operator': 'between', 'value': ['1', 'A']}, values) == ['9', '10']
+
+
+def test_str_column_equality_with_number_skips_non_numeric_cells():
+    values = ['007', '7', 'abc', '']
+    assert matches({'column': 'code', 'operator': '=', 'value': 7}, values) == ['007', '7']
+    assert matches({'column': 'code', 'operator': '!=', 'value': 7}, values) == ['abc', '']
+
+
+@pytest.mark.parametrize('condition', [
+    {'column': 'code', 'operator': '>', 'value': 5},
+    {'column': 'code', 'operator': 'between', 'value': [1, 10]},
+    {'column': 'code', 'operator': 'between', 'value': ['a', 10]},
+])
+def test_str_column_ordering_with_number_is_rejected(condition):
+    with pytest.raises(ValueError, match='code'):
+        compile_predicate(condition, TYPES)
+
+
+def test_non_numeric_cells_do_not_raise_type_error(tmp_path):
+    table_dir = tmp_path / 'items'
+    table_dir.mkdir()
+    (table_dir / 'table.csv').write_text('code,qty\n10,1\nabc,2\n5,3\n', encoding='utf-8')
+    executor = QueryExecutor(str(tmp_path))
+    parser = SQLParser()
+    try:
+        with pytest.raises(ValueError, match='code'):
+            executor.execute(parser.parse('SELECT qty FROM items WHERE code > 7'))
+        with pytest.raises(ValueError, match='code'):
+            executor.execute(parser.parse('SELECT qty FROM items WHERE code BETWEEN 1 AND 9'))
+        rows = executor.execute(parser.parse("SELECT qty FROM items WHERE code >= 'a'"))
+        assert rows == [{'qty': 2}]
+        rows = executor.execute(parser.parse('SELECT qty FROM items WHERE code = 5'))
+        assert rows == [{'qty': 3}]
+    finally:
+        executor.close()
@@ -0,0 +1,43 @@
+import pytest
+
+from schema import convert, infer_types, value_type
+from server import QueryExecutor, SQLParser
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('10', 'int'),
+    ('9.5', 'float'),
+    ('1.50', 'float'),
+    ('007', 'str'),
+    ('+5', 'str'),
+    ('1e3', 'str'),
+    ('0.12345678901234567891', 'str'),
+    ('true', 'bool'),
+    ('2024-02-29', 'date'),
+])
+def test_value_type(value, expected):
+    assert value_type(value) == expected
+
+
+def test_int_and_float_widen_to_float():
+    assert infer_types(['price'], [['10'], ['9.5'], ['100'], ['2.25']]) == ['float']
+    assert infer_types(['code'], [['10'], ['007']]) == ['str']
+    # целое, которое float не представит точно, оставляет колонку строковой
+    assert infer_types(['id'], [['1.5'], ['9007199254740993']]) == ['str']
+    assert convert('float', '1.50', exact=True) == 1.5
+
+
+def test_mixed_numeric_column_sorts_and_aggregates_as_numbers(tmp_path):
+    table_dir = tmp_path / 'goods'
+    table_dir.mkdir()
+    (table_dir / 'table.csv').write_text('name,price\na,10\nb,9.5\nc,100\nd,2.25\n', encoding='utf-8')
+    executor = QueryExecutor(str(tmp_path))
+    parser = SQLParser()
+    try:
+        rows = executor.execute(parser.parse('SELECT price FROM goods ORDER BY price'))
+        assert [row['price'] for row in rows] == [2.25, 9.5, 10.0, 100.0]
+
+        rows = executor.execute(parser.parse('SELECT SUM(price), MAX(price) FROM goods'))
+        assert list(rows[0].values()) == [121.75, 100.0]
+    finally:
+        executor.close()
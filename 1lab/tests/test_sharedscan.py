@@ -0,0 +1,78 @@
+import pytest
+
+from planner import CompiledQuery
+from sharedscan import SHARED_BLOCK_ROWS, SharedScanner
+from storage import ColumnStore
+from cache import CacheManager
+from server import ClientHandler, QueryExecutor, SQLParser
+
+
+ROWS = SHARED_BLOCK_ROWS * 3 + 100
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    table_dir = tmp_path / 'people'
+    table_dir.mkdir()
+    lines = ['id,name,age'] + [f'{i},user{i},{18 + i % 50}' for i in range(ROWS)]
+    (table_dir / 'table.csv').write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return str(tmp_path)
+
+
+def test_two_selects_share_one_pass(db_path):
+    table = ColumnStore(db_path).open('people')
+    scanner = SharedScanner()
+    first = scanner.scan_tuples(table, CompiledQuery(['id'], None, table.types))
+    second = scanner.scan_tuples(table, CompiledQuery(['id', 'age'], {'column': 'age', 'operator': '<', 'value': 30}, table.types))
+
+    first_iter = iter(first)
+    head = [next(first_iter) for _ in range(SHARED_BLOCK_ROWS + 1)]
+    # второй запрос присоединяется к скану, который уже на втором блоке
+    second_rows = list(second)
+    first_rows = head + list(first_iter)
+
+    assert scanner.stats()['scans'] == 1
+    assert scanner.stats()['attached'] == 1
+    # блоки 1-3 разобраны один раз на двоих, блок 0 второй запрос дочитывает сам
+    assert scanner.stats()['blocks_read'] == 5
+    assert scanner.stats()['blocks_shared'] == 3
+    assert not first.rotated
+    assert second.rotated
+    assert [row[0] for row in first_rows] == list(range(ROWS))
+    assert sorted(second_rows) == [(i, 18 + i % 50) for i in range(ROWS) if 18 + i % 50 < 30]
+    # строки присоединившегося запроса идут по кругу, без буфера для хвоста
+    assert second_rows[0][0] >= SHARED_BLOCK_ROWS
+
+
+def test_rotated_select_is_flagged(db_path):
+    executor = QueryExecutor(db_path)
+    parser = SQLParser()
+    try:
+        leader = iter(executor.execute_iter(parser.parse('SELECT name FROM people')))
+        for _ in range(SHARED_BLOCK_ROWS + 1):
+            next(leader)
+        rows = executor.execute_iter(parser.parse('SELECT id FROM people'))
+        result = list(rows)
+        list(leader)
+    finally:
+        executor.close()
+
+    assert rows.rotated
+    assert sorted(row['id'] for row in result) == list(range(ROWS))
+
+
+def test_rotated_result_is_not_sliced_or_projected():
+    cache = CacheManager()
+    handler = ClientHandler(None, None, None, None, None, cache, None)
+    parser = SQLParser()
+    wide = parser.parse('SELECT * FROM people')
+    rows = [{'id': 2, 'name': 'b'}, {'id': 1, 'name': 'a'}]
+    cache.set('people', SQLParser.rotated_key(SQLParser.cache_key(wide)), [1], rows)
+
+    def lookup(sql):
+        parsed = parser.parse(sql)
+        return handler.lookup_cache(parsed, 'people', SQLParser.cache_key(parsed), [1])
+
+    assert lookup('SELECT * FROM people') == rows
+    assert lookup('SELECT * FROM people LIMIT 1') is None
+    assert lookup('SELECT id FROM people') is None
@@ -0,0 +1,34 @@
+import zlib
+
+import pytest
+
+from server import ClientHandler, Logger
+from wire import negotiate_compression, frame_body, pack_frame, unpack_frame_header
+
+
+def compressed_frame(data: bytes) -> tuple:
+    frame = pack_frame(data, negotiate_compression(True))
+    length, compressed = unpack_frame_header(frame[:4])
+    assert compressed
+    return frame[4:4 + length], compressed
+
+
+def test_frame_body_rejects_frame_over_limit():
+    body, compressed = compressed_frame(b'x' * 10000)
+    assert frame_body(body, compressed, 10000) == b'x' * 10000
+    with pytest.raises(ValueError):
+        frame_body(body, compressed, 9999)
+
+
+def test_frame_body_rejects_corrupt_frame():
+    with pytest.raises(ValueError):
+        frame_body(zlib.compress(b'SELECT * FROM people')[:-4], True)
+
+
+def test_handler_rejects_compressed_request_over_cap():
+    handler = ClientHandler(None, None, None, None, Logger(), None, None, max_decompressed_bytes=4096)
+    handler.compression = negotiate_compression(True)
+
+    # несколько десятков байт zlib, которые распаковываются в мегабайт
+    assert handler._parse_request(*compressed_frame(b' ' * (1 << 20))) == (None, None)
+    assert handler._parse_request(*compressed_frame(b'SELECT 1' + b' ' * 2000)) == (None, 'SELECT 1' + ' ' * 2000)
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from storage import ColumnStore
+from writer import TableWriter
+
+
+@pytest.fixture
+def store(tmp_path):
+    table_dir = tmp_path / 'employees'
+    table_dir.mkdir()
+    (table_dir / 'table.csv').write_text(
+        'id,name,age,salary\n1,Alice,30,55000\n2,Bob,25,48000\n', encoding='utf-8'
+    )
+    return ColumnStore(str(tmp_path))
+
+
+def test_insert_keeps_inferred_types(store):
+    writer = TableWriter(store)
+    _, table, count = writer.append('employees', [['3', 'Carol', '41', '61000']])
+
+    assert count == 1
+    assert table.types == {'id': 'int', 'name': 'str', 'age': 'int', 'salary': 'int'}
+    assert list(table.column('age')) == [30, 25, 41]
+
+
+def test_insert_omitted_typed_column_is_rejected(store):
+    writer = TableWriter(store)
+    with pytest.raises(ValueError, match='пустое значение в колонке id'):
+        writer.append('employees', [['Nobody']], columns=['name'])
+
+    table = store.open('employees')
+    assert table.types['age'] == 'int'
+    assert table.row_count == 2
+    assert not os.listdir(os.path.join(store.db_path, 'employees', 'segments'))
+
+
+def test_insert_value_of_wrong_type_is_rejected(store):
+    writer = TableWriter(store)
+    with pytest.raises(ValueError, match="'abc'"):
+        writer.append('employees', [['3', 'Carol', 'abc', '1']])
+    assert store.open('employees').types['age'] == 'int'
@@ -0,0 +1,417 @@
+import math
+import threading
+from functools import partial
+from operator import itemgetter
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:      # без numpy все запросы выполняет построчный движок
+    np = None
+
+from schema import typed_constant
+from storage import appended_version
+from planner import BLOCK_ROWS, OPERATORS
+
+
+# таблицы меньше этого числа строк быстрее отфильтровать построчно:
+# подготовка массивов и маски дороже самого скана
+VECTOR_MIN_ROWS = 100_000
+
+# сколько памяти занимают массивы, построенные из колонок (даты);
+# числовые колонки — это представления над mmap и памяти не требуют
+VECTOR_CACHE_BYTES = 512 * 1024 * 1024
+
+# типы значений колонок в numpy; даты хранятся строками ISO фиксированной длины
+DTYPES = {
+    'int': 'int64',
+    'float': 'float64',
+    'bool': 'bool'
+}
+DATE_BYTES = 10
+
+# целые, которые float64 представляет точно: дальше сравнение int64 с float неточно
+_EXACT_FLOAT = 2 ** 53
+_INT64_MAX = 2 ** 63 - 1
+
+# до стольких возможных значений ключа группы коды не сжимаются через np.unique
+_DENSE_CODES = 1 << 20
+
+
+class VectorEngine:
+    """
+    Векторный движок для WHERE и агрегатов на numpy. Колонки таблицы
+    становятся массивами: числа и bool — представлениями над mmap без копирования,
+    даты — массивами datetime64 (строятся один раз на версию таблицы и кэшируются).
+    Условие считается булевой маской целиком по массивам, проекция — выборкой
+    по номерам строк, а словари Python строятся только для строк результата.
+
+    Строковые колонки в условии, GROUP BY, MIN и MAX движок не поддерживает,
+    как и константы, сравнение с которыми в numpy было бы неточным, —
+    такие запросы (select и aggregate возвращают None) выполняет построчный движок.
+    Без numpy движок выключен.
+    """
+
+    def __init__(self, threshold: int = VECTOR_MIN_ROWS, max_bytes: int = VECTOR_CACHE_BYTES):
+        # threshold=None выключает движок
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self._arrays = OrderedDict()
+        self._lock = threading.Lock()
+
+        # статистика
+        self.queries = 0
+        self.fallbacks = 0
+
+    @property
+    def available(self) -> bool:
+        return np is not None and self.threshold is not None
+
+    def enabled_for(self, table) -> bool:
+        return self.available and table.row_count >= self.threshold
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'available': self.available,
+                'queries': self.queries,
+                'fallbacks': self.fallbacks,
+                'arrays': len(self._arrays),
+                'bytes': sum(array.nbytes for array, owned in self._arrays.values() if owned)
+            }
+
+    def select(self, table, condition: dict, ranges: list = None):
+        """
+        Номера строк (массив), удовлетворяющих условию, в порядке таблицы,
+        или None, если условие векторно не считается.
+        ranges — диапазоны, где условие может выполниться (по зоновым картам).
+        """
+        if ranges is None:
+            ranges = [(0, table.row_count)]
+
+        parts = []
+        for lo, hi in ranges:
+            mask = self._mask(table, condition, lo, hi)
+            if mask is None:
+                self._count(fallback=True)
+                return None
+            parts.append(np.flatnonzero(mask) + lo)
+
+        self._count()
+        return np.concatenate(parts) if parts else np.empty(0, dtype='int64')
+
+    def take(self, table, names: list, row_ids):
+        """
+        Строки результата (словари) по номерам строк; числовые колонки
+        выбираются из массивов, строковые читаются из файлов колонок.
+        """
+        make_row = partial(zip, names)
+        for lo in range(0, len(row_ids), BLOCK_ROWS):
+            block = row_ids[lo:lo + BLOCK_ROWS]
+            if not names:
+                yield from ({} for _ in range(len(block)))
+                continue
+
+            ids = None
+            columns = []
+            for name in names:
+                if table.types[name] in DTYPES:
+                    columns.append(self._array(table, name)[block].tolist())
+                else:
+                    if ids is None:
+                        ids = block.tolist()
+                    column = table.column(name)
+                    columns.append([column[ids[0]]] if len(ids) == 1 else itemgetter(*ids)(column))
+            yield from map(dict, map(make_row, zip(*columns)))
+
+    def aggregate(self, table, names: list, condition: dict, group_size: int, aggregates: list,
+                  ranges: list = None):
+        """
+        Частичные состояния агрегатов {ключ группы: состояния} в формате HashAggregator
+        (группы в порядке первой встречи) или None, если запрос векторно не считается.
+        Аргументы — как у ParallelScanner.aggregate.
+        """
+        group_columns = names[:group_size]
+        supported = all(table.types[name] in DTYPES or table.types[name] == 'date' for name in group_columns)
+        for function, pos in aggregates:
+            if pos is None or function == 'count':
+                continue
+            col_type = table.types[names[pos]]
+            if col_type == 'str' or (function in ('sum', 'avg') and col_type not in ('int', 'float')):
+                supported = False
+        if not supported:
+            self._count(fallback=True)
+            return None
+
+        row_ids = None
+        if condition:
+            row_ids = self.select(table, condition, ranges)
+            if row_ids is None:
+                return None
+        else:
+            self._count()
+        rows = table.row_count if row_ids is None else len(row_ids)
+        if not rows:
+            return {}
+
+        def values(name):
+            array = self._array(table, name)
+            return array if row_ids is None else array[row_ids]
+
+        inverse, first_rows, groups = _factorize([values(name) for name in group_columns], rows)
+
+        # каждое состояние — список значений по группам
+        states = []
+        for function, pos in aggregates:
+            if pos is None:
+                states.append(np.bincount(inverse, minlength=groups).tolist())
+                continue
+
+            col_type = table.types[names[pos]]
+            if function == 'count':
+                if col_type == 'str':
+                    # пустые строки не считаются
+                    offsets = np.frombuffer(table.column(names[pos]).offsets, dtype='int64')
+                    present = np.diff(offsets) != 0
+                    if row_ids is not None:
+                        present = present[row_ids]
+                    states.append(np.bincount(inverse, weights=present, minlength=groups).astype('int64').tolist())
+                else:
+                    states.append(np.bincount(inverse, minlength=groups).tolist())
+                continue
+
+            column = values(names[pos])
+            if function in ('sum', 'avg'):
+                sums = _group_sums(column, inverse, groups)
+                if sums is None:
+                    self._count(fallback=True)
+                    return None
+                states.append(sums)
+                if function == 'avg':
+                    states.append(np.bincount(inverse, minlength=groups).tolist())
+                continue
+
+            # начальное значение группы — её первая строка, дальше min/max по всем строкам
+            extremes = column[first_rows]
+            (np.minimum if function == 'min' else np.maximum).at(extremes, inverse, column)
+            states.append(_to_python(extremes))
+
+        keys = zip(*[_to_python(values(name)[first_rows]) for name in group_columns]) if group_columns else [()]
+        return dict(zip(keys, map(list, zip(*states)) if states else ([] for _ in range(groups))))
+
+    def _count(self, fallback: bool = False):
+        with self._lock:
+            if fallback:
+                self.fallbacks += 1
+            else:
+                self.queries += 1
+
+    def _mask(self, table, condition: dict, lo: int, hi: int):
+        op = condition['operator']
+        if op in ('and', 'or'):
+            masks = [self._mask(table, arg, lo, hi) for arg in condition['args']]
+            if any(mask is None for mask in masks):
+                return None
+            combine = np.logical_and if op == 'and' else np.logical_or
+            return combine.reduce(masks)
+        if op == 'not':
+            mask = self._mask(table, condition['args'][0], lo, hi)
+            return None if mask is None else ~mask
+
+        column = condition['column']
+        if column not in table.types:
+            # как и в построчном движке, сравнение с отсутствующей колонкой ложно
+            return np.zeros(hi - lo, dtype=bool)
+        col_type = table.types[column]
+        if col_type not in DTYPES and col_type != 'date':
+            return None
+
+        values = self._array(table, column)[lo:hi]
+        value = condition['value']
+
+        if op == 'in':
+            constants = []
+            for item in value:
+                constant = _constant(col_type, '=', item)
+                if constant is None:
+                    return None
+                if constant[1] is not _NEVER:
+                    constants.append(constant[1])
+            return np.isin(values, np.array(constants, dtype=values.dtype))
+
+        if op == 'between':
+            low, high = _constant(col_type, '>=', value[0]), _constant(col_type, '<=', value[1])
+            if low is None or high is None or _NEVER in (low[1], high[1]):
+                return None
+            return _compare(values, *low) & _compare(values, *high)
+
+        constant = _constant(col_type, op, value)
+        if constant is None:
+            return None
+        return _compare(values, *constant)
+
+    def _array(self, table, column: str):
+        """
+        Колонка таблицы как массив numpy; кэшируется для версии таблицы.
+        """
+        key = (table.name, tuple(table.version), column)
+        with self._lock:
+            cached = self._arrays.get(key)
+            if cached is not None:
+                self._arrays.move_to_end(key)
+                return cached[0]
+
+        col_type = table.types[column]
+        if col_type in DTYPES:
+            # представление над mmap: копирования нет, память не считаем
+            array, owned = np.frombuffer(table.column(column), dtype=DTYPES[col_type]), False
+        else:
+            # даты одной длины, строка i занимает байты [i * DATE_BYTES, (i + 1) * DATE_BYTES)
+            data = table.column(column).data
+            previous = self._appended_array(table, column)
+            start = len(previous) if previous is not None else 0
+            array = np.frombuffer(data[start * DATE_BYTES:table.row_count * DATE_BYTES], dtype=f'S{DATE_BYTES}')
+            array = array.astype('datetime64[D]')
+            if previous is not None:
+                # в таблицу дописаны строки — разбираем только их
+                array = np.concatenate((previous, array))
+            owned = True
+
+        with self._lock:
+            # версии таблицы, которые уже заменены, больше не нужны
+            for stale in [k for k in self._arrays if k[0] == table.name and k[1] != key[1]]:
+                del self._arrays[stale]
+            self._arrays[key] = (array, owned)
+            total = sum(a.nbytes for a, o in self._arrays.values() if o)
+            while total > self.max_bytes and len(self._arrays) > 1:
+                _, (evicted, was_owned) = self._arrays.popitem(last=False)
+                if was_owned:
+                    total -= evicted.nbytes
+        return array
+
+
+    def _appended_array(self, table, column: str):
+        """
+        Массив колонки из предыдущей версии таблицы, к которой потом только дописывались строки.
+        """
+        with self._lock:
+            for (name, version, cached_column), (array, _) in self._arrays.items():
+                if name == table.name and cached_column == column and appended_version(list(version), table.version):
+                    return array
+        return None
+
+
+# константа, которой не равно ни одно значение колонки
+_NEVER = object()
+
+
+def _constant(col_type: str, op: str, value):
+    """
+    (оператор, константа для numpy), дающие тот же результат, что и построчное
+    сравнение, или None, если так сравнить нельзя (построчный движок
+    сам решит, что делать, — например, поднимет ошибку типа).
+    Вместо константы может быть _NEVER: '=' ложно везде, '!=' истинно везде.
+    """
+    constant = typed_constant(col_type, value)
+    if constant is None:
+        return (op, _NEVER) if op in ('=', '!=') else None
+
+    if col_type == 'date':
+        return op, np.datetime64(constant, 'D')
+    if col_type == 'bool':
+        return op, constant
+    if isinstance(constant, float) and not math.isfinite(constant):
+        return None
+    if col_type == 'float':
+        if isinstance(constant, int) and abs(constant) > _EXACT_FLOAT:
+            return None
+        return op, constant
+
+    # int64 с дробной константой: сравниваем с ближайшим целым, не переходя к float
+    if isinstance(constant, float):
+        if constant.is_integer():
+            constant = int(constant)
+        elif op in ('=', '!='):
+            return op, _NEVER
+        elif op in ('<', '<='):
+            op, constant = '<=', math.floor(constant)
+        else:
+            op, constant = '>=', math.ceil(constant)
+    if abs(constant) > _INT64_MAX:
+        return None
+    return op, constant
+
+
+def _compare(values, op: str, constant):
+    if constant is _NEVER:
+        return np.full(len(values), op == '!=')
+    return OPERATORS[op](values, constant)
+
+
+def _factorize(columns: list, rows: int) -> tuple:
+    """
+    Номер группы для каждой строки (группы нумеруются в порядке первой встречи),
+    номер первой строки каждой группы и число групп.
+    Целые и bool с небольшим разбросом значений кодируются вычитанием минимума,
+    без сортировки; остальные колонки — через np.unique.
+    """
+    if not columns:
+        return np.zeros(rows, dtype='int64'), np.zeros(1, dtype='int64'), 1
+
+    codes, space = None, 1
+    for column in columns:
+        column_codes, size = _codes(column, rows)
+        codes = column_codes if codes is None else codes * size + column_codes
+        space *= size
+        if space > max(rows, _DENSE_CODES):
+            # ключ из нескольких колонок: сжимаем коды обратно до числа встреченных значений
+            uniques, codes = np.unique(codes, return_inverse=True)
+            codes, space = codes.ravel(), len(uniques)
+
+    # первая строка каждого кода; ufunc.at не сортирует, в отличие от np.unique
+    first = np.full(space, rows, dtype='int64')
+    np.minimum.at(first, codes, np.arange(rows, dtype='int64'))
+    present = np.flatnonzero(first < rows)
+    present = present[np.argsort(first[present], kind='stable')]
+    rank = np.empty(space, dtype='int64')
+    rank[present] = np.arange(len(present))
+    return rank[codes], first[present], len(present)
+
+
+def _codes(column, rows: int) -> tuple:
+    """
+    Плотные коды значений колонки (0..size-1) и size.
+    """
+    if column.dtype.kind in 'iub':
+        column = column.astype('int64', copy=False)
+        low, high = int(column.min()), int(column.max())
+        if high - low < max(rows, _DENSE_CODES):
+            return column - low, high - low + 1
+    uniques, inverse = np.unique(column, return_inverse=True)
+    return inverse.ravel(), len(uniques)
+
+
+def _group_sums(column, inverse, groups: int):
+    """
+    Суммы по группам, сложенные в порядке строк, как в HashAggregator, или None,
+    если сумма целых может выйти за int64.
+    """
+    if column.dtype.kind == 'f':
+        # bincount складывает веса по очереди, как построчный движок
+        return np.bincount(inverse, weights=column, minlength=groups).tolist()
+
+    bound = max(abs(int(column.min())), abs(int(column.max())))
+    if bound * len(column) > _INT64_MAX:
+        return None
+    sums = np.zeros(groups, dtype='int64')
+    np.add.at(sums, inverse, column)
+    return sums.tolist()
+
+
+def _to_python(array) -> list:
+    """
+    Значения массива как значения Python: даты — строками ISO.
+    """
+    if array.dtype.kind == 'M':
+        return np.datetime_as_string(array, unit='D').tolist()
+    return array.tolist()
@@ -0,0 +1,252 @@
+"""
+Кадры протокола и двоичный формат строк результата.
+
+Кадр: заголовок из 4 байт (big-endian) — длина тела; старший бит заголовка
+(COMPRESSED) означает, что тело сжато zlib. Сжатие клиент запрашивает при входе:
+capabilities: {'compression': {'level': 1, 'threshold': 1024}} или {'compression': True}.
+После ответа на вход обе стороны сжимают кадры не меньше порога, остальные
+идут как есть, поэтому сжатые и обычные кадры перемешиваются на одном соединении.
+Сжатый кадр до согласования сжатия сервер не принимает, а распаковывает
+не больше чем в MAX_DECOMPRESSED_BYTES (параметр сервера max_decompressed_bytes),
+клиент — не больше чем в MAX_RESULT_BYTES.
+
+Если согласован конвейер (capabilities: {'pipeline': True}), тело каждого кадра
+после входа начинается с номера запроса (uint32): клиент отправляет несколько
+команд, не дожидаясь ответов, а сервер помечает ответы номерами.
+
+Двоичный формат строк — альтернатива JSON, которую клиент
+запрашивает при входе (capabilities: {'format': 'binary'}).
+
+Кадр со строками:
+    MAGIC, версия (1 байт), число строк (uint32), число колонок (uint16),
+    затем для каждой колонки: длина имени (uint16), имя в utf-8, тип (1 байт),
+    затем данные колонок подряд, каждая — блок с длиной (uint32) впереди.
+
+Типы колонок:
+    q — int64, d — float64 (массивы little-endian), ? — bool (байт 0/1);
+    s — строки в utf-8, разделённые нулевым символом;
+    j — JSON-список значений (None, смешанные типы, большие числа).
+
+Имена колонок передаются один раз на кадр, а не в каждой строке,
+и числа не переводятся в текст, поэтому кадр меньше JSON и быстрее
+собирается и разбирается.
+"""
+import sys
+import zlib
+import json
+import struct
+from array import array
+from operator import itemgetter
+from itertools import repeat
+
+
+# старший бит длины в заголовке кадра: тело сжато zlib
+COMPRESSED = 0x80000000
+MAX_FRAME_BYTES = COMPRESSED - 1
+
+# во сколько байт сервер распаковывает сжатый кадр запроса: несколько килобайт zlib
+# не должны превращаться в гигабайты в памяти; кусок COPY_DATA клиента в это умещается
+MAX_DECOMPRESSED_BYTES = 8 * 1024 * 1024
+# то же для клиента: ответ без потоковой отдачи приходит одним кадром со всеми строками
+MAX_RESULT_BYTES = 256 * 1024 * 1024
+
+# сжатие по умолчанию: уровень zlib и размер кадра, меньше которого не сжимаем;
+# уровень 1 сжимает результаты почти как 6, но в 4-5 раз быстрее (bench.py compression)
+COMPRESSION_LEVEL = 1
+COMPRESSION_THRESHOLD = 1024
+
+# первый байт двоичного кадра; JSON-сообщение так начинаться не может
+MAGIC = b'\x00'
+VERSION = 1
+
+_FRAME_HEADER = struct.Struct('!I')
+_REQUEST_ID = struct.Struct('!I')
+
+_HEADER = struct.Struct('<BIH')
+_LENGTH = struct.Struct('<I')
+_NAME_LENGTH = struct.Struct('<H')
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+
+def negotiate_compression(requested) -> dict:
+    """
+    Параметры сжатия по запросу клиента: {'level', 'threshold'} или None,
+    если сжатие не запрошено. Уровень приводится к 1..9.
+    """
+    if not isinstance(requested, dict):
+        requested = {} if requested else None
+    if requested is None or requested.get('level') == 0:
+        return None
+    try:
+        level = min(max(int(requested.get('level', COMPRESSION_LEVEL)), 1), 9)
+        threshold = max(int(requested.get('threshold', COMPRESSION_THRESHOLD)), 0)
+    except (TypeError, ValueError):
+        level, threshold = COMPRESSION_LEVEL, COMPRESSION_THRESHOLD
+    return {'level': level, 'threshold': threshold}
+
+
+def pack_frame(data: bytes, compression: dict = None) -> bytes:
+    """
+    Заголовок и тело кадра. Если задано сжатие, кадр не меньше порога сжимается,
+    но только когда это действительно уменьшает его.
+    """
+    flags = 0
+    if compression is not None and len(data) >= compression['threshold']:
+        packed = zlib.compress(data, compression['level'])
+        if len(packed) < len(data):
+            data, flags = packed, COMPRESSED
+    if len(data) > MAX_FRAME_BYTES:
+        raise ValueError('Кадр слишком большой.')
+    return _FRAME_HEADER.pack(len(data) | flags) + data
+
+
+def unpack_frame_header(header: bytes) -> tuple:
+    """
+    (длина тела, сжато ли тело) по 4 байтам заголовка.
+    """
+    (value,) = _FRAME_HEADER.unpack(header)
+    return value & MAX_FRAME_BYTES, bool(value & COMPRESSED)
+
+
+def frame_body(data: bytes, compressed: bool, limit: int = MAX_FRAME_BYTES) -> bytes:
+    """
+    Тело кадра; сжатое распаковывается не больше чем в limit байт.
+    Поднимает ValueError, если распакованное тело больше или сжатые данные испорчены.
+    """
+    if not compressed:
+        return data
+    decompressor = zlib.decompressobj()
+    try:
+        body = decompressor.decompress(data, limit)
+    except zlib.error as e:
+        raise ValueError(f'Не удалось распаковать кадр: {e}')
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError('Распакованный кадр слишком большой или обрезан.')
+    return body
+
+
+def tag_request(request_id: int, data: bytes) -> bytes:
+    """
+    Тело кадра с номером запроса впереди.
+    """
+    return _REQUEST_ID.pack(request_id) + data
+
+
+def untag_request(data: bytes) -> tuple:
+    """
+    (номер запроса, тело) из тела кадра с номером.
+    """
+    (request_id,) = _REQUEST_ID.unpack_from(data)
+    return request_id, data[_REQUEST_ID.size:]
+
+
+def is_binary(frame: bytes) -> bool:
+    return frame[:1] == MAGIC
+
+
+def encode_rows(rows: list) -> bytes:
+    """
+    Кодирует список строк-словарей с одинаковыми ключами в двоичный кадр.
+    """
+    names = list(rows[0]) if rows else []
+    try:
+        if len(set(map(len, rows))) > 1:
+            raise KeyError
+        if len(names) > 1:
+            columns = list(zip(*map(itemgetter(*names), rows)))
+        else:
+            columns = [list(map(itemgetter(name), rows)) for name in names]
+    except KeyError:
+        # строки с разными колонками — целиком JSON-списком строк
+        names, columns = ['*'], [rows]
+
+    parts = [MAGIC, _HEADER.pack(VERSION, len(rows), len(names))]
+    blocks = []
+    for name, values in zip(names, columns):
+        code, block = _encode_column(values) if name != '*' else ('j', _encode_json(values))
+        encoded_name = name.encode('utf-8')
+        parts += [_NAME_LENGTH.pack(len(encoded_name)), encoded_name, code.encode('ascii')]
+        blocks += [_LENGTH.pack(len(block)), block]
+    return b''.join(parts + blocks)
+
+
+def decode_rows(frame: bytes) -> list:
+    """
+    Разбирает двоичный кадр обратно в список строк-словарей.
+    """
+    view = memoryview(frame)
+    version, count, width = _HEADER.unpack_from(view, 1)
+    if version != VERSION:
+        raise ValueError(f'Неизвестная версия двоичного формата: {version}')
+
+    pos = 1 + _HEADER.size
+    names, codes = [], []
+    for _ in range(width):
+        (size,) = _NAME_LENGTH.unpack_from(view, pos)
+        pos += _NAME_LENGTH.size
+        names.append(bytes(view[pos:pos + size]).decode('utf-8'))
+        codes.append(chr(view[pos + size]))
+        pos += size + 1
+
+    columns = []
+    for code in codes:
+        (size,) = _LENGTH.unpack_from(view, pos)
+        pos += _LENGTH.size
+        columns.append(_decode_column(code, view[pos:pos + size]))
+        pos += size
+
+    if names == ['*']:
+        return columns[0]
+    if not names:
+        return [{} for _ in range(count)]
+    return list(map(dict, map(zip, repeat(names), zip(*columns))))
+
+
+def _encode_column(values: tuple) -> tuple:
+    types = set(map(type, values))
+
+    if types == {int} and _INT64_MIN <= min(values) and max(values) <= _INT64_MAX:
+        return 'q', _pack_array('q', values)
+    if types == {float}:
+        return 'd', _pack_array('d', values)
+    if types == {bool}:
+        return '?', bytes(values)
+    if types == {str}:
+        text = '\x00'.join(values)
+        # разделитель внутри значения — такую колонку передаём JSON
+        if text.count('\x00') == len(values) - 1:
+            return 's', text.encode('utf-8')
+    return 'j', _encode_json(values)
+
+
+def _decode_column(code: str, block: memoryview) -> list:
+    if code in ('q', 'd'):
+        return _unpack_array(code, block)
+    if code == '?':
+        return list(map(bool, block))
+    if code == 's':
+        return str(block, 'utf-8').split('\x00')
+    if code == 'j':
+        return json.loads(str(block, 'utf-8'))
+    raise ValueError(f'Неизвестный тип колонки в двоичном кадре: {code}')
+
+
+def _encode_json(values) -> bytes:
+    return json.dumps(list(values), ensure_ascii=False).encode('utf-8')
+
+
+def _pack_array(code: str, values) -> bytes:
+    packed = array(code, values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack_array(code: str, block: memoryview) -> list:
+    values = array(code)
+    values.frombytes(block)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tolist()
@@ -0,0 +1,182 @@
+import os
+import csv
+import uuid
+import tempfile
+import threading
+
+from schema import convert, load_overrides
+from storage import SEGMENTS_DIR, SEGMENT_EXT, ColumnStore, ColumnTable, segment_files
+
+
+# сколько данных COPY держим в памяти, дальше они уходят во временный файл
+COPY_SPOOL_BYTES = 8 * 1024 * 1024
+
+
+class TableWriter:
+    """
+    Дописывает строки в таблицы (INSERT, COPY). Строки проверяются по типам колонок
+    и пишутся новым сегментом: сначала во временный файл, затем он атомарно
+    появляется под следующим номером в <table>/segments/. Читатели видят сегмент
+    целиком или не видят вовсе; table.csv и опубликованные сегменты не меняются.
+    """
+
+    def __init__(self, column_store: ColumnStore):
+        self.column_store = column_store
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def append(self, table_name: str, records, columns: list = None) -> tuple:
+        """
+        Дописывает строки records — списки строковых значений в порядке columns
+        (по умолчанию в порядке колонок таблицы). Возвращает (таблица до записи,
+        таблица после записи, число строк). Если хоть одна строка не подходит,
+        не пишется ничего. Запись не меняет типы колонок: значение, которое не подходит
+        к текущему типу (в том числе определённому по данным), — ошибка.
+        """
+        with self._table_lock(table_name):
+            table = self.column_store.open(table_name)
+            table_dir = os.path.dirname(self.column_store.csv_path(table_name))
+            overrides = load_overrides(table_dir)
+            count = self._publish(table_dir, _checked_rows(table, records, columns, overrides))
+            if not count:
+                return table, table, 0
+            return table, self.column_store.open(table_name), count
+
+    def _table_lock(self, table_name: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(table_name, threading.Lock())
+
+    def _publish(self, table_dir: str, rows) -> int:
+        segments_dir = os.path.join(table_dir, SEGMENTS_DIR)
+        os.makedirs(segments_dir, exist_ok=True)
+        # без расширения .csv временный файл не считается сегментом
+        tmp_file = os.path.join(segments_dir, f'tmp-{uuid.uuid4().hex}')
+        count = 0
+        try:
+            with open(tmp_file, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f, lineterminator='\n')
+                for row in rows:
+                    writer.writerow(row)
+                    count += 1
+                f.flush()
+                os.fsync(f.fileno())
+            if count:
+                _link_next(table_dir, tmp_file)
+        finally:
+            os.remove(tmp_file)
+        return count
+
+
+class CopySession:
+    """
+    Приём данных COPY ... FROM STDIN кусками. В конвейере куски обрабатываются
+    параллельно и могут прийти не по порядку, поэтому у каждого есть номер seq:
+    кусок пишется, когда записаны все предыдущие.
+    """
+
+    def __init__(self, table_name: str, header: bool = False, spool_bytes: int = COPY_SPOOL_BYTES):
+        self.table_name = table_name
+        self.header = header
+        self.spool = tempfile.SpooledTemporaryFile(max_size=spool_bytes, mode='w+', encoding='utf-8', newline='')
+        self.received = 0
+        self._next_seq = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def feed(self, seq: int, data: str):
+        with self._lock:
+            if seq < self._next_seq or seq in self._pending:
+                raise ValueError(f'Кусок COPY номер {seq} уже получен.')
+            self._pending[seq] = data
+            while self._next_seq in self._pending:
+                self.spool.write(self._pending.pop(self._next_seq))
+                self._next_seq += 1
+            self.received += len(data)
+
+    def rows(self) -> tuple:
+        """
+        (колонки из заголовка или None, итератор строк) по всем полученным данным.
+        """
+        with self._lock:
+            if self._pending:
+                raise ValueError(f'Не получен кусок COPY номер {self._next_seq}.')
+            self.spool.seek(0)
+            reader = csv.reader(self.spool)
+            columns = None
+            if self.header:
+                columns = [name.strip() for name in next(reader, [])]
+            # пустые строки в конце файла не считаются записями
+            return columns, (record for record in reader if record)
+
+    def close(self):
+        self.spool.close()
+
+
+def _checked_rows(table: ColumnTable, records, columns: list = None, overrides: dict = None):
+    """
+    Строки в порядке колонок таблицы. Колонки, которых нет в columns, получают пустое значение.
+    Значение, которое не приводится к типу колонки, и пустое значение
+    в типизированной колонке (NULL не поддерживается) — ошибка. Для типов, определённых
+    по данным, значение проверяется так же строго, как при конвертации table.csv;
+    для типов из schema.json (overrides) достаточно, чтобы оно приводилось.
+    """
+    if columns is None:
+        positions = None
+        width = len(table.columns)
+    else:
+        for name in columns:
+            if name not in table.types:
+                raise ValueError(f'Колонка {name} не найдена в таблице {table.name}.')
+        if len(set(columns)) != len(columns):
+            raise ValueError('Колонки в списке повторяются.')
+        index = {name: i for i, name in enumerate(columns)}
+        positions = [index.get(name) for name in table.columns]
+        width = len(columns)
+
+    overrides = overrides or {}
+    checks = [(name, table.types[name], name not in overrides) for name in table.columns]
+    for n, record in enumerate(records, 1):
+        if len(record) != width:
+            raise ValueError(f'Строка {n}: ожидается значений {width}, получено {len(record)}.')
+        row = record if positions is None else ['' if i is None else record[i] for i in positions]
+        for (name, col_type, exact), value in zip(checks, row):
+            if col_type == 'str':
+                continue
+            if value == '':
+                raise ValueError(f'Строка {n}: пустое значение в колонке {name} типа {col_type}.')
+            try:
+                convert(col_type, value, exact)
+            except ValueError:
+                raise ValueError(f"Строка {n}: значение '{value}' не приводится к типу {col_type} колонки {name}.")
+        yield row
+
+
+def _link_next(table_dir: str, tmp_file: str):
+    """
+    Публикует сегмент под следующим свободным номером. os.link не заменяет
+    существующий файл, поэтому два писателя не займут один номер.
+    """
+    segments_dir = os.path.join(table_dir, SEGMENTS_DIR)
+    files = segment_files(table_dir)
+    number = int(os.path.basename(files[-1])[:-len(SEGMENT_EXT)]) + 1 if files else 1
+    while True:
+        try:
+            os.link(tmp_file, os.path.join(segments_dir, f'{number:08d}{SEGMENT_EXT}'))
+            break
+        except FileExistsError:
+            number += 1
+    _sync_dir(segments_dir)
+
+
+def _sync_dir(path: str):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # Windows не открывает каталоги, там запись каталога и так надёжна
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)